@@ -11,13 +11,25 @@ from blueprints.login import login_bp
 from blueprints.stages import stages_bp
 from blueprints.dashboard import dashboard_bp
 from blueprints.workflow import workflow_bp
+from blueprints.metrics import metrics_bp
+from blueprints.events import events_bp
+from blueprints.firestore_metrics import RESPONSE_HEADERS, TIME_HEADER, finish_request as record_firestore_usage
+from blueprints import machine_mirror, request_metrics, request_traces
+import logging
 import os
 from blueprints.firebase_config import initialize_firebase
+from blueprints.logging_config import configure_logging
 from flask_cors import CORS
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Logging goes through a background queue listener; configure it before anything logs
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Anonymized request traces for scripts/replay_traces.py, only when TRACE_LOG_PATH is set
+request_traces.configure_tracing()
 
 # Create Flask application
 app = Flask(__name__)
@@ -36,10 +48,33 @@ app.register_blueprint(machines_bp)
 app.register_blueprint(users_bp)
 app.register_blueprint(stages_bp)
 app.register_blueprint(workflow_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(events_bp)
 # main_bp = Blueprint('main', __name__)
 
 # Configure CORS to allow requests from Firebase frontend
-CORS(app, origins=['https://isolab-support.firebaseapp.com'], supports_credentials=True)
+CORS(app, origins=['https://isolab-support.firebaseapp.com'], supports_credentials=True,
+     expose_headers=list(RESPONSE_HEADERS.values()) + [TIME_HEADER])
+
+@app.before_request
+def start_request_timer():
+    """Start timing the request for the latency histograms"""
+    request_metrics.start_request()
+
+@app.after_request
+def add_firestore_usage(response):
+    """Report the request's Firestore operations in response headers and /metrics"""
+    return record_firestore_usage(response)
+
+@app.after_request
+def record_request_latency(response):
+    """Record the request latency per endpoint and log slow requests"""
+    return request_metrics.finish_request(response)
+
+@app.after_request
+def record_request_trace(response):
+    """Append the request to the trace log when tracing is enabled"""
+    return request_traces.finish_request(response)
 
 # Set template and static folders to match your current structure
 app.template_folder = 'static/templates'
@@ -49,13 +84,13 @@ app.config['DEBUG'] = os.environ.get('Flask_DEBUG')
 # Initialize Firebase
 
 firebase_initialized = initialize_firebase()
-if firebase_initialized:
-    print("Firebase successfully initialized")
+if not firebase_initialized:
+    logger.warning("Firebase initialization failed - some features may not work. "
+                   "Check FIREBASE_SETUP.md for configuration instructions")
 else:
-    print("Firebase initialization failed - some features may not work")
-    print("Check FIREBASE_SETUP.md for configuration instructions")
+    # Optional in-memory replica of the machines collection (MACHINE_MIRROR=1)
+    machine_mirror.start_mirror()
 
-    
 
 
 # Frontend URL configuration
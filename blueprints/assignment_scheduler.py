@@ -0,0 +1,163 @@
+"""
+Assignee scheduler
+Picks the user who gets a machine entering a stage from a live workload index
+(stats/workloads: open assignments and estimated hours per user), which is
+updated with increments in the same write as each assignment
+"""
+
+from datetime import datetime
+import logging
+import os
+from firebase_admin import firestore
+from . import reference_cache
+from .machine_stats import STATS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+WORKLOADS_DOC = 'workloads'
+
+# least_loaded: fewest open estimated hours; weighted: fewest hours relative to the
+# user's assignment_weight; round_robin: each active user of the role in turn
+POLICIES = ('least_loaded', 'weighted', 'round_robin')
+ASSIGNMENT_POLICY = os.environ.get('ASSIGNMENT_POLICY', 'least_loaded')
+if ASSIGNMENT_POLICY not in POLICIES:
+    logger.warning("Unknown ASSIGNMENT_POLICY %r, using least_loaded", ASSIGNMENT_POLICY)
+    ASSIGNMENT_POLICY = 'least_loaded'
+
+# User field scaling the share of work of the weighted policy (default 1)
+WEIGHT_FIELD = 'assignment_weight'
+
+# Machine field holding the estimated hours of its open assignment, so the index is
+# decremented by what was added even if the stage estimate is edited meanwhile
+ASSIGNED_HOURS_FIELD = 'assigned_hours'
+
+
+def get_workloads_ref(db):
+    """Get the reference of the workload index document"""
+    return db.collection(STATS_COLLECTION).document(WORKLOADS_DOC)
+
+
+def stage_hours(stage_def):
+    """Estimated hours of an assignment to a stage (stored in ASSIGNED_HOURS_FIELD)"""
+    return (stage_def or {}).get('estimated_duration_hours') or 0
+
+
+def open_assignment(machine_data, get_stage=reference_cache.get_stage):
+    """(user id, estimated hours) of a machine's open assignment, or None.
+    Machines assigned before the hours were stored count their stage's estimate."""
+    if not machine_data or machine_data.get('status') == 'Completed':
+        return None
+    user_id = machine_data.get('assigned_user_id')
+    current_stage = machine_data.get('current_stage')
+    if not user_id or not current_stage:
+        return None
+    hours = machine_data.get(ASSIGNED_HOURS_FIELD)
+    if hours is None:
+        hours = stage_hours(get_stage(current_stage))
+    return user_id, hours
+
+
+def compute_workload_delta(old_data, new_data):
+    """Compute {user id: (assignments, hours)} changes for a machine going from
+    old_data to new_data. Either side may be None for a create or a delete."""
+    changes = {}
+    for machine_data, sign in ((old_data, -1), (new_data, 1)):
+        assignment = open_assignment(machine_data)
+        if assignment is None:
+            continue
+        user_id, hours = assignment
+        assignments, total_hours = changes.get(user_id, (0, 0))
+        changes[user_id] = (assignments + sign, total_hours + sign * hours)
+    return {user_id: change for user_id, change in changes.items() if change != (0, 0)}
+
+
+def add_workload_update(batch, db, old_data, new_data, rotated_role=None):
+    """Add the workload increments for a machine write to a batch or transaction.
+    rotated_role advances that role's round-robin position (pass it whenever a
+    user of the role was chosen). Returns False when nothing changes."""
+    changes = compute_workload_delta(old_data, new_data)
+    if not changes and not rotated_role:
+        return False
+
+    update = {'updated_at': datetime.now()}
+    if changes:
+        update['users'] = {
+            user_id: {
+                'open_assignments': firestore.Increment(assignments),
+                'open_hours': firestore.Increment(hours),
+            }
+            for user_id, (assignments, hours) in changes.items()
+        }
+    if rotated_role:
+        update['rotations'] = {rotated_role: firestore.Increment(1)}
+    batch.set(get_workloads_ref(db), update, merge=True)
+    return True
+
+
+def build_workloads(machines, get_stage=reference_cache.get_stage):
+    """Per-user workload of an iterable of machine data"""
+    users = {}
+    for machine_data in machines:
+        assignment = open_assignment(machine_data, get_stage)
+        if assignment is None:
+            continue
+        user_id, hours = assignment
+        workload = users.setdefault(user_id, {'open_assignments': 0, 'open_hours': 0})
+        workload['open_assignments'] += 1
+        workload['open_hours'] += hours
+    return users
+
+
+def recompute_workloads(db):
+    """Rebuild the workload index from the machines in progress, keeping the rotations"""
+    workloads_ref = get_workloads_ref(db)
+    existing = workloads_ref.get()
+    existing = existing.to_dict() if existing.exists else {}
+
+    machines = db.collection('machines').where('status', '==', 'En cours').stream()
+    workloads = {
+        'users': build_workloads(doc.to_dict() for doc in machines),
+        'rotations': existing.get('rotations', {}),
+    }
+    workloads['updated_at'] = datetime.now()
+    workloads['recomputed_at'] = workloads['updated_at']
+    workloads_ref.set(workloads)
+    return workloads
+
+
+def get_workloads(db):
+    """Read the workload index; a missing index counts as empty.
+    It is never rebuilt here: a full scan on a request path would be slow, and its
+    set() would overwrite the increments of concurrent assignments. Admins rebuild
+    it with POST /machines/statistics/recompute."""
+    workloads_doc = get_workloads_ref(db).get()
+    if not workloads_doc.exists:
+        return {'users': {}, 'rotations': {}}
+    return workloads_doc.to_dict()
+
+
+def user_workload(workloads, user_id):
+    """(open assignments, open hours) of a user in the index"""
+    workload = workloads.get('users', {}).get(user_id) or {}
+    return workload.get('open_assignments', 0), round(workload.get('open_hours', 0), 2)
+
+
+def choose_assignee(role, workloads, policy=None):
+    """Active user of a role who gets the next assignment, or None when the role has nobody"""
+    candidates = sorted(reference_cache.get_active_users(role=role), key=lambda user: user['id'])
+    if not candidates:
+        return None
+    policy = policy or ASSIGNMENT_POLICY
+
+    if policy == 'round_robin':
+        position = workloads.get('rotations', {}).get(role, 0)
+        return candidates[int(position) % len(candidates)]
+
+    def load(user):
+        assignments, hours = user_workload(workloads, user['id'])
+        if policy == 'weighted':
+            weight = user.get(WEIGHT_FIELD) or 1
+            return hours / weight, assignments / weight, user['id']
+        return hours, assignments, user['id']
+
+    return min(candidates, key=load)
@@ -5,8 +5,11 @@ Handles only Create, Read, Update, Delete operations for clients
 
 from flask import Blueprint, request, jsonify, session, render_template, redirect, url_for
 from datetime import datetime
+import logging
 from .firebase_config import get_db, is_firebase_available
 
+logger = logging.getLogger(__name__)
+
 # Create clients blueprint
 clients_bp = Blueprint('clients', __name__, url_prefix='/clients')
 
@@ -24,6 +27,15 @@ def clients_page():
     
     return redirect(f'{FRONTEND_URL}/clients.html')
 
+def list_clients(db):
+    """List all clients with their document ids"""
+    clients = []
+    for doc in db.collection('clients').stream():
+        client_data = doc.to_dict()
+        client_data['id'] = doc.id
+        clients.append(client_data)
+    return clients
+
 @clients_bp.route('/all', methods=['GET'])
 def get_clients():
     """Read - Get all clients"""
@@ -33,22 +45,14 @@ def get_clients():
     if session.get('role') != 'admin':
         return jsonify({"error": "Access denied. Admin role required."}), 403
     
-    print("Fetching all clients...")
     try:
         db = get_db()
         if not is_firebase_available():
-            print("Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
 
-        clients_ref = db.collection('clients')
-        docs = clients_ref.stream()
-
-        clients = []
-        for doc in docs:
-            client_data = doc.to_dict()
-            client_data['id'] = doc.id
-            clients.append(client_data)
+        clients = list_clients(db)
         return jsonify({"clients": clients})
         
     except Exception as e:
@@ -69,7 +73,6 @@ def create_client():
             return jsonify({"error": "Database not available"}), 500
             
         data = request.get_json()
-        print(f"Received client data: {data}")
         
         # Basic validation - match the database structure exactly
         required_fields = ['clientName', 'clientSociety', 'clientPhone', 'clientAddress']
@@ -90,8 +93,6 @@ def create_client():
             'is_active': True
         }
         
-        print(f"Saving client data: {client_data}")
-        
         # Add to Firestore
         doc_ref = db.collection('clients').add(client_data)
         client_id = doc_ref[1].id
@@ -99,7 +100,7 @@ def create_client():
         return jsonify({"message": "Client created successfully", "id": client_id}), 201
         
     except Exception as e:
-        print(f"Error creating client: {str(e)}")
+        logger.exception("Error creating client")
         return jsonify({"error": str(e)}), 500
 
 @clients_bp.route('/<client_id>', methods=['GET'])
@@ -1,21 +1,94 @@
 """
 Dashboard Blueprint
-Handles rendering the dashboard page after login
+Handles rendering the dashboard page after login and the single-request
+bootstrap endpoint that loads every dashboard section at once
 """
 
-from flask import Blueprint, render_template, session, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from .firebase_config import get_db, is_firebase_available
+from .machines import list_visible_machines
+from .stages import build_dashboard_data, list_my_tasks, list_recent_activities
+from .clients import list_clients
+from .users import get_user_profile
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/')
 
 # Frontend URL configuration
 FRONTEND_URL = 'https://isolab-support.firebaseapp.com/'
 
+# Sections served by /dashboard/bootstrap (each mirrors an existing endpoint)
+BOOTSTRAP_SECTIONS = ['user', 'dashboard', 'machines', 'clients', 'tasks', 'activities']
+
 @dashboard_bp.route('/dashboard', methods=['GET'])
 def dashboard():
     # Require login
-    print("Dashboard endpoint called")
     if 'user_id' not in session:
-        print("User not logged in, redirecting to home")
         return redirect(f'{FRONTEND_URL}/login.html')
-    print("User logged in, redirecting to dashboard")
     return redirect(f'{FRONTEND_URL}/dashboard.html')
+
+@dashboard_bp.route('/dashboard/bootstrap', methods=['GET'])
+def dashboard_bootstrap():
+    """Load the dashboard sections in one request.
+    ?sections=user,dashboard,machines,clients,tasks,activities (default: all).
+    Sections share the documents they read: tasks and activities reuse the
+    machines section when both are requested."""
+    try:
+        db = get_db()
+        if not is_firebase_available():
+            return jsonify({"error": "Database not available"}), 500
+
+        # Check if user is logged in (once for every section)
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+
+        user_id = session.get('user_id')
+        user_role = session.get('role', '')
+        stage_access = session.get('stage_access', '')
+
+        requested = request.args.get('sections')
+        if requested:
+            sections = [section.strip() for section in requested.split(',') if section.strip()]
+            unknown = [section for section in sections if section not in BOOTSTRAP_SECTIONS]
+            if unknown:
+                return jsonify({"error": f"Unknown sections: {unknown}. Must be among: {BOOTSTRAP_SECTIONS}"}), 400
+        else:
+            sections = BOOTSTRAP_SECTIONS
+
+        response = {}
+        errors = {}
+
+        if 'user' in sections:
+            user_data = get_user_profile(db, user_id)
+            if user_data is None:
+                session.clear()
+                return jsonify({"error": "User not found"}), 404
+            response['user'] = user_data
+
+        if 'dashboard' in sections:
+            response['dashboard'] = build_dashboard_data(db, user_id, user_role)
+
+        machines = None
+        if 'machines' in sections:
+            machines, _, _ = list_visible_machines(db, user_id, user_role, stage_access)
+            response['machines'] = {"data": machines}
+
+        if 'clients' in sections:
+            if user_role == 'admin':
+                response['clients'] = list_clients(db)
+            else:
+                errors['clients'] = "Access denied. Admin role required."
+
+        if 'tasks' in sections:
+            response['tasks'] = list_my_tasks(db, user_id, user_role, machines)
+
+        if 'activities' in sections:
+            machines_by_id = {machine['id']: machine for machine in machines or []}
+            response['activities'] = list_recent_activities(db, user_id, user_role, machines_by_id)
+
+        if errors:
+            response['errors'] = errors
+
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,801 @@
+"""
+Firestore-compatible document store
+Implements the part of the Firestore client API the blueprints use (collections,
+documents, queries, write batches, transactions, count aggregations, get_all) on top of a
+pluggable storage engine, so the app runs without a Firebase project.
+
+An engine stores plain dicts per collection path and implements:
+    get(collection, doc_id) -> dict or None
+    put(collection, doc_id, data) / delete(collection, doc_id)
+    candidates(collection, filters, orders=(), limit=None, start=None) -> [(doc_id, data)],
+        a superset of the documents matching the (field, op, value) filters; an engine
+        that applies every filter exactly may also return only the first `limit`
+        documents in `orders` from the start cursor ([values], inclusive)
+    document_ids(collection) / collection_names()
+    atomic() -> context manager making a group of writes atomic
+    snapshot() -> context manager giving a consistent view for one query
+Engines whose data other processes also write set shared_between_processes,
+which disables on_snapshot listeners (they would only see local writes).
+"""
+
+import heapq
+import logging
+import queue
+import random
+import string
+import threading
+from datetime import datetime, timezone
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1 import GeoPoint, transforms
+from google.cloud.firestore_v1.aggregation import AggregationResult
+from google.cloud.firestore_v1.base_query import And, FieldFilter, Or
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_ID = '__name__'
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+
+# Operators an engine may answer from an index (the query re-checks every filter)
+INDEXABLE_OPERATORS = ('==', 'in', 'array_contains')
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+
+AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+_MISSING = object()
+
+
+def utc_now():
+    """Current time as an aware UTC datetime, like Firestore server timestamps"""
+    return datetime.now(timezone.utc)
+
+
+def auto_id():
+    """Generate a 20 character document id like Firestore's add()"""
+    return ''.join(random.choice(AUTO_ID_CHARS) for _ in range(20))
+
+
+def normalize_value(value):
+    """Copy a value into its stored form: naive datetimes are taken as UTC
+    (as the Firestore client does), tuples become lists"""
+    if isinstance(value, dict):
+        return {key: normalize_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(item) for item in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    if isinstance(value, StoreDocumentReference):
+        return value
+    return value
+
+
+def copy_value(value):
+    """Copy the mutable containers of a stored value (leaves are immutable)"""
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def value_key(value):
+    """Hashable sort key following Firestore's cross-type value ordering"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, StoreDocumentReference):
+        return (6, value.path)
+    if isinstance(value, GeoPoint):
+        return (7, (value.latitude, value.longitude))
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(value_key(item) for item in value))
+    if isinstance(value, dict):
+        return (9, tuple(sorted((key, value_key(item)) for key, item in value.items())))
+    return (10, repr(value))
+
+
+def get_field(data, field_path):
+    """Read a dotted field path from document data (_MISSING when absent)"""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def matches_filter(doc_id, data, field_path, op, value):
+    """Evaluate one Firestore filter against a document"""
+    if field_path == DOCUMENT_ID:
+        actual = doc_id
+        value = [document_id_of(item) for item in value] if op in ('in', 'not-in') else document_id_of(value)
+    else:
+        actual = get_field(data, field_path)
+    if actual is _MISSING:
+        return False
+
+    if op == '==':
+        return value_key(actual) == value_key(value)
+    if op == '!=':
+        return actual is not None and value_key(actual) != value_key(value)
+    if op in RANGE_OPERATORS:
+        actual_key = value_key(actual)
+        expected_key = value_key(value)
+        if actual_key[0] != expected_key[0]:
+            return False
+        if op == '<':
+            return actual_key < expected_key
+        if op == '<=':
+            return actual_key <= expected_key
+        if op == '>':
+            return actual_key > expected_key
+        return actual_key >= expected_key
+    if op == 'in':
+        return value_key(actual) in {value_key(item) for item in value}
+    if op == 'not-in':
+        return actual is not None and value_key(actual) not in {value_key(item) for item in value}
+    if op == 'array_contains':
+        return isinstance(actual, list) and value_key(value) in {value_key(item) for item in actual}
+    if op == 'array_contains_any':
+        if not isinstance(actual, list):
+            return False
+        wanted = {value_key(item) for item in value}
+        return any(value_key(item) in wanted for item in actual)
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def document_id_of(value):
+    """Get a document id from an id, a path or a document reference"""
+    if isinstance(value, StoreDocumentReference):
+        return value.id
+    if isinstance(value, str) and '/' in value:
+        return value.rsplit('/', 1)[1]
+    return value
+
+
+def split_path(path):
+    """Split a document path into (collection path, document id)"""
+    collection_path, _, doc_id = path.rpartition('/')
+    return collection_path, doc_id
+
+
+def apply_write(existing, data, merge=False, update=False):
+    """Build the new document data for a set/update, applying field transforms.
+    update uses dotted field paths; merge deep-merges nested maps."""
+    if update:
+        result = copy_value(existing) if existing is not None else {}
+        for field_path, value in data.items():
+            _apply_field(result, field_path.split('.'), value)
+        return result
+
+    if merge and existing is not None:
+        result = copy_value(existing)
+        if isinstance(merge, (list, tuple)):
+            for field_path in merge:
+                value = get_field(data, field_path)
+                if value is not _MISSING:
+                    _apply_field(result, field_path.split('.'), value)
+            return result
+        _merge_into(result, data)
+        return result
+
+    result = {}
+    _merge_into(result, data)
+    return result
+
+
+def _merge_into(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and value and not isinstance(target.get(key), dict):
+            target[key] = {}
+        if isinstance(value, dict) and value:
+            _merge_into(target[key], value)
+        else:
+            _apply_field(target, [key], value)
+
+
+def _apply_field(target, parts, value):
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    key = parts[-1]
+    current = target.get(key, _MISSING)
+
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[key] = utc_now()
+    elif isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        target[key] = base + value.value
+    elif isinstance(value, transforms.Maximum):
+        target[key] = value.value if current is _MISSING or not isinstance(current, (int, float)) else max(current, value.value)
+    elif isinstance(value, transforms.Minimum):
+        target[key] = value.value if current is _MISSING or not isinstance(current, (int, float)) else min(current, value.value)
+    elif isinstance(value, transforms.ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        present = {value_key(item) for item in items}
+        for item in value.values:
+            if value_key(item) not in present:
+                items.append(normalize_value(item))
+                present.add(value_key(item))
+        target[key] = items
+    elif isinstance(value, transforms.ArrayRemove):
+        removed = {value_key(item) for item in value.values}
+        items = list(current) if isinstance(current, list) else []
+        target[key] = [item for item in items if value_key(item) not in removed]
+    else:
+        target[key] = normalize_value(value)
+
+
+class _Descending:
+    """Sort key wrapper inverting the order of a value key"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+class StoreDocumentSnapshot:
+    """Result of reading a document"""
+
+    def __init__(self, reference, data, read_time):
+        self.reference = reference
+        self._data = data
+        self.read_time = read_time
+        self.update_time = read_time if data is not None else None
+        self.create_time = None
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy_value(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy_value(value)
+
+
+class StoreDocumentReference:
+    """Reference to one document of a collection"""
+
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self):
+        return StoreCollection(self._client, self._collection_path)
+
+    def __eq__(self, other):
+        return isinstance(other, StoreDocumentReference) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<StoreDocumentReference {self.path}>"
+
+    def collection(self, collection_id):
+        return StoreCollection(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        data = self._client.engine.get(self._collection_path, self.id)
+        if data is not None and field_paths:
+            data = _project(data, field_paths)
+        return StoreDocumentSnapshot(self, copy_value(data), utc_now())
+
+    def create(self, document_data):
+        return self._client._write([('create', self, document_data, None)])[0]
+
+    def set(self, document_data, merge=False):
+        return self._client._write([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates, option=None):
+        return self._client._write([('update', self, field_updates, None)])[0]
+
+    def delete(self, option=None):
+        return self._client._write([('delete', self, None, None)])[0]
+
+
+class WriteResult:
+    """Outcome of one committed write"""
+
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class StoreQuery:
+    """Immutable query over one collection"""
+
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None,
+                 limit_to_last=False, offset=0, projection=None, start=None, end=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._offset = offset
+        self._projection = projection
+        self._start = start
+        self._end = end
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders, 'limit': self._limit,
+            'limit_to_last': self._limit_to_last, 'offset': self._offset,
+            'projection': self._projection, 'start': self._start, 'end': self._end,
+        }
+        state.update(changes)
+        return StoreQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is None:
+            filter = FieldFilter(field_path, op_string, value)
+        return self._copy(filters=self._filters + (filter,))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        if direction not in (ASCENDING, DESCENDING):
+            raise ValueError(f"Invalid direction: {direction}")
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def count(self, alias=None):
+        return StoreAggregationQuery(self, alias or 'field_1')
+
+    def on_snapshot(self, callback):
+        """Listen to the documents matching the query's filters: the first snapshot holds
+        the query results, later ones each committed change that enters, stays in or
+        leaves the result set. Orders and limits only apply to the first snapshot."""
+        return self._client._watch(self._collection_path, callback, query=self)
+
+    def _flat_filters(self):
+        """Field filters that must all hold (None when an Or filter is present)"""
+        flat = []
+        pending = list(self._filters)
+        while pending:
+            current = pending.pop(0)
+            if isinstance(current, Or):
+                return None
+            if isinstance(current, And):
+                pending.extend(current.filters)
+            else:
+                flat.append((current.field_path, current.op_string, current.value))
+        return flat
+
+    def _matches(self, doc_id, data, query_filter):
+        if isinstance(query_filter, Or):
+            return any(self._matches(doc_id, data, item) for item in query_filter.filters)
+        if isinstance(query_filter, And):
+            return all(self._matches(doc_id, data, item) for item in query_filter.filters)
+        return matches_filter(doc_id, data, query_filter.field_path, query_filter.op_string, query_filter.value)
+
+    def _effective_orders(self):
+        """Explicit orders, plus Firestore's implicit inequality and document id orders"""
+        orders = list(self._orders)
+        if not orders:
+            flat = self._flat_filters() or []
+            for field_path, op, _ in flat:
+                if op in RANGE_OPERATORS + ('!=', 'not-in'):
+                    orders.append((field_path, ASCENDING))
+                    break
+        if not any(field_path == DOCUMENT_ID for field_path, _ in orders):
+            direction = orders[-1][1] if orders else ASCENDING
+            orders.append((DOCUMENT_ID, direction))
+        return orders
+
+    def _sort_key(self, orders, doc_id, data):
+        key = []
+        for field_path, direction in orders:
+            value = doc_id if field_path == DOCUMENT_ID else get_field(data, field_path)
+            item = value_key(value)
+            key.append(item if direction == ASCENDING else _Descending(item))
+        return tuple(key)
+
+    def _cursor_values(self, orders, cursor):
+        """Cursor values in the order of the orders (a prefix of them)"""
+        values, _ = cursor
+        if isinstance(values, StoreDocumentSnapshot):
+            snapshot = values
+            return [snapshot.id if field_path == DOCUMENT_ID else snapshot.get(field_path)
+                    for field_path, _ in orders]
+        if isinstance(values, dict):
+            return [values[field_path] for field_path, _ in orders if field_path in values]
+        return list(values)
+
+    def _cursor_key(self, orders, cursor):
+        values = self._cursor_values(orders, cursor)
+        key = []
+        for (field_path, direction), value in zip(orders, values):
+            if field_path == DOCUMENT_ID:
+                value = document_id_of(value)
+            item = value_key(normalize_value(value))
+            key.append(item if direction == ASCENDING else _Descending(item))
+        return tuple(key)
+
+    def _execute(self):
+        """Run the query against the engine and return [(doc_id, data)]"""
+        flat = self._flat_filters()
+        orders = self._effective_orders()
+        engine = self._client.engine
+
+        # The engine may stop at the first offset + limit documents after the start cursor
+        hints = {}
+        if flat is not None and self._limit is not None and not self._limit_to_last:
+            hints = {'orders': orders, 'limit': self._offset + self._limit}
+            if self._start is not None:
+                hints['start'] = (self._cursor_values(orders, self._start), self._start[1])
+
+        with engine.snapshot():
+            candidates = engine.candidates(self._collection_path, flat or [], **hints)
+            rows = []
+            for doc_id, data in candidates:
+                if all(self._matches(doc_id, data, query_filter) for query_filter in self._filters):
+                    # Ordering on a field excludes documents without it
+                    if all(field_path == DOCUMENT_ID or get_field(data, field_path) is not _MISSING
+                           for field_path, _ in orders):
+                        rows.append((self._sort_key(orders, doc_id, data), doc_id, data))
+
+        if self._start is not None:
+            start_key = self._cursor_key(orders, self._start)
+            inclusive = self._start[1]
+            rows = [row for row in rows
+                    if row[0][:len(start_key)] > start_key or (inclusive and row[0][:len(start_key)] == start_key)]
+        if self._end is not None:
+            end_key = self._cursor_key(orders, self._end)
+            inclusive = self._end[1]
+            rows = [row for row in rows
+                    if row[0][:len(end_key)] < end_key or (inclusive and row[0][:len(end_key)] == end_key)]
+
+        if self._limit is not None and not self._limit_to_last:
+            rows = heapq.nsmallest(self._offset + self._limit, rows, key=lambda row: row[0])
+        else:
+            rows.sort(key=lambda row: row[0])
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[-self._limit:] if self._limit_to_last else rows[:self._limit]
+            if self._limit == 0:
+                rows = []
+        return [(doc_id, data) for _, doc_id, data in rows]
+
+    def stream(self, transaction=None, **kwargs):
+        read_time = utc_now()
+        for doc_id, data in self._execute():
+            if self._projection is not None:
+                data = _project(data, self._projection)
+            reference = StoreDocumentReference(self._client, self._collection_path, doc_id)
+            yield StoreDocumentSnapshot(reference, copy_value(data), read_time)
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+
+class StoreCollection(StoreQuery):
+    """Collection reference; also the unfiltered query over the collection"""
+
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        if '/' not in self._collection_path:
+            return None
+        collection_path, doc_id = split_path(self._collection_path.rsplit('/', 1)[0])
+        return StoreDocumentReference(self._client, collection_path, doc_id)
+
+    def document(self, document_id=None):
+        return StoreDocumentReference(self._client, self._collection_path, document_id or auto_id())
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def list_documents(self, page_size=None):
+        for doc_id in self._client.engine.document_ids(self._collection_path):
+            yield StoreDocumentReference(self._client, self._collection_path, doc_id)
+
+    def on_snapshot(self, callback):
+        """Listen to the collection like Firestore: callback(docs, changes, read_time) runs
+        on a background thread, first with every document ADDED, then after each commit.
+        Unlike Firestore, docs holds only the documents of the change set."""
+        return self._client._watch(self._collection_path, callback)
+
+
+class StoreWatch:
+    """Collection listener delivering change sets in commit order"""
+
+    def __init__(self, client, collection_path, callback, query=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._callback = callback
+        self._query = query
+        # Ids currently in the result set of a query listener
+        self._members = set()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=f'watch-{collection_path}', daemon=True)
+        self.is_active = True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            changes, read_time = item
+            try:
+                self._callback([change.document for change in changes], changes, read_time)
+            except Exception:
+                logger.exception("on_snapshot callback failed for %s", self._collection_path)
+
+    def _push(self, entries, read_time):
+        """Queue (doc_id, data or None, existed) entries as one change set"""
+        changes = []
+        for doc_id, data, existed in entries:
+            if self._query is not None:
+                if data is not None and not all(self._query._matches(doc_id, data, query_filter)
+                                                for query_filter in self._query._filters):
+                    data = None
+                existed = doc_id in self._members
+                if data is None and not existed:
+                    continue
+                if data is None:
+                    self._members.discard(doc_id)
+                else:
+                    self._members.add(doc_id)
+            reference = StoreDocumentReference(self._client, self._collection_path, doc_id)
+            if data is None:
+                change_type = ChangeType.REMOVED
+                snapshot = StoreDocumentSnapshot(reference, None, read_time)
+            else:
+                change_type = ChangeType.MODIFIED if existed else ChangeType.ADDED
+                snapshot = StoreDocumentSnapshot(reference, copy_value(data), read_time)
+            changes.append(DocumentChange(change_type, snapshot, -1, -1))
+        if changes:
+            self._queue.put((changes, read_time))
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._unwatch(self)
+        self._queue.put(None)
+
+
+class StoreAggregationQuery:
+    """count() aggregation over a query"""
+
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None, **kwargs):
+        value = len(self._query._execute())
+        return [[AggregationResult(alias=self._alias, value=value, read_time=utc_now())]]
+
+    def stream(self, transaction=None, **kwargs):
+        yield from self.get(transaction=transaction)
+
+
+class StoreWriteBatch:
+    """Write batch applied atomically on commit"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, None))
+        return self
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+        return self
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, None))
+        return self
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, None))
+        return self
+
+    def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return self._client._write(writes)
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class StoreTransaction(StoreWriteBatch):
+    """Transaction: run() holds the client's write lock from the first read to
+    the commit, so concurrent transactions are serialized instead of retried"""
+
+    def __init__(self, client, max_attempts=None, read_only=False):
+        super().__init__(client)
+        self.read_only = read_only
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, StoreDocumentReference):
+            return iter([ref_or_query.get(**kwargs)])
+        return ref_or_query.stream()
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references, **kwargs)
+
+    def run(self, function):
+        """Call function(transaction) and commit its writes atomically"""
+        with self._client._write_lock, self._client.engine.atomic():
+            self._writes = []
+            result = function(self)
+            self.commit()
+        return result
+
+
+class DocumentStoreClient:
+    """Drop-in replacement for firestore.Client backed by a storage engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._write_lock = threading.RLock()
+        # collection path -> active StoreWatch listeners
+        self._watches = {}
+
+    def collection(self, collection_path):
+        return StoreCollection(self, collection_path)
+
+    def document(self, document_path):
+        collection_path, doc_id = split_path(document_path)
+        return StoreDocumentReference(self, collection_path, doc_id)
+
+    def collections(self):
+        return [StoreCollection(self, name) for name in self.engine.collection_names()]
+
+    def batch(self):
+        return StoreWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return StoreTransaction(self, **kwargs)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield reference.get(field_paths=field_paths)
+
+    def _write(self, writes):
+        """Apply (kind, reference, data, merge) writes as one atomic group"""
+        update_time = utc_now()
+        with self._write_lock, self.engine.atomic():
+            staged = {}
+            existed = {}
+            for kind, reference, data, merge in writes:
+                key = (reference._collection_path, reference.id)
+                existing = staged[key] if key in staged else self.engine.get(*key)
+                if kind == 'create':
+                    if existing is not None:
+                        raise AlreadyExists(f"Document already exists: {reference.path}")
+                    staged[key] = apply_write(None, data)
+                elif kind == 'set':
+                    staged[key] = apply_write(existing, data, merge=merge)
+                elif kind == 'update':
+                    if existing is None:
+                        raise NotFound(f"No document to update: {reference.path}")
+                    staged[key] = apply_write(existing, data, update=True)
+                else:
+                    staged[key] = None
+                existed.setdefault(key, existing is not None)
+            for (collection_path, doc_id), data in staged.items():
+                if data is None:
+                    self.engine.delete(collection_path, doc_id)
+                else:
+                    self.engine.put(collection_path, doc_id, data)
+            if self._watches:
+                # Queued while the write lock is held, so listeners see commits in order
+                self._notify(staged, existed, update_time)
+        return [WriteResult(update_time) for _ in writes]
+
+    def _notify(self, staged, existed, update_time):
+        entries = {}
+        for (collection_path, doc_id), data in staged.items():
+            if data is None and not existed[(collection_path, doc_id)]:
+                continue
+            entries.setdefault(collection_path, []).append((doc_id, data, existed[(collection_path, doc_id)]))
+        for collection_path, collection_entries in entries.items():
+            for watch in self._watches.get(collection_path, ()):
+                watch._push(collection_entries, update_time)
+
+    def _watch(self, collection_path, callback, query=None):
+        if getattr(self.engine, 'shared_between_processes', False):
+            raise NotImplementedError(
+                f"{type(self.engine).__name__} is shared between processes; listeners would miss other workers' writes"
+            )
+        watch = StoreWatch(self, collection_path, callback, query)
+        with self._write_lock:
+            if query is not None:
+                initial = [(doc_id, data, False) for doc_id, data in query._execute()]
+            else:
+                with self.engine.snapshot():
+                    initial = [(doc_id, data, False) for doc_id, data in self.engine.candidates(collection_path, [])]
+            watch._push(initial, utc_now())
+            if not initial:
+                # Firestore reports an empty collection with an empty first snapshot
+                watch._queue.put(([], utc_now()))
+            self._watches.setdefault(collection_path, []).append(watch)
+        watch._thread.start()
+        return watch
+
+    def _unwatch(self, watch):
+        with self._write_lock:
+            watches = self._watches.get(watch._collection_path, [])
+            if watch in watches:
+                watches.remove(watch)
+
+
+def _project(data, field_paths):
+    """Keep only the selected field paths of document data"""
+    projected = {}
+    for field_path in field_paths:
+        value = get_field(data, field_path)
+        if value is not _MISSING:
+            _apply_field(projected, field_path.split('.'), copy_value(value))
+    return projected
@@ -0,0 +1,327 @@
+"""
+Live change events
+Write paths add a compact event document to machine_events in the same batch as
+the change; every worker relays new events to its Server-Sent Events streams
+(GET /events/stream), filtered by each user's role, stage and assignments
+"""
+
+from flask import Blueprint, Response, jsonify, request, session
+from datetime import datetime, timedelta, timezone
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP, Query
+from google.cloud.firestore_v1.base_query import FieldFilter
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from .firebase_config import get_db, is_firebase_available
+
+logger = logging.getLogger(__name__)
+
+events_bp = Blueprint('events', __name__, url_prefix='/events')
+
+EVENTS_COLLECTION = 'machine_events'
+
+# Events are only useful to reconnecting streams for a while; a Firestore TTL
+# policy on expire_at deletes them afterwards
+EVENT_TTL = timedelta(hours=24)
+
+# Streams are closed after this long and the browser reconnects (with
+# Last-Event-ID), so a stream never outlives the request timeout
+STREAM_MAX_SECONDS = int(os.environ.get('EVENT_STREAM_MAX_SECONDS', '300'))
+
+# gunicorn threads per worker (must match --threads). Each open stream holds one
+# of them, so by default streams may take half and the rest serve other requests
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', '16'))
+MAX_STREAMS = int(os.environ.get('EVENT_STREAM_MAX_CONNECTIONS', str(max(1, WORKER_THREADS // 2))))
+if MAX_STREAMS >= WORKER_THREADS:
+    logger.warning("EVENT_STREAM_MAX_CONNECTIONS=%d leaves no thread of the %d gunicorn threads for other requests",
+                   MAX_STREAMS, WORKER_THREADS)
+
+HEARTBEAT_SECONDS = 15
+RECONNECT_MILLISECONDS = 3000
+
+# Recent events kept per worker to resume reconnecting streams without a query
+RECENT_EVENTS = 1000
+BACKFILL_LIMIT = 200
+
+# Storage engines without listeners are polled at this interval
+POLL_SECONDS = 1.0
+
+# Machine fields copied into events so clients can patch their view without a read
+EVENT_FIELDS = (
+    'serialNumber', 'machineType', 'clientName', 'clientSociety', 'status', 'workflow_status',
+    'current_stage', 'current_stage_label', 'assigned_user_id', 'assigned_username',
+)
+
+# Event fields that are never sent to clients
+PRIVATE_FIELDS = ('audience', 'created_at', 'expire_at')
+
+
+def build_event(event_type, machine_id, old_data, new_data, **details):
+    """Event document for a machine change; old_data is None on create, new_data on delete"""
+    current = new_data if new_data is not None else old_data
+    event = {'type': event_type, 'machine_id': machine_id}
+    for field in EVENT_FIELDS:
+        if current.get(field) is not None:
+            event[field] = current[field]
+    event.update(details)
+
+    # Users and stages the machine belonged to before or after the change may see it
+    users = set()
+    stages = set()
+    for data in (old_data, new_data):
+        if not data:
+            continue
+        users.add(data.get('assigned_user_id'))
+        stages.add(data.get('current_stage'))
+        for stage in (data.get('workflow_instance') or {}).get('stages', []):
+            users.update(user.get('user_id') for user in stage.get('assigned_users', []))
+    users.discard(None)
+    stages.discard(None)
+    event['audience'] = {'users': sorted(users), 'stages': sorted(stages)}
+
+    event['created_at'] = SERVER_TIMESTAMP
+    event['expire_at'] = datetime.now(timezone.utc) + EVENT_TTL
+    return event
+
+
+def add_event(batch, db, event_type, machine_id, old_data, new_data, **details):
+    """Add a change event to a write batch so it commits together with the change"""
+    event = build_event(event_type, machine_id, old_data, new_data, **details)
+    batch.set(db.collection(EVENTS_COLLECTION).document(), event)
+
+
+def is_visible(event, user_id, user_role, stage_access):
+    """Same rule as the machine list: admins see everything, others their stage and assignments"""
+    if user_role == 'admin':
+        return True
+    audience = event.get('audience', {})
+    if user_id in audience.get('users', ()):
+        return True
+    return bool(stage_access) and stage_access != 'all' and stage_access in audience.get('stages', ())
+
+
+def event_key(event_id):
+    """Sort key of an event id ('<created ms>-<document id>'), None if malformed"""
+    created_ms, _, doc_id = (event_id or '').partition('-')
+    if not created_ms.isdigit() or not doc_id:
+        return None
+    return int(created_ms), doc_id
+
+
+def to_event(doc_id, data):
+    """Stored event document -> in-memory event with its stream id"""
+    created_at = data.get('created_at')
+    created_ms = int(created_at.timestamp() * 1000) if isinstance(created_at, datetime) else 0
+    event = dict(data)
+    event['id'] = f'{created_ms}-{doc_id}'
+    event['key'] = (created_ms, doc_id)
+    return event
+
+
+def format_event(event):
+    """Server-Sent Events frame of an event"""
+    payload = {key: value for key, value in event.items() if key not in PRIVATE_FIELDS and key != 'key'}
+    payload['at'] = datetime.fromtimestamp(event['key'][0] / 1000, timezone.utc).isoformat()
+    return f"id: {event['id']}\ndata: {json.dumps(payload, default=str, separators=(',', ':'))}\n\n"
+
+
+class EventBus:
+    """Receives new events once per worker and fans them out to the open streams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = collections.deque(maxlen=RECENT_EVENTS)
+        self._seen = set()
+        self._watch = None
+        self._poller = None
+        self._stopped = threading.Event()
+        self.started_ms = None
+        self.counters = {'events': 0, 'sent': 0, 'rejected': 0}
+
+    def start(self, db):
+        started_at = datetime.now(timezone.utc)
+        self.started_ms = int(started_at.timestamp() * 1000)
+        new_events = db.collection(EVENTS_COLLECTION).where(filter=FieldFilter('created_at', '>=', started_at))
+        try:
+            self._watch = new_events.on_snapshot(self._on_snapshot)
+        except NotImplementedError:
+            # Engines shared between worker processes have no listeners; poll them instead
+            self._poller = threading.Thread(target=self._poll, args=(db, started_at), name='event-poller', daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        self._deliver([to_event(change.document.id, change.document.to_dict())
+                       for change in changes if change.type.name == 'ADDED'])
+
+    def _poll(self, db, since):
+        while not self._stopped.wait(POLL_SECONDS):
+            try:
+                docs = (db.collection(EVENTS_COLLECTION)
+                        .where(filter=FieldFilter('created_at', '>=', since))
+                        .order_by('created_at').limit(BACKFILL_LIMIT).stream())
+                events = [to_event(doc.id, doc.to_dict()) for doc in docs]
+            except Exception:
+                logger.exception("Could not poll %s", EVENTS_COLLECTION)
+                continue
+            if events:
+                since = datetime.fromtimestamp(events[-1]['key'][0] / 1000, timezone.utc)
+                self._deliver(events)
+
+    def _deliver(self, events):
+        events = sorted(events, key=lambda event: event['key'])
+        with self._lock:
+            events = [event for event in events if event['id'] not in self._seen]
+            for event in events:
+                if len(self._recent) == self._recent.maxlen:
+                    self._seen.discard(self._recent[0]['id'])
+                self._recent.append(event)
+                self._seen.add(event['id'])
+            subscribers = list(self._subscribers)
+            self.counters['events'] += len(events)
+        for subscriber in subscribers:
+            for event in events:
+                subscriber.put(event)
+
+    def subscribe(self):
+        """Queue receiving every new event, or None when this worker has too many streams"""
+        with self._lock:
+            if len(self._subscribers) >= MAX_STREAMS:
+                self.counters['rejected'] += 1
+                return None
+            subscriber = queue.SimpleQueue()
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def events_after(self, db, last_key):
+        """Events a reconnecting stream missed, from memory when this worker has them"""
+        with self._lock:
+            if self.started_ms is not None and last_key[0] >= self.started_ms:
+                return [event for event in self._recent if event['key'] > last_key]
+        since = datetime.fromtimestamp(last_key[0] / 1000, timezone.utc)
+        docs = (db.collection(EVENTS_COLLECTION)
+                .where(filter=FieldFilter('created_at', '>=', since))
+                .order_by('created_at', direction=Query.ASCENDING).limit(BACKFILL_LIMIT).stream())
+        events = [to_event(doc.id, doc.to_dict()) for doc in docs]
+        return sorted((event for event in events if event['key'] > last_key), key=lambda event: event['key'])
+
+    def status(self):
+        with self._lock:
+            return {'streams': len(self._subscribers), **self.counters}
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_event_bus():
+    """The worker's event bus, started on the first stream so idle workers read nothing"""
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                bus = EventBus()
+                bus.start(get_db())
+                _bus = bus
+    return _bus
+
+
+def stop_event_bus():
+    global _bus
+    with _bus_lock:
+        if _bus is not None:
+            _bus.stop()
+            _bus = None
+
+
+def render_prometheus():
+    """Event stream state in Prometheus text format (empty until a stream has opened)"""
+    if _bus is None:
+        return ''
+    status = _bus.status()
+    lines = [
+        '# TYPE isolab_event_streams gauge',
+        f"isolab_event_streams {status['streams']}",
+    ]
+    for counter in ('events', 'sent', 'rejected'):
+        lines.append(f'# TYPE isolab_event_stream_{counter}_total counter')
+        lines.append(f'isolab_event_stream_{counter}_total {status[counter]}')
+    return '\n'.join(lines) + '\n'
+
+
+@events_bp.route('/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream of the machine changes visible to the current user"""
+    if not is_firebase_available():
+        return jsonify({"error": "Database not available"}), 500
+
+    if 'user_id' not in session:
+        return jsonify({"error": "Authentication required"}), 401
+
+    user_id = session.get('user_id')
+    user_role = session.get('role', '')
+    stage_access = session.get('stage_access', '')
+
+    db = get_db()
+    bus = get_event_bus()
+    subscriber = bus.subscribe()
+    if subscriber is None:
+        response = jsonify({"error": "Too many open event streams, retry later"})
+        response.headers['Retry-After'] = str(RECONNECT_MILLISECONDS // 1000)
+        return response, 503
+
+    # EventSource sends the id of the last event it received when it reconnects
+    last_key = event_key(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    try:
+        missed = bus.events_after(db, last_key) if last_key else []
+    except Exception:
+        bus.unsubscribe(subscriber)
+        raise
+
+    def generate():
+        sent_keys = set()
+        try:
+            yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+            for event in missed:
+                sent_keys.add(event['key'])
+                if is_visible(event, user_id, user_role, stage_access):
+                    bus.counters['sent'] += 1
+                    yield format_event(event)
+
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscriber.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                if event['key'] in sent_keys or (last_key and event['key'] <= last_key):
+                    continue
+                if is_visible(event, user_id, user_role, stage_access):
+                    bus.counters['sent'] += 1
+                    yield format_event(event)
+        finally:
+            bus.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
@@ -1,30 +1,75 @@
 """
 Firebase configuration and initialization module
+STORAGE_BACKEND=memory or sqlite serves the same client API from a local
+engine instead of connecting to Firebase
 """
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+import logging
 import os
+from .firestore_metrics import instrument_client
 
+logger = logging.getLogger(__name__)
 
 db = None
 firebase_app = None
 
+# Storage backends selectable with STORAGE_BACKEND
+STORAGE_BACKENDS = ('firestore', 'memory', 'sqlite')
+
+# Database file of the sqlite backend (fill it with scripts/import_firestore_export.py)
+DEFAULT_SQLITE_PATH = 'isolab.db'
+
+def initialize_local_storage(backend):
+    """Initialize a local storage engine: memory is seeded from STORAGE_EXPORT_DIR,
+    sqlite opens SQLITE_PATH"""
+    global db
+    
+    if backend == 'sqlite':
+        from .sqlite_store import create_sqlite_client
+
+        sqlite_path = os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
+        client = create_sqlite_client(sqlite_path)
+        if not client.engine.collection_names():
+            logger.warning("SQLite database %s is empty; import data with scripts/import_firestore_export.py",
+                           sqlite_path)
+        db = instrument_client(client)
+        logger.info("Using sqlite storage at %s", sqlite_path)
+        return True
+
+    from .firestore_export import load_export
+    from .memory_store import create_memory_client
+
+    export_dir = os.environ.get('STORAGE_EXPORT_DIR') or None
+    collections = load_export(export_dir)
+    db = instrument_client(create_memory_client(collections))
+    logger.info("Using %s storage with %d documents", backend,
+                sum(len(documents) for documents in collections.values()))
+    return True
+
 def initialize_firebase():
-    """Initialize Firebase Admin SDK and Firestore"""
+    """Initialize Firebase Admin SDK and Firestore, or the configured local backend"""
     global db, firebase_app
     
+    backend = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+    if backend not in STORAGE_BACKENDS:
+        logger.error("Unknown STORAGE_BACKEND %r, must be one of %s", backend, STORAGE_BACKENDS)
+        return False
+    if backend != 'firestore':
+        try:
+            return initialize_local_storage(backend)
+        except Exception:
+            logger.exception("%s storage initialization failed", backend)
+            return False
+    
     try:
         # Check for service account key - use forward slashes for cross-platform compatibility
         service_key_path = "config/isolab-support-firebase-adminsdk-fbsvc-7a36653eaf.json"
         
-        print(f"🔍 DEBUG: Looking for Firebase service key at: {service_key_path}")
-        print(f"🔍 DEBUG: Current working directory: {os.getcwd()}")
-        print(f"🔍 DEBUG: File exists check: {os.path.exists(service_key_path)}")
+        logger.debug("Looking for Firebase service key at %s (cwd: %s)", service_key_path, os.getcwd())
 
         if not os.path.exists(service_key_path):
-            print(f"❌ DEBUG: Firebase service account key not found at {service_key_path}")
-            
             # Try alternative paths
             alternative_paths = [
                 "/app/config/isolab-support-firebase-adminsdk-fbsvc-7a36653eaf.json",
@@ -33,40 +78,39 @@ def initialize_firebase():
             ]
             
             for alt_path in alternative_paths:
-                print(f"🔍 DEBUG: Trying alternative path: {alt_path}")
+                logger.debug("Trying alternative Firebase key path: %s", alt_path)
                 if os.path.exists(alt_path):
                     service_key_path = alt_path
-                    print(f"✅ DEBUG: Found Firebase key at: {service_key_path}")
                     break
             else:
-                print("❌ DEBUG: Firebase service account key not found in any location")
-                print("Some features may not work. Please check FIREBASE_SETUP.md for configuration instructions.")
+                logger.error("Firebase service account key not found in any location. "
+                             "Please check FIREBASE_SETUP.md for configuration instructions.")
                 return False
         
         # Initialize Firebase
-        print(f"🔍 DEBUG: Initializing Firebase with service key: {service_key_path}")
+        logger.debug("Initializing Firebase with service key: %s", service_key_path)
         cred = credentials.Certificate(service_key_path)
         firebase_app = firebase_admin.initialize_app(cred)
-        print("✅ DEBUG: Firebase app initialized successfully")
         
-        # Initialize Firestore DB
-        db = firestore.client()
-        print("✅ DEBUG: Firestore client initialized successfully")
+        # Initialize Firestore DB (wrapped for per-request operation accounting)
+        db = instrument_client(firestore.client())
         
-        print("✅ DEBUG: Firebase initialized successfully")
+        logger.info("Firebase initialized successfully")
         return True
         
-    except Exception as e:
-        print(f"❌ DEBUG: Firebase initialization failed: {e}")
-        print(f"❌ DEBUG: Exception type: {type(e)}")
-        import traceback
-        print(f"❌ DEBUG: Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Firebase initialization failed")
         return False
 
 def get_db():
     """Get Firestore database instance"""
     return db
 
+def set_db(client):
+    """Replace the database client (used by benchmark and load-test scripts)"""
+    global db
+    db = instrument_client(client)
+
 def is_firebase_available():
     """Check if Firebase is properly initialized"""
     return db is not None
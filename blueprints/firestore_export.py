@@ -0,0 +1,77 @@
+"""
+Firestore export files
+Reads and writes the JSON export format (one <collection>.json file of
+{doc_id: data} per collection, timestamps as ISO strings) used to seed the
+local storage engines
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EXPORT_DIR = os.path.join(ROOT_DIR, 'firestore_export_20250810_105750')
+SUMMARY_FILE = 'export_summary.json'
+
+# Timestamps are exported as datetime.isoformat() strings
+TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2}|Z)?$')
+
+
+def parse_export_value(value):
+    """Convert exported values back to Firestore types (ISO strings to datetimes)"""
+    if isinstance(value, dict):
+        return {key: parse_export_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [parse_export_value(item) for item in value]
+    if isinstance(value, str) and TIMESTAMP_PATTERN.match(value):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+
+def export_value(value):
+    """Convert a Firestore value to its JSON export form (datetimes to ISO strings)"""
+    if isinstance(value, dict):
+        return {key: export_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [export_value(item) for item in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def load_export(export_dir=None):
+    """Load an export directory as {collection: {doc_id: data}}"""
+    export_dir = export_dir or DEFAULT_EXPORT_DIR
+    collections = {}
+    for file_name in sorted(os.listdir(export_dir)):
+        if not file_name.endswith('.json') or file_name == SUMMARY_FILE:
+            continue
+        with open(os.path.join(export_dir, file_name), encoding='utf-8') as export_file:
+            documents = json.load(export_file)
+        collections[file_name[:-len('.json')]] = {
+            doc_id: parse_export_value(data) for doc_id, data in documents.items()
+        }
+    return collections
+
+
+def write_export(collections, export_dir):
+    """Write {collection: {doc_id: data}} as an export directory with its summary file"""
+    os.makedirs(export_dir, exist_ok=True)
+    for collection, documents in collections.items():
+        with open(os.path.join(export_dir, f'{collection}.json'), 'w', encoding='utf-8') as export_file:
+            json.dump({doc_id: export_value(data) for doc_id, data in documents.items()},
+                      export_file, indent=2, ensure_ascii=False)
+
+    summary = {
+        'export_timestamp': datetime.now().isoformat(),
+        'total_collections': len(collections),
+        'successful_collections': len(collections),
+        'total_documents': sum(len(documents) for documents in collections.values()),
+        'collections': sorted(collections),
+        'export_directory': os.path.basename(os.path.normpath(export_dir)),
+    }
+    with open(os.path.join(export_dir, SUMMARY_FILE), 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file, indent=2)
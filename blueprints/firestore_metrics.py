@@ -0,0 +1,353 @@
+"""
+Firestore operation accounting
+Wraps the Firestore client to count document reads, writes, deletes, queries
+and time spent in Firestore, per request and aggregated per route
+"""
+
+import math
+import threading
+import time
+from flask import g, has_request_context, request
+
+# Route label used for operations made outside of a request (startup, background threads)
+BACKGROUND_ROUTE = '_background'
+
+# Per-request totals exposed as response headers
+RESPONSE_HEADERS = {
+    'reads': 'X-Firestore-Reads',
+    'writes': 'X-Firestore-Writes',
+    'deletes': 'X-Firestore-Deletes',
+    'queries': 'X-Firestore-Queries',
+}
+TIME_HEADER = 'X-Firestore-Time-Ms'
+
+COUNTERS = ('reads', 'writes', 'deletes', 'queries', 'seconds')
+
+_lock = threading.Lock()
+_route_totals = {}
+
+
+def _new_counters():
+    return {counter: 0 for counter in COUNTERS}
+
+
+def record(reads=0, writes=0, deletes=0, queries=0, seconds=0.0):
+    """Add Firestore operations to the current request (or the background bucket)"""
+    if has_request_context():
+        if 'firestore_usage' not in g:
+            g.firestore_usage = _new_counters()
+        usage = g.firestore_usage
+        usage['reads'] += reads
+        usage['writes'] += writes
+        usage['deletes'] += deletes
+        usage['queries'] += queries
+        usage['seconds'] += seconds
+    else:
+        with _lock:
+            totals = _route_totals.setdefault(BACKGROUND_ROUTE, dict(_new_counters(), requests=0))
+            totals['reads'] += reads
+            totals['writes'] += writes
+            totals['deletes'] += deletes
+            totals['queries'] += queries
+            totals['seconds'] += seconds
+
+
+def get_request_usage():
+    """Get the Firestore counters of the current request"""
+    if has_request_context() and 'firestore_usage' in g:
+        return dict(g.firestore_usage)
+    return _new_counters()
+
+
+def finish_request(response):
+    """Add the request's usage to its route totals and to the response headers"""
+    usage = get_request_usage()
+    route = request.endpoint or 'unknown'
+
+    with _lock:
+        totals = _route_totals.setdefault(route, dict(_new_counters(), requests=0))
+        totals['requests'] += 1
+        for counter in COUNTERS:
+            totals[counter] += usage[counter]
+
+    for counter, header in RESPONSE_HEADERS.items():
+        response.headers[header] = str(usage[counter])
+    response.headers[TIME_HEADER] = f"{usage['seconds'] * 1000:.1f}"
+    return response
+
+
+def get_route_totals():
+    """Get a copy of the aggregated counters per route"""
+    with _lock:
+        return {route: dict(totals) for route, totals in _route_totals.items()}
+
+
+def reset():
+    """Clear the aggregated counters"""
+    with _lock:
+        _route_totals.clear()
+
+
+def render_prometheus():
+    """Render the aggregated counters in Prometheus text format"""
+    totals = get_route_totals()
+    metrics = [
+        ('isolab_firestore_reads_total', 'reads', 'Firestore document reads'),
+        ('isolab_firestore_writes_total', 'writes', 'Firestore document writes'),
+        ('isolab_firestore_deletes_total', 'deletes', 'Firestore document deletes'),
+        ('isolab_firestore_queries_total', 'queries', 'Firestore queries and lookups issued'),
+        ('isolab_firestore_seconds_total', 'seconds', 'Wall time spent in Firestore calls'),
+        ('isolab_requests_total', 'requests', 'Requests handled'),
+    ]
+
+    lines = []
+    for name, counter, description in metrics:
+        lines.append(f"# HELP {name} {description} by route")
+        lines.append(f"# TYPE {name} counter")
+        for route in sorted(totals):
+            value = totals[route].get(counter, 0)
+            if counter == 'seconds':
+                value = f"{value:.6f}"
+            lines.append(f'{name}{{route="{route}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _unwrap(value):
+    """Get the underlying Firestore object of a wrapper"""
+    return value._wrapped if isinstance(value, _Instrumented) else value
+
+
+class _Instrumented:
+    """Base wrapper delegating everything it does not count to the wrapped object"""
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __eq__(self, other):
+        return self._wrapped == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._wrapped)
+
+
+class InstrumentedAggregationQuery(_Instrumented):
+    """Counts an aggregation query (count()) as one query and one read per 1000 entries"""
+
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        results = self._wrapped.get(*args, **kwargs)
+        value = 0
+        for result in results:
+            for aggregation in result:
+                value = max(value, int(aggregation.value or 0))
+        record(queries=1, reads=max(1, math.ceil(value / 1000)),
+               seconds=time.perf_counter() - started)
+        return results
+
+
+class InstrumentedQuery(_Instrumented):
+    """Counts query executions and the documents they return"""
+
+    def _chain(self, method, *args, **kwargs):
+        args = [_unwrap(arg) for arg in args]
+        return InstrumentedQuery(getattr(self._wrapped, method)(*args, **kwargs))
+
+    def where(self, *args, **kwargs):
+        return self._chain('where', *args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return self._chain('order_by', *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._chain('limit', *args, **kwargs)
+
+    def limit_to_last(self, *args, **kwargs):
+        return self._chain('limit_to_last', *args, **kwargs)
+
+    def offset(self, *args, **kwargs):
+        return self._chain('offset', *args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._chain('select', *args, **kwargs)
+
+    def start_at(self, *args, **kwargs):
+        return self._chain('start_at', *args, **kwargs)
+
+    def start_after(self, *args, **kwargs):
+        return self._chain('start_after', *args, **kwargs)
+
+    def end_at(self, *args, **kwargs):
+        return self._chain('end_at', *args, **kwargs)
+
+    def end_before(self, *args, **kwargs):
+        return self._chain('end_before', *args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        return InstrumentedAggregationQuery(self._wrapped.count(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        """Stream results, timing only the time spent waiting on Firestore"""
+        if 'transaction' in kwargs:
+            kwargs['transaction'] = _unwrap(kwargs['transaction'])
+        started = time.perf_counter()
+        iterator = iter(self._wrapped.stream(*args, **kwargs))
+        elapsed = time.perf_counter() - started
+        returned = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    snapshot = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - started
+                    break
+                elapsed += time.perf_counter() - started
+                returned += 1
+                yield snapshot
+        finally:
+            # Firestore bills one read for a query even when it returns nothing
+            record(queries=1, reads=max(1, returned), seconds=elapsed)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    """Collection reference whose documents and additions are counted"""
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        update_time, doc_ref = self._wrapped.add(*args, **kwargs)
+        record(writes=1, seconds=time.perf_counter() - started)
+        return update_time, InstrumentedDocument(doc_ref)
+
+
+class InstrumentedDocument(_Instrumented):
+    """Document reference whose reads and writes are counted"""
+
+    def _timed(self, method, counter, *args, **kwargs):
+        if 'transaction' in kwargs:
+            kwargs['transaction'] = _unwrap(kwargs['transaction'])
+        started = time.perf_counter()
+        result = getattr(self._wrapped, method)(*args, **kwargs)
+        record(**{counter: 1}, queries=1 if counter == 'reads' else 0,
+               seconds=time.perf_counter() - started)
+        return result
+
+    def get(self, *args, **kwargs):
+        return self._timed('get', 'reads', *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._timed('set', 'writes', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._timed('create', 'writes', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._timed('update', 'writes', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._timed('delete', 'deletes', *args, **kwargs)
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+
+class InstrumentedWriteBatch(_Instrumented):
+    """Write batch whose operations are counted when committed"""
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        self._pending_writes = 0
+        self._pending_deletes = 0
+
+    def set(self, reference, *args, **kwargs):
+        self._wrapped.set(_unwrap(reference), *args, **kwargs)
+        self._pending_writes += 1
+        return self
+
+    def create(self, reference, *args, **kwargs):
+        self._wrapped.create(_unwrap(reference), *args, **kwargs)
+        self._pending_writes += 1
+        return self
+
+    def update(self, reference, *args, **kwargs):
+        self._wrapped.update(_unwrap(reference), *args, **kwargs)
+        self._pending_writes += 1
+        return self
+
+    def delete(self, reference, *args, **kwargs):
+        self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+        self._pending_deletes += 1
+        return self
+
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._wrapped.commit(*args, **kwargs)
+        record(writes=self._pending_writes, deletes=self._pending_deletes,
+               seconds=time.perf_counter() - started)
+        self._pending_writes = 0
+        self._pending_deletes = 0
+        return result
+
+
+class InstrumentedTransaction(InstrumentedWriteBatch):
+    """Transaction whose staged operations are counted once it has committed.
+    Firestore commits it itself (and may rerun the function), so the caller
+    resets the counts before each attempt and records them after the last."""
+
+    def get(self, ref_or_query, *args, **kwargs):
+        started = time.perf_counter()
+        snapshots = list(self._wrapped.get(_unwrap(ref_or_query), *args, **kwargs))
+        record(queries=1, reads=max(1, len(snapshots)), seconds=time.perf_counter() - started)
+        return iter(snapshots)
+
+    def reset(self):
+        self._pending_writes = 0
+        self._pending_deletes = 0
+
+    def record_commit(self, seconds):
+        record(writes=self._pending_writes, deletes=self._pending_deletes, seconds=seconds)
+        self.reset()
+
+
+class InstrumentedClient(_Instrumented):
+    """Firestore client wrapper returned by firebase_config.get_db()"""
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def batch(self, *args, **kwargs):
+        return InstrumentedWriteBatch(self._wrapped.batch(*args, **kwargs))
+
+    def transaction(self, *args, **kwargs):
+        return InstrumentedTransaction(self._wrapped.transaction(*args, **kwargs))
+
+    def get_all(self, references, *args, **kwargs):
+        """Batched document lookup: one call, one read per document"""
+        references = [_unwrap(reference) for reference in references]
+        if 'transaction' in kwargs:
+            kwargs['transaction'] = _unwrap(kwargs['transaction'])
+        started = time.perf_counter()
+        snapshots = list(self._wrapped.get_all(references, *args, **kwargs))
+        record(queries=1, reads=len(snapshots), seconds=time.perf_counter() - started)
+        return iter(snapshots)
+
+
+def instrument_client(client):
+    """Wrap a Firestore client for operation accounting"""
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
@@ -0,0 +1,74 @@
+"""
+Request-scoped document loader
+Collects document-by-id lookups made while handling a request, fetches them
+with batched db.get_all() calls and memoizes the results until the request ends
+"""
+
+import copy
+from flask import g, has_request_context
+from .firebase_config import get_db
+
+
+class RequestLoader:
+    """Batches and memoizes document reads by (collection, document id)"""
+
+    def __init__(self, db):
+        self._db = db
+        self._documents = {}
+        self._pending = {}
+
+    def prime(self, collection, doc_id, data):
+        """Store a document already read elsewhere (data None means missing)"""
+        self._documents[(collection, doc_id)] = copy.deepcopy(data)
+
+    def clear(self, collection, doc_id):
+        """Forget a memoized document after writing it"""
+        self._documents.pop((collection, doc_id), None)
+
+    def want(self, collection, doc_ids):
+        """Queue documents to be fetched by the next dispatch"""
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_ids]
+        for doc_id in doc_ids:
+            if doc_id and (collection, doc_id) not in self._documents:
+                self._pending.setdefault(collection, set()).add(doc_id)
+
+    def dispatch(self):
+        """Fetch every queued document with one get_all() call"""
+        if not self._pending:
+            return
+
+        references = []
+        for collection, doc_ids in self._pending.items():
+            collection_ref = self._db.collection(collection)
+            for doc_id in sorted(doc_ids):
+                references.append(collection_ref.document(doc_id))
+                # Memoize misses too; get_all also returns missing documents
+                self._documents[(collection, doc_id)] = None
+        self._pending = {}
+
+        for snapshot in self._db.get_all(references):
+            key = (snapshot.reference.parent.id, snapshot.id)
+            self._documents[key] = snapshot.to_dict() if snapshot.exists else None
+
+    def load_many(self, collection, doc_ids):
+        """Get several documents of a collection as {id: data or None}"""
+        self.want(collection, doc_ids)
+        self.dispatch()
+        return {
+            doc_id: copy.deepcopy(self._documents.get((collection, doc_id)))
+            for doc_id in doc_ids if doc_id
+        }
+
+    def load(self, collection, doc_id):
+        """Get one document's data, or None if it does not exist"""
+        return self.load_many(collection, [doc_id]).get(doc_id)
+
+
+def get_loader():
+    """Get the loader of the current request (a fresh one outside requests)"""
+    if not has_request_context():
+        return RequestLoader(get_db())
+    if 'document_loader' not in g:
+        g.document_loader = RequestLoader(get_db())
+    return g.document_loader
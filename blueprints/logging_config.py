@@ -0,0 +1,72 @@
+"""
+Logging configuration
+Routes every log record through a QueueHandler so formatting and stream I/O
+happen on a background QueueListener thread instead of the request thread
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+
+_listener = None
+
+
+def parse_module_levels(value):
+    """Parse LOG_LEVELS ("blueprints.machines=DEBUG,isolab.slow_requests=WARNING")"""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def default_level():
+    """WARNING in production, DEBUG when Flask_DEBUG (or FLASK_DEBUG) is enabled"""
+    value = os.environ.get('Flask_DEBUG') or os.environ.get('FLASK_DEBUG') or ''
+    debug = value.lower() in ('1', 'true', 'yes')
+    return 'DEBUG' if debug else 'WARNING'
+
+
+def configure_logging(stream=None):
+    """Install the queue-backed logging pipeline once per process.
+
+    LOG_LEVEL sets the root level (default: WARNING, or DEBUG with Flask_DEBUG).
+    LOG_LEVELS overrides it per logger name, e.g. "blueprints.login=DEBUG".
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output_handler = logging.StreamHandler(stream or sys.stdout)
+    output_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(os.environ.get('LOG_LEVEL', default_level()).upper())
+
+    for name, level in parse_module_levels(os.environ.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
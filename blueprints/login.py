@@ -8,6 +8,9 @@ from datetime import datetime
 from blueprints.firebase_config import get_db, is_firebase_available
 from google.cloud.firestore_v1.base_query import FieldFilter
 import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
 
 def hash_password(password):
     """Simple password hashing"""
@@ -19,71 +22,57 @@ login_bp = Blueprint('login', __name__, url_prefix='/')
 def login():
     """Login with username/email and password"""
     try:
-        print("DEBUG: Login endpoint called")
-        print(f"DEBUG: Request method: {request.method}")
-        print(f"DEBUG: Request content type: {request.content_type}")
+        logger.debug("Login endpoint called (content type: %s)", request.content_type)
 
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Login failed: database not available")
             return jsonify({"error": "Database not available"}), 500
-        print("DEBUG: Firebase connection established")
-        
+
         data = request.get_json()
-        print(f"DEBUG: Received data: {data}")
-        
+
         identifier = data.get('email') or data.get('username')  # Support both email and username
         password = data.get('password')
 
-        print(f"DEBUG: Identifier: {identifier}")
-        print(f"DEBUG: Password provided: {'Yes' if password else 'No'}")
-
         if not identifier:
-            print("DEBUG: No identifier provided")
+            logger.debug("Login rejected: no identifier provided")
             return jsonify({"error": "Email or username required"}), 400
         
         if not password:
-            print("DEBUG: No password provided")
+            logger.debug("Login rejected: no password provided")
             return jsonify({"error": "Password required"}), 400
         
         # Find user by email or username
         users_ref = db.collection('users')
-        print(f"DEBUG: Searching for user by email: {identifier}")
         
         # Try to find by email first
         users = users_ref.where(filter=FieldFilter("email", "==", identifier)).get()
-        print(f"DEBUG: Users found by email: {len(users)}")
+        logger.debug("Users found by email: %d", len(users))
 
         # If not found by email, try username
         if not users:
-            print(f"DEBUG: Searching for user by username: {identifier}")
             users = users_ref.where(filter=FieldFilter("username", "==", identifier)).get()
-            print(f"DEBUG: Users found by username: {len(users)}")
+            logger.debug("Users found by username: %d", len(users))
         
         if not users:
-            print(f"DEBUG: User not found: {identifier}")
+            logger.info("Login failed: unknown user %s", identifier)
             return jsonify({"error": "Invalid credentials"}), 401
         
         user_doc = users[0]
         user_data = user_doc.to_dict()
         user_data['id'] = user_doc.id
         
-        print(f"DEBUG: User found: {user_data.get('email')} (ID: {user_doc.id})")
-        print(f"DEBUG: User role: {user_data.get('role')}")
-        print(f"DEBUG: User active: {user_data.get('is_active', True)}")
-        
         # Simple password verification using hash
         hashed_input = hash_password(password)
         stored_password = user_data.get('password')
-        print(f"DEBUG: Password hash match: {hashed_input == stored_password}")
         
         if stored_password != hashed_input:
-            print(f"DEBUG: Invalid password for user: {identifier}")
+            logger.info("Login failed: invalid password for user %s", user_doc.id)
             return jsonify({"error": "Invalid credentials"}), 401
         
         # Check if user is active
         if not user_data.get('is_active', True):
-            print(f"DEBUG: Account deactivated for user: {identifier}")
+            logger.info("Login refused: account %s is deactivated", user_doc.id)
             return jsonify({"error": "Account is deactivated"}), 403
         
         # Store in session with new structure
@@ -94,45 +83,26 @@ def login():
         session['first_name'] = user_data.get('first_name', 'Unknown')
         session['last_name'] = user_data.get('last_name', 'User')
         
-        print(f"DEBUG: Session created for user: {user_data.get('username')} ({user_data['role']})")
-        print(f"DEBUG: Session data after setting: {dict(session)}")
-        print(f"DEBUG: Session data - User ID: {user_doc.id}")
-        print(f"DEBUG: Session data - Role: {user_data['role']}")
-        print(f"DEBUG: Session data - Stage access: {user_data.get('stage_access')}")
-        
-        print(f"User logged in: {user_data.get('username')} ({user_data['role']}) - Stage access: {user_data.get('stage_access')}")
+        logger.info("User logged in: %s (%s) - Stage access: %s",
+                    user_doc.id, user_data['role'], user_data.get('stage_access'))
         
         # Remove password from response
         user_data.pop('password', None)
         
-        print(f"DEBUG: Login successful, returning user data")
-        
-        response = jsonify({
+        return jsonify({
             "message": "Login successful",
             "user": user_data
         })
         
-        print(f"DEBUG: Response headers: {response.headers}")
-        
-        return response
-        
     except Exception as e:
-        print(f"DEBUG: Login failed with exception: {e}") 
-        print(f"DEBUG: Exception type: {type(e)}")
-        import traceback
-        print(f"DEBUG: Traceback: {traceback.format_exc()}")
+        logger.exception("Login failed")
         return jsonify({"error": str(e)}), 500
 
 @login_bp.route('/logout', methods=['POST'])
 def logout():
     """Logout - clear session"""
-    print("DEBUG: Logout endpoint called")
-    user_id = session.get('user_id', 'Unknown')
-    username = session.get('username', 'Unknown')
-    print(f"DEBUG: Logging out user: {username} (ID: {user_id})")
-    
+    logger.debug("Logging out user %s", session.get('user_id', 'Unknown'))
     session.clear()
-    print("DEBUG: Session cleared successfully")
     return jsonify({"message": "Logout successful"})
 
 
@@ -0,0 +1,201 @@
+"""
+Machines mirror
+Optional per-process replica of the machines collection (MACHINE_MIRROR=1),
+kept current by an on_snapshot listener and queried through the same client
+API, so list and dashboard endpoints answer from memory instead of Firestore
+"""
+
+import logging
+import os
+import threading
+import time
+from .document_store import DocumentStoreClient, normalize_value
+from .firebase_config import get_db
+from .memory_store import MemoryEngine
+
+logger = logging.getLogger(__name__)
+
+MACHINE_MIRROR = os.environ.get('MACHINE_MIRROR', '').lower() in ('1', 'true', 'yes')
+
+# How long after a local write reads wait for the mirror to receive it
+MIRROR_MAX_WAIT_SECONDS = float(os.environ.get('MACHINE_MIRROR_MAX_WAIT_MS', '500')) / 1000
+
+# A write whose change event never arrives stops holding reads back after this
+PENDING_WRITE_EXPIRY_SECONDS = 10.0
+
+# Fields the read endpoints filter machines on
+MIRROR_INDEX_FIELDS = ('current_stage', 'assigned_user_id', 'status', 'clientId')
+
+COLLECTION = 'machines'
+
+
+class MachineMirror:
+    """In-memory copy of the machines collection fed by a snapshot listener"""
+
+    def __init__(self):
+        self._engine = MemoryEngine()
+        self._client = DocumentStoreClient(self._engine)
+        for field in MIRROR_INDEX_FIELDS:
+            self._engine.ensure_index(COLLECTION, field)
+        self._condition = threading.Condition()
+        self._watch = None
+        self._ready = False
+        # machine id -> monotonic time of a local write not yet seen by the listener
+        self._pending = {}
+        self.counters = {'events': 0, 'answered': 0, 'fallbacks': 0}
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_event_at = None
+
+    def start(self, db):
+        self._watch = db.collection(COLLECTION).on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        with self._condition:
+            self._ready = False
+
+    def _on_snapshot(self, docs, changes, read_time):
+        now = time.time()
+        with self._condition:
+            for change in changes:
+                document = change.document
+                if change.type.name == 'REMOVED':
+                    self._engine.delete(COLLECTION, document.id)
+                else:
+                    self._engine.put(COLLECTION, document.id, normalize_value(document.to_dict()))
+                self._pending.pop(document.id, None)
+                if self._ready and document.update_time is not None:
+                    # Replication lag: commit time to local application
+                    self.last_lag = max(0.0, now - document.update_time.timestamp())
+                    self.max_lag = max(self.max_lag, self.last_lag)
+            self.counters['events'] += len(changes)
+            self.last_event_at = now
+            if not self._ready:
+                logger.info("Machine mirror ready with %d machines",
+                            len(self._engine.document_ids(COLLECTION)))
+            self._ready = True
+            self._condition.notify_all()
+
+    def wait_ready(self, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: self._ready, timeout)
+
+    def note_write(self, machine_id):
+        """Hold mirror reads back until the listener delivers a write to this machine"""
+        with self._condition:
+            if self._ready:
+                self._pending[machine_id] = time.monotonic()
+
+    def collection(self):
+        """Mirror collection when it is loaded and has this process's writes, else None"""
+        with self._condition:
+            # While loading, or once a write is overdue, answer from the database without waiting
+            while self._ready and self._pending:
+                self._expire_pending()
+                remaining = max(self._pending.values(), default=0) + MIRROR_MAX_WAIT_SECONDS - time.monotonic()
+                if not self._pending or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if not self._ready or self._pending:
+                self.counters['fallbacks'] += 1
+                return None
+            self.counters['answered'] += 1
+        return self._client.collection(COLLECTION)
+
+    def _expire_pending(self):
+        expired = time.monotonic() - PENDING_WRITE_EXPIRY_SECONDS
+        for machine_id, noted_at in list(self._pending.items()):
+            if noted_at < expired:
+                logger.warning("Machine mirror never received the write to %s", machine_id)
+                del self._pending[machine_id]
+
+    def status(self):
+        with self._condition:
+            return {
+                'ready': self._ready,
+                'documents': len(self._engine.document_ids(COLLECTION)),
+                'pending_writes': len(self._pending),
+                'last_lag_seconds': self.last_lag,
+                'max_lag_seconds': self.max_lag,
+                'seconds_since_event': time.time() - self.last_event_at if self.last_event_at else None,
+                **self.counters,
+            }
+
+
+_mirror = None
+
+
+def start_mirror():
+    """Start the mirror when MACHINE_MIRROR is set; returns whether it is running"""
+    global _mirror
+    if not MACHINE_MIRROR or _mirror is not None:
+        return _mirror is not None
+    db = get_db()
+    if db is None:
+        return False
+
+    mirror = MachineMirror()
+    try:
+        mirror.start(db)
+    except NotImplementedError as e:
+        logger.warning("Machine mirror disabled: %s", e)
+        return False
+    _mirror = mirror
+    return True
+
+
+def wait_for_mirror(timeout=30.0):
+    """Block until the mirror has loaded (used by scripts); False when off or timed out"""
+    return _mirror is not None and _mirror.wait_ready(timeout)
+
+
+def stop_mirror():
+    global _mirror
+    if _mirror is not None:
+        _mirror.stop()
+        _mirror = None
+
+
+def get_mirror_collection():
+    """Machines collection of the mirror, or None while it is off, warming up or behind"""
+    if _mirror is None:
+        return None
+    return _mirror.collection()
+
+
+def machines_collection(db):
+    """Collection to read machines from: the mirror when current, else the database"""
+    mirrored = get_mirror_collection()
+    return mirrored if mirrored is not None else db.collection(COLLECTION)
+
+
+def note_machine_write(machine_id):
+    """Call just before committing a write to a machine so later reads wait for it"""
+    if _mirror is not None:
+        _mirror.note_write(machine_id)
+
+
+def render_prometheus():
+    """Mirror state in Prometheus text format (empty when the mirror is off)"""
+    if _mirror is None:
+        return ''
+    status = _mirror.status()
+    lines = [
+        '# TYPE isolab_machine_mirror_ready gauge',
+        f"isolab_machine_mirror_ready {int(status['ready'])}",
+        '# TYPE isolab_machine_mirror_documents gauge',
+        f"isolab_machine_mirror_documents {status['documents']}",
+        '# TYPE isolab_machine_mirror_lag_seconds gauge',
+        f"isolab_machine_mirror_lag_seconds {status['last_lag_seconds']:.6f}",
+        '# TYPE isolab_machine_mirror_max_lag_seconds gauge',
+        f"isolab_machine_mirror_max_lag_seconds {status['max_lag_seconds']:.6f}",
+        '# TYPE isolab_machine_mirror_pending_writes gauge',
+        f"isolab_machine_mirror_pending_writes {status['pending_writes']}",
+    ]
+    for counter in ('events', 'answered', 'fallbacks'):
+        lines.append(f'# TYPE isolab_machine_mirror_{counter}_total counter')
+        lines.append(f'isolab_machine_mirror_{counter}_total {status[counter]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+"""
+Machine statistics aggregate
+Maintains the stats/machines document with per-stage machine counts, updated
+with increments in the same batch as each machine write
+"""
+
+from datetime import datetime
+from firebase_admin import firestore
+
+STATS_COLLECTION = 'stats'
+MACHINE_STATS_DOC = 'machines'
+
+
+def get_stats_ref(db):
+    """Get the reference of the machine statistics document"""
+    return db.collection(STATS_COLLECTION).document(MACHINE_STATS_DOC)
+
+
+def stats_bucket(machine_data):
+    """Get the stage bucket a machine is counted in"""
+    if machine_data.get('status') == 'Completed':
+        return 'completed'
+    return machine_data.get('current_stage') or 'unknown'
+
+
+def compute_stats_delta(old_data, new_data):
+    """Compute counter changes for a machine going from old_data to new_data.
+    Either side may be None for a create or a delete."""
+    total = 0
+    completed = 0
+    stage_counts = {}
+
+    for machine_data, sign in ((old_data, -1), (new_data, 1)):
+        if machine_data is None:
+            continue
+        total += sign
+        if machine_data.get('status') == 'Completed':
+            completed += sign
+        bucket = stats_bucket(machine_data)
+        stage_counts[bucket] = stage_counts.get(bucket, 0) + sign
+
+    stage_counts = {bucket: count for bucket, count in stage_counts.items() if count}
+    return total, completed, stage_counts
+
+
+def add_stats_update(batch, db, old_data, new_data):
+    """Add the counter increments for a machine write to a batch or transaction.
+    Returns False when the write does not change any counter."""
+    total, completed, stage_counts = compute_stats_delta(old_data, new_data)
+    if not total and not completed and not stage_counts:
+        return False
+
+    update = {'updated_at': datetime.now()}
+    if total:
+        update['total_machines'] = firestore.Increment(total)
+    if completed:
+        update['completed_machines'] = firestore.Increment(completed)
+    if stage_counts:
+        update['stage_counts'] = {
+            bucket: firestore.Increment(count) for bucket, count in stage_counts.items()
+        }
+    batch.set(get_stats_ref(db), update, merge=True)
+    return True
+
+
+def recompute_stats(db):
+    """Rebuild the statistics document from every machine and return it"""
+    stats = {
+        'total_machines': 0,
+        'completed_machines': 0,
+        'stage_counts': {},
+    }
+    for doc in db.collection('machines').stream():
+        machine_data = doc.to_dict()
+        stats['total_machines'] += 1
+        if machine_data.get('status') == 'Completed':
+            stats['completed_machines'] += 1
+        bucket = stats_bucket(machine_data)
+        stats['stage_counts'][bucket] = stats['stage_counts'].get(bucket, 0) + 1
+
+    stats['updated_at'] = datetime.now()
+    stats['recomputed_at'] = stats['updated_at']
+    get_stats_ref(db).set(stats)
+    return stats
+
+
+def get_stats(db):
+    """Read the statistics document, building it on first use.
+    A document created only by increments was never seeded with the existing
+    machines, so it is rebuilt once as well."""
+    stats_doc = get_stats_ref(db).get()
+    if not stats_doc.exists:
+        return recompute_stats(db)
+    stats = stats_doc.to_dict()
+    if 'recomputed_at' not in stats:
+        return recompute_stats(db)
+    return stats
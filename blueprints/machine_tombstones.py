@@ -0,0 +1,42 @@
+"""
+Machine tombstones
+Records deleted machines, and machines leaving a stage or assignee, in the
+same batch as the write so GET /machines/changes can tell clients which
+machines to drop from their view
+"""
+
+from datetime import datetime, timedelta
+
+TOMBSTONES_COLLECTION = 'machine_tombstones'
+
+# Machine fields the change feed filters tombstones on (their values before the write)
+TOMBSTONE_SCOPE_FIELDS = ('current_stage', 'assigned_user_id')
+
+# Position of a tombstone in the change feed, like updated_at for machines
+REMOVED_AT_FIELD = 'removed_at'
+
+# A TTL policy on expire_at deletes old tombstones; older watermarks need a full reload
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+
+def add_tombstone(batch, db, machine_id, old_data, new_data):
+    """Add a tombstone to a batch when a machine is deleted (new_data None) or
+    changes stage or assignee. Returns False when nobody loses sight of it."""
+    if old_data is None:
+        return False
+    if new_data is not None and all(old_data.get(field) == new_data.get(field)
+                                    for field in TOMBSTONE_SCOPE_FIELDS):
+        return False
+
+    # A move shares the machine's updated_at so both land on the same point of the feed
+    removed_at = (new_data or {}).get('updated_at') or datetime.now()
+    tombstone = {
+        'machine_id': machine_id,
+        'reason': 'deleted' if new_data is None else 'moved',
+        REMOVED_AT_FIELD: removed_at,
+        'expire_at': removed_at + TOMBSTONE_RETENTION,
+    }
+    for field in TOMBSTONE_SCOPE_FIELDS:
+        tombstone[field] = old_data.get(field)
+    batch.set(db.collection(TOMBSTONES_COLLECTION).document(), tombstone)
+    return True
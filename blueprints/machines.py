@@ -4,9 +4,24 @@ Handles machine operations with simple current_stage approach
 """
 
 from flask import Blueprint, request, jsonify, session, render_template, redirect
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from google.cloud.firestore_v1 import Query
+from google.cloud.firestore_v1.field_path import FieldPath
+import base64
+import json
+import logging
 from .firebase_config import get_db, is_firebase_available
 from .users import require_role
+from . import machine_mirror, reference_cache
+from .assignment_scheduler import (ASSIGNED_HOURS_FIELD, add_workload_update, choose_assignee, get_workloads,
+                                   recompute_workloads, stage_hours)
+from .events import add_event
+from .loader import get_loader
+from .machine_stats import add_stats_update, recompute_stats
+from .machine_tombstones import TOMBSTONES_COLLECTION, REMOVED_AT_FIELD, TOMBSTONE_RETENTION, add_tombstone
+from .workflow_stats import add_workflow_stats_update
+
+logger = logging.getLogger(__name__)
 
 # Create machines blueprint
 machines_bp = Blueprint('machines', __name__, url_prefix='/machines')
@@ -14,110 +29,384 @@ machines_bp = Blueprint('machines', __name__, url_prefix='/machines')
 # Frontend URL configuration
 FRONTEND_URL = 'https://isolab-support.firebaseapp.com'
 
+# Pagination limits for GET /machines
+MAX_PAGE_SIZE = 200
+
+# Equality filters accepted by GET /machines: query parameter -> machine field
+MACHINE_FILTERS = {
+    'status': 'status',
+    'stage': 'current_stage',
+    'clientId': 'clientId',
+    'paymentStatus': 'paymentStatus',
+    'facturation': 'facturation',
+    'machineType': 'machineType',
+}
+
+# Fields used by the role-based visibility queries for non-admin users
+VISIBILITY_FIELDS = ['current_stage', 'assigned_user_id']
+
+# Range filter (?dateFrom= / ?dateTo=) applies to the listing order field
+DATE_RANGE_FIELD = 'dateAdded'
+
+# Firestore accepts at most 500 writes per batch
+BATCH_WRITE_LIMIT = 450
+
+# Delta sync (GET /machines/changes) walks machines in the order of their last write
+CHANGES_ORDER_FIELD = 'updated_at'
+
+# Watermarks stay this far behind the clock, so writes stamped by a server whose
+# clock is slightly late, or still committing, are not skipped (they may come twice)
+WATERMARK_SKEW = timedelta(seconds=10)
+
+def parse_date_param(value, end_of_day=False):
+    """Parse an ISO date or datetime query parameter as a UTC datetime"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end_of_day and len(value) == 10:
+        # A plain date for dateTo includes the whole day
+        parsed += timedelta(days=1)
+    return parsed
+
+def parse_machine_filters(args):
+    """Read equality and date range filters from the request arguments.
+    Returns (equality_filters, date_from, date_to); raises ValueError on bad dates."""
+    equality_filters = {}
+    for param, field in MACHINE_FILTERS.items():
+        value = args.get(param)
+        if value:
+            equality_filters[field] = value
+    
+    date_from = args.get('dateFrom')
+    date_to = args.get('dateTo')
+    try:
+        date_from = parse_date_param(date_from) if date_from else None
+        date_to = parse_date_param(date_to, end_of_day=True) if date_to else None
+    except ValueError:
+        raise ValueError("dateFrom and dateTo must be ISO dates (YYYY-MM-DD)")
+    return equality_filters, date_from, date_to
+
+def apply_machine_filters(query, equality_filters, date_from=None, date_to=None):
+    """Push equality and date range filters down to the Firestore query"""
+    for field, value in equality_filters.items():
+        query = query.where(field, '==', value)
+    if date_from is not None:
+        query = query.where(DATE_RANGE_FIELD, '>=', date_from)
+    if date_to is not None:
+        query = query.where(DATE_RANGE_FIELD, '<', date_to)
+    return query
+
+def encode_cursor(date_added, doc_id):
+    """Build an opaque page token from the last machine's sort key"""
+    payload = json.dumps({'d': date_added.isoformat(), 'id': doc_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Parse a page token back into (dateAdded, document id); raises ValueError"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(payload['d']), str(payload['id'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
+def stored_now():
+    """Current time as the write paths store it: naive datetime.now(), taken as UTC"""
+    return datetime.now().replace(tzinfo=timezone.utc)
+
+def as_utc(value):
+    """Aware UTC datetime of a stored or parsed timestamp"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def encode_watermark(changed_at, doc_id=None):
+    """Build an opaque delta sync token from the position of the last change seen"""
+    payload = json.dumps({'t': as_utc(changed_at).isoformat(), 'id': doc_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_watermark(token):
+    """Parse a delta sync token back into (UTC datetime, document id or None); raises ValueError"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        doc_id = payload['id']
+        return as_utc(datetime.fromisoformat(payload['t'])), str(doc_id) if doc_id else None
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid watermark: {token}") from e
+
+def parse_page_size(value):
+    """Validate the ?limit= parameter; None means no pagination"""
+    if value is None or value == '':
+        return None
+    limit = int(value)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def ordered_machines_query(query, cursor=None, limit=None):
+    """Apply the stable listing order (newest first, then id) and page bounds to a query"""
+    query = query.order_by('dateAdded', direction=Query.DESCENDING)
+    query = query.order_by(FieldPath.document_id(), direction=Query.DESCENDING)
+    if cursor is not None:
+        date_added, doc_id = cursor
+        query = query.start_after({'dateAdded': date_added, FieldPath.document_id(): doc_id})
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def changes_query(query, order_field, watermark, limit):
+    """Order a query by change time (then id) and start it after a watermark"""
+    changed_at, doc_id = watermark
+    query = query.order_by(order_field).order_by(FieldPath.document_id())
+    if doc_id:
+        query = query.start_after({order_field: changed_at, FieldPath.document_id(): doc_id})
+    else:
+        query = query.where(order_field, '>=', changed_at)
+    return query.limit(limit)
+
+def merge_ordered_pages(sources, limit=None):
+    """Merge document streams that share the listing order, dropping duplicates.
+    Returns (documents, has_more); each source must have been fetched with limit + 1."""
+    merged = {}
+    for docs in sources:
+        for doc in docs:
+            merged.setdefault(doc.id, doc)
+    ordered = sorted(merged.values(),
+                     key=lambda doc: (doc.get('dateAdded'), doc.id),
+                     reverse=True)
+    if limit is None:
+        return ordered, False
+    return ordered[:limit], len(ordered) > limit
+
 @machines_bp.route('/view', methods=['GET'])
 def view_machines():
     """Redirect to the machines view page on frontend"""
     return redirect(f'{FRONTEND_URL}/voir-machines.html')
 
+def list_visible_machines(db, user_id, user_role, stage_access, equality_filters=None,
+                          date_from=None, date_to=None, cursor=None, limit=None):
+    """List machines visible to a user, with stage info attached.
+    Returns (machines, next_cursor, has_more)."""
+    equality_filters = equality_filters or {}
+    
+    # Fetch one extra document per source to know whether another page exists
+    fetch_limit = limit + 1 if limit is not None else None
+    
+    machines_ref = machine_mirror.machines_collection(db)
+    sources = []
+    
+    if user_role == 'admin':
+        # Admin sees all machines
+        admin_query = apply_machine_filters(machines_ref, equality_filters, date_from, date_to)
+        sources.append(ordered_machines_query(admin_query, cursor, fetch_limit).stream())
+    else:
+        # Regular users see machines in their stage or assigned to them
+        
+        # Get machines in user's accessible stage (skipped when a stage filter excludes it)
+        requested_stage = equality_filters.get('current_stage')
+        if stage_access and stage_access != 'all' and requested_stage in (None, stage_access):
+            stage_filters = dict(equality_filters, current_stage=stage_access)
+            stage_query = apply_machine_filters(machines_ref, stage_filters, date_from, date_to)
+            sources.append(ordered_machines_query(stage_query, cursor, fetch_limit).stream())
+        
+        # Also get machines directly assigned to this user
+        assigned_filters = dict(equality_filters, assigned_user_id=user_id)
+        assigned_query = apply_machine_filters(machines_ref, assigned_filters, date_from, date_to)
+        sources.append(ordered_machines_query(assigned_query, cursor, fetch_limit).stream())
+    
+    # Both sources share the same order, so merging them keeps pages consistent
+    machines_docs, has_more = merge_ordered_pages(sources, limit)
+    
+    machines = [describe_machine(doc) for doc in machines_docs]
+    next_cursor = None
+    
+    if has_more and machines_docs:
+        last_doc = machines_docs[-1]
+        next_cursor = encode_cursor(last_doc.get('dateAdded'), last_doc.id)
+    
+    return machines, next_cursor, has_more
+
+def list_changed_machines(db, user_id, user_role, stage_access, watermark, limit):
+    """List machines written after a watermark and the visible machines removed since,
+    with the same visibility as list_visible_machines.
+    Returns (machines, removed, last_key, has_more); last_key is the page's last position."""
+    machines_ref = machine_mirror.machines_collection(db)
+    tombstones_ref = db.collection(TOMBSTONES_COLLECTION)
+    machine_queries = []
+    tombstone_queries = []
+    
+    if user_role == 'admin':
+        machine_queries.append(machines_ref)
+        # Admins see every machine, so only deletions take one out of their view
+        tombstone_queries.append(tombstones_ref.where('reason', '==', 'deleted'))
+    else:
+        # Machines in the user's stage or assigned to them, and those that left either
+        scopes = [('assigned_user_id', user_id)]
+        if stage_access and stage_access != 'all':
+            scopes.insert(0, ('current_stage', stage_access))
+        for field, value in scopes:
+            machine_queries.append(machines_ref.where(field, '==', value))
+            tombstone_queries.append(tombstones_ref.where(field, '==', value))
+    
+    # Fetch one extra change per source to know whether another page exists
+    changes = {}
+    for query in machine_queries:
+        for doc in changes_query(query, CHANGES_ORDER_FIELD, watermark, limit + 1).stream():
+            changes[('machine', doc.id)] = ((as_utc(doc.get(CHANGES_ORDER_FIELD)), doc.id), doc)
+    for query in tombstone_queries:
+        for doc in changes_query(query, REMOVED_AT_FIELD, watermark, limit + 1).stream():
+            changes[('tombstone', doc.id)] = ((as_utc(doc.get(REMOVED_AT_FIELD)), doc.id), doc)
+    
+    ordered = sorted(changes.items(), key=lambda item: item[1][0])
+    page = ordered[:limit]
+    
+    machines = [describe_machine(doc) for (kind, _), (_, doc) in page if kind == 'machine']
+    removed = []
+    # A machine that left and came back within the page is simply changed
+    seen_ids = {machine['id'] for machine in machines}
+    for (kind, _), (key, doc) in page:
+        machine_id = doc.get('machine_id') if kind == 'tombstone' else None
+        if machine_id and machine_id not in seen_ids:
+            seen_ids.add(machine_id)
+            removed.append({'id': machine_id, 'reason': doc.get('reason'), 'removed_at': key[0]})
+    
+    last_key = page[-1][1][0] if page else None
+    return machines, removed, last_key, len(ordered) > limit
+
+def describe_machine(doc):
+    """Listing entry of a machine document: its data, id and current stage info"""
+    machine_data = doc.to_dict()
+    # Later lookups of this machine in the same request need no read
+    get_loader().prime('machines', doc.id, machine_data)
+    machine_data['id'] = doc.id
+    
+    # Add current stage information
+    current_stage = machine_data.get('current_stage')
+    if current_stage:
+        # Get stage definition for additional info
+        stage_def = reference_cache.get_stage(current_stage)
+        
+        if stage_def:
+            machine_data['stage_info'] = {
+                'order': stage_def.get('order'),
+                'estimated_duration_hours': stage_def.get('estimated_duration_hours'),
+                'required_role': stage_def.get('required_role')
+            }
+    
+    return machine_data
+
 @machines_bp.route('', methods=['GET'])
 def get_all_machines():
-    """Get all machines filtered by user role and stage access"""
+    """Get machines visible to the user's role and stage access.
+    Supports the MACHINE_FILTERS parameters, dateFrom/dateTo, and limit/cursor pagination."""
     try:
-        print("DEBUG: Getting all machines")
-        print(f"DEBUG: User session: {session.get('user_id')}")
-        print(f"DEBUG: User role: {session.get('role')}")
-        print(f"DEBUG: Stage access: {session.get('stage_access')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in
         if 'user_id' not in session:
-            print("DEBUG: Authentication required - no user_id in session")
             return jsonify({"error": "Authentication required"}), 401
         
         user_id = session.get('user_id')
         user_role = session.get('role', '')
         stage_access = session.get('stage_access', '')
         
-        print(f"DEBUG: Fetching machines for user {user_id} with role {user_role}")
+        # Optional pagination: ?limit=<n>&cursor=<token from previous page>
+        try:
+            limit = parse_page_size(request.args.get('limit'))
+            cursor_token = request.args.get('cursor')
+            cursor = decode_cursor(cursor_token) if cursor_token else None
+            equality_filters, date_from, date_to = parse_machine_filters(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        machines_ref = db.collection('machines')
+        machines, next_cursor, has_more = list_visible_machines(
+            db, user_id, user_role, stage_access,
+            equality_filters, date_from, date_to, cursor, limit
+        )
         
-        if user_role == 'admin':
-            # Admin sees all machines
-            print("DEBUG: Admin user - fetching all machines")
-            machines_docs = machines_ref.stream()
-        else:
-            # Regular users see machines in their stage or assigned to them
-            print(f"DEBUG: Regular user - filtering by stage access: {stage_access}")
-            machines_docs = []
-            
-            # Get machines in user's accessible stage
-            if stage_access and stage_access != 'all':
-                print(f"DEBUG: Fetching machines for stage: {stage_access}")
-                stage_machines = machines_ref.where('current_stage', '==', stage_access).stream()
-                machines_docs.extend(stage_machines)
-            
-            # Also get machines directly assigned to this user
-            assigned_machines = machines_ref.where('assigned_user_id', '==', user_id).stream()
-            machines_docs.extend(assigned_machines)
+        logger.debug("Listed %d machines for user %s (%s), has_more=%s",
+                     len(machines), user_id, user_role, has_more)
         
-        machines = []
-        seen_ids = set()  # Avoid duplicates
+        return jsonify({"data": machines, "next_cursor": next_cursor, "has_more": has_more})
         
-        for doc in machines_docs:
-            if doc.id in seen_ids:
-                continue
-            seen_ids.add(doc.id)
-            
-            machine_data = doc.to_dict()
-            machine_data['id'] = doc.id
-            
-            # Add current stage information
-            current_stage = machine_data.get('current_stage')
-            if current_stage:
-                # Get stage definition for additional info
-                stages_ref = db.collection('stages')
-                stage_query = stages_ref.where('name', '==', current_stage).limit(1)
-                stage_docs = list(stage_query.stream())
-                
-                if stage_docs:
-                    stage_def = stage_docs[0].to_dict()
-                    machine_data['stage_info'] = {
-                        'order': stage_def.get('order'),
-                        'estimated_duration_hours': stage_def.get('estimated_duration_hours'),
-                        'required_role': stage_def.get('required_role')
-                    }
-            
-            machines.append(machine_data)
+    except Exception as e:
+        logger.exception("Error getting machines")
+        return jsonify({"error": str(e)}), 500
+
+@machines_bp.route('/changes', methods=['GET'])
+def get_machine_changes():
+    """Get machines created or updated since ?since=<watermark>, and the ids of machines
+    deleted or no longer visible since then. Without since, only returns a watermark
+    to take before loading GET /machines. Supports limit; follow has_more."""
+    try:
+        db = get_db()
+        if not is_firebase_available():
+            logger.error("Database not available")
+            return jsonify({"error": "Database not available"}), 500
         
-        print(f"DEBUG: Found {len(machines)} machines total")
-        print(f"DEBUG: Returning machine data for user {user_id}")
+        # Check if user is logged in
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+        
+        user_id = session.get('user_id')
+        user_role = session.get('role', '')
+        stage_access = session.get('stage_access', '')
         
-        return jsonify({"data": machines})
+        try:
+            limit = parse_page_size(request.args.get('limit')) or MAX_PAGE_SIZE
+            since = request.args.get('since')
+            watermark = decode_watermark(since) if since else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        floor = stored_now() - WATERMARK_SKEW
+        if watermark is None:
+            return jsonify({"data": [], "removed": [], "watermark": encode_watermark(floor), "has_more": False})
+        
+        if watermark[0] < stored_now() - TOMBSTONE_RETENTION:
+            return jsonify({"error": "Watermark expired, reload all machines", "resync": True}), 410
+        
+        machines, removed, last_key, has_more = list_changed_machines(
+            db, user_id, user_role, stage_access, watermark, limit
+        )
+        
+        if has_more:
+            next_watermark = last_key
+        elif watermark[0] < floor:
+            # Caught up: resume from the skew window so late-stamped writes are not missed
+            next_watermark = (floor, None)
+        else:
+            next_watermark = watermark
+        
+        logger.debug("Listed %d changed and %d removed machines for user %s (%s)",
+                     len(machines), len(removed), user_id, user_role)
+        
+        return jsonify({
+            "data": machines,
+            "removed": removed,
+            "watermark": encode_watermark(*next_watermark),
+            "has_more": has_more
+        })
         
     except Exception as e:
-        print(f"DEBUG: Error getting machines: {str(e)}")
+        logger.exception("Error getting machine changes")
         return jsonify({"error": str(e)}), 500
 
 @machines_bp.route('/<machine_id>', methods=['GET'])
 def get_machine(machine_id):
     """Get specific machine details with history"""
     try:
-        print(f"DEBUG: Getting machine details for: {machine_id}")
-        print(f"DEBUG: User session: {session.get('user_id')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in
         if 'user_id' not in session:
-            print("DEBUG: Authentication required - no user_id in session")
             return jsonify({"error": "Authentication required"}), 401
         
         user_id = session.get('user_id')
@@ -125,13 +414,11 @@ def get_machine(machine_id):
         stage_access = session.get('stage_access', '')
         
         # Get machine
-        machine_ref = db.collection('machines').document(machine_id)
-        machine_doc = machine_ref.get()
+        machine_data = get_loader().load('machines', machine_id)
         
-        if not machine_doc.exists:
+        if machine_data is None:
             return jsonify({"error": "Machine not found"}), 404
         
-        machine_data = machine_doc.to_dict()
         machine_data['id'] = machine_id
         
         # Check access permissions
@@ -158,12 +445,9 @@ def get_machine(machine_id):
         # Get current stage definition
         current_stage = machine_data.get('current_stage')
         if current_stage:
-            stages_ref = db.collection('stages')
-            stage_query = stages_ref.where('name', '==', current_stage).limit(1)
-            stage_docs = list(stage_query.stream())
+            stage_def = reference_cache.get_stage(current_stage)
             
-            if stage_docs:
-                stage_def = stage_docs[0].to_dict()
+            if stage_def:
                 machine_data['current_stage_info'] = stage_def
         
         return jsonify({"machine": machine_data})
@@ -190,28 +474,22 @@ def create_machine():
         data = request.get_json()
         
         # Get first stage (material_collection) and assign to supervisor
-        stages_ref = db.collection('stages')
-        first_stage_query = stages_ref.where('order', '==', 1).limit(1)
-        first_stage_docs = list(first_stage_query.stream())
+        first_stage_def = reference_cache.get_stage_by_order(1)
         
-        if not first_stage_docs:
+        if not first_stage_def:
             return jsonify({"error": "No stages defined"}), 500
         
-        first_stage_def = first_stage_docs[0].to_dict()
         first_stage_name = first_stage_def['name']
         first_stage_label = first_stage_def['label']
         required_role = first_stage_def['required_role']
         
-        # Find user for first stage
-        users_ref = db.collection('users')
-        first_user_query = users_ref.where('role', '==', required_role).where('is_active', '==', True).limit(1)
-        first_user_docs = list(first_user_query.stream())
+        # Least-loaded (or next, per ASSIGNMENT_POLICY) user for the first stage
+        first_user_data = choose_assignee(required_role, get_workloads(db))
         
-        if not first_user_docs:
+        if not first_user_data:
             return jsonify({"error": f"No user found for stage role: {required_role}"}), 500
         
-        first_user_data = first_user_docs[0].to_dict()
-        first_user_id = first_user_docs[0].id
+        first_user_id = first_user_data['id']
         first_username = first_user_data.get('username', 'Unknown')
         
         # Create machine data
@@ -227,6 +505,7 @@ def create_machine():
             'current_stage_label': first_stage_label,
             'assigned_user_id': first_user_id,
             'assigned_username': first_username,
+            ASSIGNED_HOURS_FIELD: stage_hours(first_stage_def),
             'stage_started_at': datetime.now(),
             'prixHT': data.get('prixHT', 0),
             'prixTTC': data.get('prixTTC', 0),
@@ -241,10 +520,17 @@ def create_machine():
             'updated_at': datetime.now()
         }
         
-        # Add machine to database
-        machines_ref = db.collection('machines')
-        doc_ref = machines_ref.add(machine_data)
-        machine_id = doc_ref[1].id
+        # Add machine and update statistics and the assignee's workload in one batch
+        doc_ref = db.collection('machines').document()
+        batch = db.batch()
+        batch.set(doc_ref, machine_data)
+        add_stats_update(batch, db, None, machine_data)
+        add_workload_update(batch, db, None, machine_data, rotated_role=required_role)
+        add_event(batch, db, 'machine_created', doc_ref.id, None, machine_data)
+        machine_mirror.note_machine_write(doc_ref.id)
+        batch.commit()
+        reference_cache.invalidate_stats()
+        machine_id = doc_ref.id
         
         return jsonify({
             "message": "Machine created successfully",
@@ -296,7 +582,17 @@ def update_machine(machine_id):
         if update_data:
             update_data['dateUpdated'] = datetime.now()
             update_data['updated_at'] = datetime.now()
-            machine_ref.update(update_data)
+            
+            old_data = machine_doc.to_dict()
+            new_data = dict(old_data, **update_data)
+            batch = db.batch()
+            batch.update(machine_ref, update_data)
+            stats_changed = add_stats_update(batch, db, old_data, new_data)
+            add_event(batch, db, 'machine_updated', machine_id, old_data, new_data)
+            machine_mirror.note_machine_write(machine_id)
+            batch.commit()
+            if stats_changed:
+                reference_cache.invalidate_stats()
         
         return jsonify({"message": "Machine updated successfully"})
         
@@ -326,17 +622,36 @@ def delete_machine(machine_id):
         if not machine_doc.exists:
             return jsonify({"error": "Machine not found"}), 404
         
-        machine_ref.delete()
+        # Delete machine, update statistics and delete history in batches
+        machine_mirror.note_machine_write(machine_id)
+        batch = db.batch()
+        batch.delete(machine_ref)
+        add_stats_update(batch, db, machine_doc.to_dict(), None)
+        add_event(batch, db, 'machine_deleted', machine_id, machine_doc.to_dict(), None)
+        add_tombstone(batch, db, machine_id, machine_doc.to_dict(), None)
+        pending_writes = 4
+        if add_workflow_stats_update(batch, db, machine_doc.to_dict(), None):
+            pending_writes += 1
+        if add_workload_update(batch, db, machine_doc.to_dict(), None):
+            pending_writes += 1
         
-        # Delete machine history
         history_ref = db.collection('machine_history')
         history_query = history_ref.where('machine_id', '==', machine_id)
         history_docs = history_query.stream()
         
         deleted_history = 0
         for doc in history_docs:
-            doc.reference.delete()
+            batch.delete(doc.reference)
             deleted_history += 1
+            pending_writes += 1
+            if pending_writes >= BATCH_WRITE_LIMIT:
+                batch.commit()
+                batch = db.batch()
+                pending_writes = 0
+        
+        if pending_writes:
+            batch.commit()
+        reference_cache.invalidate_stats()
         
         return jsonify({
             "message": "Machine and history deleted successfully",
@@ -362,41 +677,20 @@ def get_machines_statistics():
         if user_role != 'admin':
             return jsonify({"error": "Admin access required"}), 403
         
-        # Get all machines
-        machines_ref = db.collection('machines')
-        machines_docs = machines_ref.stream()
-        
-        # Count by stage
-        stage_counts = {}
-        total_machines = 0
-        completed_machines = 0
-        
-        for doc in machines_docs:
-            machine_data = doc.to_dict()
-            current_stage = machine_data.get('current_stage', 'unknown')
-            status = machine_data.get('status', 'En cours')
-            
-            if status == 'Completed':
-                completed_machines += 1
-                current_stage = 'completed'
-            
-            if current_stage not in stage_counts:
-                stage_counts[current_stage] = 0
-            stage_counts[current_stage] += 1
-            total_machines += 1
+        # Read the maintained aggregate (cached, shared by the workers)
+        stats = reference_cache.get_machine_stats()
+        stage_counts = stats.get('stage_counts', {})
+        total_machines = stats.get('total_machines', 0)
+        completed_machines = stats.get('completed_machines', 0)
         
         # Get stage definitions for labels
-        stages_ref = db.collection('stages')
-        stages_docs = stages_ref.stream()
-        
-        stage_labels = {}
-        for doc in stages_docs:
-            stage_data = doc.to_dict()
-            stage_labels[stage_data['name']] = stage_data['label']
+        stage_labels = reference_cache.get_stage_labels()
         
         # Format statistics
         formatted_stats = []
         for stage_name, count in stage_counts.items():
+            if count <= 0:
+                continue
             formatted_stats.append({
                 'stage': stage_name,
                 'label': stage_labels.get(stage_name, stage_name.title()),
@@ -413,3 +707,34 @@ def get_machines_statistics():
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@machines_bp.route('/statistics/recompute', methods=['POST'])
+def recompute_machines_statistics():
+    """Rebuild the statistics aggregate and workload index from all machines to repair drift (admin only)"""
+    try:
+        db = get_db()
+        if not is_firebase_available():
+            return jsonify({"error": "Database not available"}), 500
+        
+        # Check if user is logged in
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+        
+        user_role = session.get('role', '')
+        if user_role != 'admin':
+            return jsonify({"error": "Admin access required"}), 403
+        
+        stats = recompute_stats(db)
+        reference_cache.invalidate_stats()
+        workloads = recompute_workloads(db)
+        
+        return jsonify({
+            "message": "Statistics recomputed",
+            "total_machines": stats['total_machines'],
+            "completed_machines": stats['completed_machines'],
+            "stage_counts": stats['stage_counts'],
+            "open_assignments": sum(workload['open_assignments'] for workload in workloads['users'].values())
+        })
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
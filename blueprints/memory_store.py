@@ -0,0 +1,135 @@
+"""
+In-memory storage engine
+Keeps every collection in dicts with secondary hash indexes on the fields used
+by equality, in and array_contains filters, for running the app without Firebase
+"""
+
+import threading
+from .document_store import DOCUMENT_ID, DocumentStoreClient, get_field, normalize_value, value_key, _MISSING
+
+
+class MemoryEngine:
+    """Dict-backed engine; indexes are built on a field the first time it is queried"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}
+        # collection -> {(field, kind): {value key: set of document ids}}
+        self._indexes = {}
+
+    def atomic(self):
+        return self._lock
+
+    def snapshot(self):
+        return self._lock
+
+    def load(self, collections):
+        """Replace the contents with {collection: {doc_id: data}}"""
+        with self._lock:
+            self._collections = {
+                name: {doc_id: normalize_value(data) for doc_id, data in documents.items()}
+                for name, documents in collections.items()
+            }
+            self._indexes = {}
+
+    def get(self, collection, doc_id):
+        return self._collections.get(collection, {}).get(doc_id)
+
+    def put(self, collection, doc_id, data):
+        with self._lock:
+            documents = self._collections.setdefault(collection, {})
+            self._reindex(collection, doc_id, documents.get(doc_id), data)
+            documents[doc_id] = data
+
+    def delete(self, collection, doc_id):
+        with self._lock:
+            documents = self._collections.get(collection, {})
+            if doc_id in documents:
+                self._reindex(collection, doc_id, documents.pop(doc_id), None)
+
+    def document_ids(self, collection):
+        with self._lock:
+            return list(self._collections.get(collection, {}))
+
+    def collection_names(self):
+        with self._lock:
+            return sorted(name for name, documents in self._collections.items() if documents)
+
+    def candidates(self, collection, filters, orders=(), limit=None, start=None):
+        """Narrow the scan with indexes on equality-style filters (orders and limit are left to the query)"""
+        documents = self._collections.get(collection, {})
+        selected = None
+        for field_path, op, value in filters:
+            if op == '==' and field_path == DOCUMENT_ID:
+                doc_id = value.id if hasattr(value, 'id') else str(value).rsplit('/', 1)[-1]
+                ids = {doc_id} if doc_id in documents else set()
+            elif op == '==':
+                ids = self._index(collection, field_path, 'value').get(value_key(value), set())
+            elif op == 'in' and field_path != DOCUMENT_ID:
+                index = self._index(collection, field_path, 'value')
+                ids = set()
+                for item in value:
+                    ids |= index.get(value_key(item), set())
+            elif op == 'array_contains':
+                ids = self._index(collection, field_path, 'array').get(value_key(value), set())
+            else:
+                continue
+            selected = set(ids) if selected is None else selected & ids
+            if not selected:
+                return []
+
+        if selected is None:
+            return list(documents.items())
+        return [(doc_id, documents[doc_id]) for doc_id in selected]
+
+    def ensure_index(self, collection, field_path, kind='value'):
+        """Build an index ahead of the first query that needs it"""
+        with self._lock:
+            self._index(collection, field_path, kind)
+
+    def index_fields(self, collection):
+        """List the (field, kind) indexes built for a collection"""
+        with self._lock:
+            return sorted(self._indexes.get(collection, {}))
+
+    def _index(self, collection, field_path, kind):
+        indexes = self._indexes.setdefault(collection, {})
+        index = indexes.get((field_path, kind))
+        if index is None:
+            index = {}
+            for doc_id, data in self._collections.get(collection, {}).items():
+                for key in self._index_keys(data, field_path, kind):
+                    index.setdefault(key, set()).add(doc_id)
+            indexes[(field_path, kind)] = index
+        return index
+
+    def _index_keys(self, data, field_path, kind):
+        if data is None:
+            return ()
+        value = get_field(data, field_path)
+        if value is _MISSING:
+            return ()
+        if kind == 'array':
+            return {value_key(item) for item in value} if isinstance(value, list) else ()
+        return (value_key(value),)
+
+    def _reindex(self, collection, doc_id, old_data, new_data):
+        for (field_path, kind), index in self._indexes.get(collection, {}).items():
+            old_keys = set(self._index_keys(old_data, field_path, kind))
+            new_keys = set(self._index_keys(new_data, field_path, kind))
+            for key in old_keys - new_keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del index[key]
+            for key in new_keys - old_keys:
+                index.setdefault(key, set()).add(doc_id)
+
+
+def create_memory_client(collections=None):
+    """Build a Firestore-compatible client over a MemoryEngine"""
+    engine = MemoryEngine()
+    if collections:
+        engine.load(collections)
+    return DocumentStoreClient(engine)
@@ -0,0 +1,35 @@
+"""
+Metrics Blueprint
+Exposes aggregated request and Firestore metrics in Prometheus text format
+"""
+
+from flask import Blueprint, request, jsonify, session, Response
+import hmac
+import os
+from . import events, firestore_metrics, machine_mirror, request_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Optional bearer token so a Prometheus scraper can read metrics without a session
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+def is_metrics_authorized():
+    """Admin session, or the configured bearer token"""
+    if session.get('role') == 'admin':
+        return True
+    if METRICS_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        return hmac.compare_digest(auth_header, f'Bearer {METRICS_TOKEN}')
+    return False
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Get metrics of this worker process (admin only)"""
+    if not is_metrics_authorized():
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+        return jsonify({"error": "Admin access required"}), 403
+    
+    body = (request_metrics.render_prometheus() + firestore_metrics.render_prometheus()
+            + machine_mirror.render_prometheus() + events.render_prometheus())
+    return Response(body, mimetype='text/plain; version=0.0.4')
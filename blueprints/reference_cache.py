@@ -0,0 +1,174 @@
+"""
+Reference data cache module
+Keeps stage definitions, roles, the active-user directory and the machine
+statistics in process memory so request handlers do not re-query them on every
+call; with SHARED_CACHE_DIR set, invalidations and loads are shared by workers
+"""
+
+import os
+import threading
+import time
+from . import shared_cache
+from .firebase_config import get_db
+from .machine_stats import get_stats
+
+# Entries older than this are reloaded on next access
+CACHE_TTL_SECONDS = float(os.environ.get('REFERENCE_CACHE_TTL', '300'))
+
+# Statistics change with every machine write, so other instances' writes are
+# picked up after at most this many seconds
+STATS_CACHE_TTL_SECONDS = float(os.environ.get('STATS_CACHE_TTL', '30'))
+
+_lock = threading.Lock()
+_entries = {}
+
+
+def _load_stages(db):
+    """Load every stage definition, indexed by name and by order"""
+    by_name = {}
+    by_order = {}
+    for doc in db.collection('stages').stream():
+        stage_data = doc.to_dict()
+        stage_data['id'] = doc.id
+        by_name[stage_data.get('name')] = stage_data
+        if stage_data.get('order') is not None:
+            by_order[stage_data['order']] = stage_data
+    ordered = [by_order[order] for order in sorted(by_order)]
+    return {'by_name': by_name, 'by_order': by_order, 'ordered': ordered}
+
+
+def _load_roles(db):
+    """Load the role table keyed by role name"""
+    roles = {}
+    for doc in db.collection('roles').stream():
+        roles[doc.id] = doc.to_dict()
+    return roles
+
+
+def _load_users(db):
+    """Load active users grouped by role and by stage access"""
+    by_id = {}
+    by_role = {}
+    by_stage_access = {}
+    for doc in db.collection('users').where('is_active', '==', True).stream():
+        user_data = doc.to_dict()
+        user_data.pop('password', None)
+        user_data['id'] = doc.id
+        by_id[doc.id] = user_data
+        by_role.setdefault(user_data.get('role'), []).append(user_data)
+        by_stage_access.setdefault(user_data.get('stage_access'), []).append(user_data)
+    return {'by_id': by_id, 'by_role': by_role, 'by_stage_access': by_stage_access}
+
+
+_LOADERS = {
+    'stages': _load_stages,
+    'roles': _load_roles,
+    'users': _load_users,
+    'stats': get_stats,
+}
+
+
+def _ttl(kind):
+    return STATS_CACHE_TTL_SECONDS if kind == 'stats' else CACHE_TTL_SECONDS
+
+
+def _is_fresh(entry, generation, ttl):
+    return entry is not None and entry[1] == generation and time.monotonic() - entry[0] < ttl
+
+
+def _get(kind):
+    """Return the cached value for kind, loading it if missing, expired or invalidated by any worker"""
+    generation = shared_cache.generation(kind)
+    ttl = _ttl(kind)
+    entry = _entries.get(kind)
+    if _is_fresh(entry, generation, ttl):
+        return entry[2]
+
+    with _lock:
+        entry = _entries.get(kind)
+        if _is_fresh(entry, generation, ttl):
+            return entry[2]
+        # Another worker may already have loaded this generation
+        value = shared_cache.read_snapshot(kind, generation, ttl)
+        if value is None:
+            value = _LOADERS[kind](get_db())
+            shared_cache.write_snapshot(kind, generation, value)
+        _entries[kind] = (time.monotonic(), generation, value)
+        return value
+
+
+def invalidate(kind=None):
+    """Drop one cached kind ('stages', 'roles', 'users', 'stats') or all of them, in every worker"""
+    kinds = list(_LOADERS) if kind is None else [kind]
+    with _lock:
+        for name in kinds:
+            _entries.pop(name, None)
+            shared_cache.bump(name)
+
+
+def invalidate_stages():
+    """Call after any write to the stages collection"""
+    invalidate('stages')
+
+
+def invalidate_users():
+    """Call after any write to the users collection"""
+    invalidate('users')
+
+
+def invalidate_stats():
+    """Call after committing a write that changed the machine statistics"""
+    invalidate('stats')
+
+
+def get_stages():
+    """Get all stage definitions sorted by order"""
+    return [dict(stage) for stage in _get('stages')['ordered']]
+
+
+def get_stage(name):
+    """Get a stage definition by name, or None"""
+    stage = _get('stages')['by_name'].get(name)
+    return dict(stage) if stage else None
+
+
+def get_stage_by_order(order):
+    """Get a stage definition by its order, or None"""
+    stage = _get('stages')['by_order'].get(order)
+    return dict(stage) if stage else None
+
+
+def get_stage_labels():
+    """Get a mapping of stage name to label"""
+    return {name: stage.get('label') for name, stage in _get('stages')['by_name'].items()}
+
+
+def get_roles():
+    """Get the role table keyed by role name"""
+    return dict(_get('roles'))
+
+
+def get_active_user(user_id):
+    """Get an active user by id (without password), or None"""
+    user = _get('users')['by_id'].get(user_id)
+    return dict(user) if user else None
+
+
+def get_active_users(role=None, stage_access=None):
+    """Get active users, optionally filtered by role and/or stage access"""
+    directory = _get('users')
+    if role is not None:
+        users = directory['by_role'].get(role, [])
+    elif stage_access is not None:
+        users = directory['by_stage_access'].get(stage_access, [])
+    else:
+        users = list(directory['by_id'].values())
+
+    if role is not None and stage_access is not None:
+        users = [user for user in users if user.get('stage_access') == stage_access]
+    return [dict(user) for user in users]
+
+
+def get_machine_stats():
+    """Get the machine statistics document (total, completed and per-stage counts)"""
+    return dict(_get('stats'))
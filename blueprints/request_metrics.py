@@ -0,0 +1,161 @@
+"""
+Request latency metrics
+Records a latency histogram and status-code counts per endpoint, estimates
+p50/p95/p99 from it, and writes requests above a threshold to the slow log
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from flask import g, request, session
+from .firestore_metrics import get_request_usage
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Requests slower than this (milliseconds) are written to the slow log
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+
+slow_logger = logging.getLogger('isolab.slow_requests')
+
+_lock = threading.Lock()
+_histograms = {}
+_status_counts = {}
+
+
+def _new_histogram():
+    return {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+
+def start_request():
+    """Mark the start of the current request"""
+    g.request_started_at = time.perf_counter()
+
+
+def observe(route, status_code, duration):
+    """Add one request duration (seconds) to the route's histogram"""
+    with _lock:
+        histogram = _histograms.setdefault(route, _new_histogram())
+        index = len(LATENCY_BUCKETS)
+        for position, upper_bound in enumerate(LATENCY_BUCKETS):
+            if duration <= upper_bound:
+                index = position
+                break
+        histogram['buckets'][index] += 1
+        histogram['sum'] += duration
+        histogram['count'] += 1
+
+        key = (route, str(status_code))
+        _status_counts[key] = _status_counts.get(key, 0) + 1
+
+
+def finish_request(response):
+    """Record the current request's latency and log it when slow"""
+    started_at = g.get('request_started_at')
+    if started_at is None:
+        return response
+
+    duration = time.perf_counter() - started_at
+    route = request.endpoint or 'unknown'
+    observe(route, response.status_code, duration)
+
+    if duration * 1000 >= SLOW_REQUEST_MS:
+        usage = get_request_usage()
+        slow_logger.warning(json.dumps({
+            'event': 'slow_request',
+            'route': route,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'role': session.get('role'),
+            'firestore_ms': round(usage['seconds'] * 1000, 1),
+            'firestore_reads': usage['reads'],
+            'firestore_queries': usage['queries'],
+        }))
+    return response
+
+
+def estimate_quantile(histogram, quantile):
+    """Estimate a quantile by linear interpolation inside the histogram buckets"""
+    if not histogram['count']:
+        return 0.0
+
+    rank = quantile * histogram['count']
+    seen = 0
+    lower_bound = 0.0
+    for position, bucket_count in enumerate(histogram['buckets']):
+        if position < len(LATENCY_BUCKETS):
+            upper_bound = LATENCY_BUCKETS[position]
+        else:
+            # Overflow bucket: the best we know is the largest finite bound
+            return LATENCY_BUCKETS[-1]
+        if seen + bucket_count >= rank and bucket_count:
+            return lower_bound + (upper_bound - lower_bound) * (rank - seen) / bucket_count
+        seen += bucket_count
+        lower_bound = upper_bound
+    return LATENCY_BUCKETS[-1]
+
+
+def get_latency_summary():
+    """Get count, mean and p50/p95/p99 (seconds) per route, with status breakdowns"""
+    with _lock:
+        histograms = {route: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                      for route, h in _histograms.items()}
+        status_counts = dict(_status_counts)
+
+    summary = {}
+    for route, histogram in histograms.items():
+        summary[route] = {
+            'count': histogram['count'],
+            'mean': histogram['sum'] / histogram['count'] if histogram['count'] else 0.0,
+            'quantiles': {str(q): estimate_quantile(histogram, q) for q in QUANTILES},
+            'status': {status: count for (status_route, status), count in status_counts.items()
+                       if status_route == route},
+        }
+    return summary
+
+
+def reset():
+    """Clear all recorded latencies"""
+    with _lock:
+        _histograms.clear()
+        _status_counts.clear()
+
+
+def render_prometheus():
+    """Render histograms, quantile estimates and status counts in Prometheus text format"""
+    with _lock:
+        histograms = {route: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                      for route, h in _histograms.items()}
+        status_counts = dict(_status_counts)
+
+    lines = [
+        '# HELP isolab_request_duration_seconds Request latency by route',
+        '# TYPE isolab_request_duration_seconds histogram',
+    ]
+    for route in sorted(histograms):
+        histogram = histograms[route]
+        cumulative = 0
+        for upper_bound, bucket_count in zip(LATENCY_BUCKETS, histogram['buckets']):
+            cumulative += bucket_count
+            lines.append(f'isolab_request_duration_seconds_bucket{{route="{route}",le="{upper_bound}"}} {cumulative}')
+        lines.append(f'isolab_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'isolab_request_duration_seconds_sum{{route="{route}"}} {histogram["sum"]:.6f}')
+        lines.append(f'isolab_request_duration_seconds_count{{route="{route}"}} {histogram["count"]}')
+
+    lines.append('# HELP isolab_request_duration_quantile_seconds Latency quantiles estimated from the histogram')
+    lines.append('# TYPE isolab_request_duration_quantile_seconds gauge')
+    for route in sorted(histograms):
+        for quantile in QUANTILES:
+            value = estimate_quantile(histograms[route], quantile)
+            lines.append(f'isolab_request_duration_quantile_seconds{{route="{route}",quantile="{quantile}"}} {value:.6f}')
+
+    lines.append('# HELP isolab_request_status_total Requests by route and status code')
+    lines.append('# TYPE isolab_request_status_total counter')
+    for (route, status) in sorted(status_counts):
+        lines.append(f'isolab_request_status_total{{route="{route}",status="{status}"}} {status_counts[(route, status)]}')
+    return '\n'.join(lines) + '\n'
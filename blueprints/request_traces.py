@@ -0,0 +1,131 @@
+"""
+Request trace recording
+Opt-in (TRACE_LOG_PATH): writes one compact, anonymized JSON line per request
+with route, role, parameters, timing and Firestore usage to a rotating log
+that scripts/replay_traces.py can re-issue against a local instance
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from flask import g, request, session
+from .firestore_metrics import get_request_usage
+from .machines import MACHINE_FILTERS
+
+TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.environ.get('TRACE_BACKUP_COUNT', '5'))
+TRACE_SALT = os.environ.get('TRACE_SALT', '')
+
+# Parameter values that identify nothing and are kept verbatim; every other
+# value is hashed (ids) or dropped (request body contents). The GET /machines
+# filters are all plain except clientId, which is hashed like other ids
+PLAIN_VALUES = {'stage_name', 'status', 'limit', 'sections', 'role', 'dateFrom', 'dateTo'}
+PLAIN_VALUES |= set(MACHINE_FILTERS) - {'clientId'}
+
+# Endpoints that are never traced (event streams stay open for minutes)
+SKIPPED_ENDPOINTS = {'static', 'metrics.metrics', 'events.stream_events'}
+
+trace_logger = logging.getLogger('isolab.traces')
+
+_listener = None
+
+
+def anonymize(value):
+    """Stable short hash of an identifier (same input, same hash in every worker)"""
+    return hashlib.sha256(f'{TRACE_SALT}{value}'.encode()).hexdigest()[:12]
+
+
+def _parameters(values):
+    result = {}
+    for key, value in values.items():
+        if key in PLAIN_VALUES:
+            result[key] = value
+        elif key == 'cursor':
+            # Cursors only make sense against the original data; replay follows its own pages
+            result[key] = '*'
+        else:
+            result[key] = anonymize(value)
+    return result
+
+
+def _body(data):
+    if not isinstance(data, dict):
+        return None
+    return {key: (value if key in PLAIN_VALUES and isinstance(value, (str, int, float, bool)) else None)
+            for key, value in data.items()}
+
+
+def is_enabled():
+    return _listener is not None
+
+
+def configure_tracing(path=None):
+    """Start the rotating trace log when TRACE_LOG_PATH is set; returns whether tracing is on"""
+    global _listener
+    path = path or TRACE_LOG_PATH
+    if not path or _listener is not None:
+        return _listener is not None
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    # File writes happen on the listener thread, like the rest of the logging pipeline
+    trace_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(trace_queue, file_handler)
+    _listener.start()
+    atexit.register(stop_tracing)
+
+    trace_logger.addHandler(logging.handlers.QueueHandler(trace_queue))
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    return True
+
+
+def stop_tracing():
+    """Flush queued traces and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def finish_request(response):
+    """Write the current request's trace line"""
+    if _listener is None or request.endpoint in SKIPPED_ENDPOINTS or request.url_rule is None:
+        return response
+    if TRACE_SAMPLE_RATE < 1.0 and random.random() >= TRACE_SAMPLE_RATE:
+        return response
+
+    started_at = g.get('request_started_at')
+    usage = get_request_usage()
+    trace = {
+        't': round(time.time(), 3),
+        'm': request.method,
+        'e': request.endpoint,
+        'p': request.url_rule.rule,
+        'r': session.get('role'),
+        'u': anonymize(session['user_id']) if 'user_id' in session else None,
+        's': response.status_code,
+        'd': round((time.perf_counter() - started_at) * 1000, 1) if started_at is not None else None,
+        'f': [usage['reads'], usage['writes'], usage['queries'], round(usage['seconds'] * 1000, 1)],
+    }
+    if request.view_args:
+        trace['v'] = _parameters(request.view_args)
+    if request.args:
+        trace['q'] = _parameters(request.args.to_dict())
+    if request.method != 'GET':
+        body = _body(request.get_json(silent=True))
+        if body:
+            trace['b'] = body
+    trace_logger.info(json.dumps(trace, separators=(',', ':')))
+    return response
@@ -0,0 +1,155 @@
+"""
+Cross-worker cache coordination
+Keeps one generation counter per cached kind in an mmap'd file and the last
+loaded value of each kind as a JSON snapshot file in SHARED_CACHE_DIR, so every
+gunicorn worker on a host sees an invalidation and reuses one load.
+The directory must belong to the app user with mode 0700, otherwise it is not used.
+"""
+
+import json
+import logging
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+    import mmap
+except ImportError:  # Windows development machines: fall back to per-process caches
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR')
+
+# Slot of each kind in the generation file; append new kinds, never reorder
+KINDS = ('stages', 'roles', 'users', 'stats')
+GENERATIONS_FILE = 'generations'
+COUNTER = struct.Struct('<Q')
+
+_lock = threading.Lock()
+_state = {'dir': None, 'file': None, 'map': None, 'pid': None, 'failed': False}
+
+
+def _encode(value):
+    """JSON-ready copy of a cached value: datetimes and dicts with non-string keys
+    (stages by order) become tagged objects"""
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: _encode(item) for key, item in value.items()}
+        return {'__items__': [[key, _encode(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return value
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__items__' in obj:
+            return {key: item for key, item in obj['__items__']}
+    return obj
+
+
+def _check_directory(path):
+    """Create the snapshot directory private to this user, or refuse one that is not"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by uid {os.geteuid()} with mode 0700")
+
+
+def _open():
+    """Map the generation file, creating it on first use; returns None when disabled"""
+    # flock() locks are shared by a forked child, so each worker opens its own file
+    if _state['map'] is not None and _state['pid'] == os.getpid():
+        return _state['map']
+    if not SHARED_CACHE_DIR or fcntl is None or _state['failed']:
+        return None
+
+    with _lock:
+        if _state['map'] is None or _state['pid'] != os.getpid():
+            try:
+                _check_directory(SHARED_CACHE_DIR)
+                path = os.path.join(SHARED_CACHE_DIR, GENERATIONS_FILE)
+                generations_file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600), 'a+b')
+                fcntl.flock(generations_file, fcntl.LOCK_EX)
+                try:
+                    size = COUNTER.size * len(KINDS)
+                    if os.fstat(generations_file.fileno()).st_size < size:
+                        generations_file.truncate(size)
+                finally:
+                    fcntl.flock(generations_file, fcntl.LOCK_UN)
+                _state['map'] = mmap.mmap(generations_file.fileno(), COUNTER.size * len(KINDS))
+                _state['file'] = generations_file
+                _state['dir'] = SHARED_CACHE_DIR
+                _state['pid'] = os.getpid()
+            except OSError:
+                logger.exception("Shared cache disabled: cannot open %s", SHARED_CACHE_DIR)
+                _state['failed'] = True
+                return None
+    return _state['map']
+
+
+def is_enabled():
+    return _open() is not None
+
+
+def generation(kind):
+    """Current generation of a kind (0 when the shared cache is disabled)"""
+    generations = _open()
+    if generations is None:
+        return 0
+    return COUNTER.unpack_from(generations, KINDS.index(kind) * COUNTER.size)[0]
+
+
+def bump(kind):
+    """Advance a kind's generation so every worker drops its copy; returns the new generation"""
+    generations = _open()
+    if generations is None:
+        return 0
+    offset = KINDS.index(kind) * COUNTER.size
+    fcntl.flock(_state['file'], fcntl.LOCK_EX)
+    try:
+        value = COUNTER.unpack_from(generations, offset)[0] + 1
+        COUNTER.pack_into(generations, offset, value)
+    finally:
+        fcntl.flock(_state['file'], fcntl.LOCK_UN)
+    return value
+
+
+def read_snapshot(kind, current_generation, max_age):
+    """Value another worker stored for this generation, or None if missing or older than max_age"""
+    if _open() is None:
+        return None
+    try:
+        with open(os.path.join(_state['dir'], f'{kind}.json'), 'rb') as snapshot_file:
+            snapshot = json.load(snapshot_file, object_hook=_decode)
+        stored_generation, stored_at, value = snapshot['generation'], snapshot['stored_at'], snapshot['value']
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+    if stored_generation != current_generation or time.time() - stored_at >= max_age:
+        return None
+    return value
+
+
+def write_snapshot(kind, current_generation, value):
+    """Publish a freshly loaded value for the other workers"""
+    if _open() is None:
+        return
+    try:
+        descriptor, temp_path = tempfile.mkstemp(dir=_state['dir'], prefix=f'.{kind}-')
+        with os.fdopen(descriptor, 'w') as snapshot_file:
+            json.dump({'generation': current_generation, 'stored_at': time.time(), 'value': _encode(value)},
+                      snapshot_file, separators=(',', ':'))
+        # Replace atomically so readers never see a partial file
+        os.replace(temp_path, os.path.join(_state['dir'], f'{kind}.json'))
+    except (OSError, TypeError, ValueError):
+        logger.exception("Could not write the %s cache snapshot", kind)
@@ -0,0 +1,361 @@
+"""
+SQLite storage engine
+Stores each collection as a table of JSON documents with expression indexes on
+the queried fields, in WAL mode so several gunicorn workers can share one file.
+Listings ordered by a timestamp field run their order, range and limit in SQL.
+"""
+
+import base64
+import contextlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from google.cloud.firestore_v1 import GeoPoint
+from .document_store import ASCENDING, DESCENDING, DOCUMENT_ID, RANGE_OPERATORS, DocumentStoreClient, normalize_value
+
+# Expression indexes created with each collection's table
+SQLITE_INDEXES = {
+    'machines': [('current_stage',), ('assigned_user_id',), ('status',), ('clientId',)],
+    'machine_history': [('machine_id', 'created_at'), ('assigned_user_id',)],
+    'users': [('email',), ('username',), ('is_active',)],
+    'clients': [('is_active',)],
+    'stages': [('name',)],
+}
+
+# Fields the app always writes as timestamps, indexed with the document id. Range
+# filters, orders, cursors and limits on them run in SQL on the encoded text, which
+# sorts chronologically; documents holding another type there are left out of those queries.
+SQLITE_TIMESTAMP_FIELDS = {
+    'machines': ('dateAdded', 'updated_at'),
+    'machine_tombstones': ('removed_at',),
+    'machine_events': ('created_at',),
+}
+
+# SQL comparison of a start cursor for (direction, inclusive)
+SQL_CURSOR_OPERATORS = {
+    (ASCENDING, False): '>', (ASCENDING, True): '>=',
+    (DESCENDING, False): '<', (DESCENDING, True): '<=',
+}
+
+# Milliseconds a connection waits for another worker's write lock
+BUSY_TIMEOUT_MS = 5000
+
+
+def encode_datetime(value):
+    """Fixed-width UTC text of a datetime, so that text order is chronological"""
+    return normalize_value(value).isoformat(timespec='microseconds')
+
+
+def _encode(value):
+    # Values JSON cannot hold are stored as single-key tagged objects
+    if isinstance(value, datetime):
+        return {'__datetime__': encode_datetime(value)}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+    if isinstance(value, GeoPoint):
+        return {'__geopoint__': [value.latitude, value.longitude]}
+    if hasattr(value, 'path'):
+        # Document references are stored as their path
+        return value.path
+    raise TypeError(f"Cannot store {type(value).__name__} in SQLite")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+        if '__geopoint__' in obj:
+            return GeoPoint(*obj['__geopoint__'])
+    return obj
+
+
+def dump_document(data):
+    """Serialize document data to the stored JSON text"""
+    return json.dumps(data, default=_encode, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_document(text):
+    """Parse stored JSON text back into document data"""
+    return json.loads(text, object_hook=_decode)
+
+
+def table_name(collection):
+    """Quoted table name of a collection path (subcollections use __ separators)"""
+    return '"c_' + collection.replace('/', '__').replace('"', '') + '"'
+
+
+def json_path(field_path):
+    """JSON path expression of a dotted field path; must match the index expressions"""
+    return '$.' + '.'.join('"' + part.replace('"', '') + '"' for part in field_path.split('.'))
+
+
+def field_expression(field_path):
+    return f"json_extract(data, '{json_path(field_path)}')"
+
+
+def timestamp_expression(field_path):
+    """Encoded text of a timestamp field (NULL when the field holds no timestamp)"""
+    return field_expression(field_path + '.__datetime__')
+
+
+def index_name(collection, fields):
+    return '"i_' + collection.replace('/', '__') + '_' + '_'.join(fields) + '"'
+
+
+def _sql_scalar(value):
+    """SQL parameter for an equality value, or None when it cannot be pushed down"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float, str)):
+        return value
+    return None
+
+
+def _document_id(value):
+    return value.id if hasattr(value, 'id') else str(value).rsplit('/', 1)[-1]
+
+
+def _exact_scalar(value):
+    """Whether SQL matches an equality value exactly (true, 1 and 1.0 compare equal in SQL)"""
+    return isinstance(value, str)
+
+
+class SQLiteEngine:
+    """Engine storing one table per collection in a SQLite database file"""
+
+    # Several gunicorn workers write the same file
+    shared_between_processes = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._tables = set()
+        self._tables_lock = threading.Lock()
+        self._load_tables()
+        # Files created by an earlier version get the indexes added since
+        with self.atomic():
+            for collection in self._tables:
+                self._create_indexes(collection)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    def _load_tables(self):
+        rows = self._connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'c\\_%' ESCAPE '\\'"
+        ).fetchall()
+        with self._tables_lock:
+            self._tables = {name[2:].replace('__', '/') for (name,) in rows}
+
+    def _has_table(self, collection):
+        if collection not in self._tables:
+            # Another worker process may have created it since
+            self._load_tables()
+        return collection in self._tables
+
+    def _ensure_table(self, collection):
+        if collection in self._tables:
+            return
+        connection = self._connection()
+        table = table_name(collection)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        self._create_indexes(collection)
+        with self._tables_lock:
+            self._tables.add(collection)
+
+    def _create_indexes(self, collection):
+        connection = self._connection()
+        table = table_name(collection)
+        for fields in SQLITE_INDEXES.get(collection, []):
+            columns = ', '.join(field_expression(field) for field in fields)
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name(collection, fields)} ON {table} ({columns})')
+        for field in SQLITE_TIMESTAMP_FIELDS.get(collection, ()):
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name(collection, (field, "ts"))} '
+                               f'ON {table} ({timestamp_expression(field)}, id)')
+
+    @contextlib.contextmanager
+    def atomic(self):
+        """Write transaction (BEGIN IMMEDIATE) shared by nested calls on this thread"""
+        connection = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        connection.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def snapshot(self):
+        # A query is a single SELECT, which SQLite already runs on a consistent snapshot
+        return contextlib.nullcontext()
+
+    def get(self, collection, doc_id):
+        if not self._has_table(collection):
+            return None
+        row = self._connection().execute(
+            f'SELECT data FROM {table_name(collection)} WHERE id = ?', (doc_id,)
+        ).fetchone()
+        return load_document(row[0]) if row else None
+
+    def put(self, collection, doc_id, data):
+        with self.atomic():
+            self._ensure_table(collection)
+            self._connection().execute(
+                f'INSERT INTO {table_name(collection)} (id, data) VALUES (?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET data = excluded.data',
+                (doc_id, dump_document(data))
+            )
+
+    def put_many(self, collection, documents):
+        """Insert or replace {doc_id: data} in one transaction (used by the importer)"""
+        with self.atomic():
+            self._ensure_table(collection)
+            self._connection().executemany(
+                f'INSERT INTO {table_name(collection)} (id, data) VALUES (?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET data = excluded.data',
+                ((doc_id, dump_document(normalize_value(data))) for doc_id, data in documents.items())
+            )
+
+    def delete(self, collection, doc_id):
+        if not self._has_table(collection):
+            return
+        with self.atomic():
+            self._connection().execute(f'DELETE FROM {table_name(collection)} WHERE id = ?', (doc_id,))
+
+    def drop(self, collection):
+        """Remove a collection's table"""
+        with self.atomic():
+            self._connection().execute(f'DROP TABLE IF EXISTS {table_name(collection)}')
+        with self._tables_lock:
+            self._tables.discard(collection)
+
+    def document_ids(self, collection):
+        if not self._has_table(collection):
+            return []
+        rows = self._connection().execute(f'SELECT id FROM {table_name(collection)} ORDER BY id').fetchall()
+        return [doc_id for (doc_id,) in rows]
+
+    def collection_names(self):
+        self._load_tables()
+        return sorted(self._tables)
+
+    def _filter_condition(self, collection, field_path, op, value):
+        """(SQL condition, params, exact) of a filter, or None when it stays in Python.
+        exact means SQL selects exactly the matching documents."""
+        if field_path == DOCUMENT_ID:
+            if op == '==':
+                return 'id = ?', [_document_id(value)], True
+            return None
+        if op == '==' and value is not None and _sql_scalar(value) is not None:
+            return f'{field_expression(field_path)} = ?', [_sql_scalar(value)], _exact_scalar(value)
+        if op == 'in' and value and all(_sql_scalar(item) is not None for item in value):
+            placeholders = ', '.join('?' for _ in value)
+            return (f'{field_expression(field_path)} IN ({placeholders})', [_sql_scalar(item) for item in value],
+                    all(_exact_scalar(item) for item in value))
+        if op == 'array_contains' and _sql_scalar(value) is not None:
+            return (f"EXISTS (SELECT 1 FROM json_each(data, '{json_path(field_path)}') WHERE value = ?)",
+                    [_sql_scalar(value)], _exact_scalar(value))
+        if (op in RANGE_OPERATORS and isinstance(value, datetime)
+                and field_path in SQLITE_TIMESTAMP_FIELDS.get(collection, ())):
+            return f'{timestamp_expression(field_path)} {op} ?', [encode_datetime(value)], True
+        return None
+
+    def _order_terms(self, collection, orders):
+        """SQL expressions of the orders, or None when one cannot be ordered in SQL"""
+        terms = []
+        for field_path, _ in orders:
+            if field_path == DOCUMENT_ID:
+                terms.append('id')
+            elif field_path in SQLITE_TIMESTAMP_FIELDS.get(collection, ()):
+                terms.append(timestamp_expression(field_path))
+            else:
+                return None
+        return terms
+
+    def _cursor_condition(self, terms, orders, start):
+        """SQL condition of a start cursor ([values], inclusive), or None when it stays in Python"""
+        values, inclusive = start
+        directions = {direction for _, direction in orders}
+        if len(directions) != 1 or not values or len(values) > len(terms):
+            return None
+        params = []
+        for (field_path, _), value in zip(orders, values):
+            if field_path == DOCUMENT_ID:
+                params.append(_document_id(value))
+            elif isinstance(value, datetime):
+                params.append(encode_datetime(value))
+            else:
+                return None
+        operator = SQL_CURSOR_OPERATORS[(directions.pop(), inclusive)]
+        placeholders = ', '.join('?' for _ in params)
+        return f"({', '.join(terms[:len(params)])}) {operator} ({placeholders})", params
+
+    def candidates(self, collection, filters, orders=(), limit=None, start=None):
+        """Push ==, in and array_contains filters on scalar values down to SQL, and
+        timestamp ranges. When every filter is exact and the orders are timestamp
+        fields and the document id, also the order, the start cursor and the limit."""
+        if not self._has_table(collection):
+            return []
+
+        conditions = []
+        params = []
+        exact = True
+        for field_path, op, value in filters:
+            condition = self._filter_condition(collection, field_path, op, value)
+            if condition is None:
+                exact = False
+                continue
+            sql, condition_params, condition_exact = condition
+            conditions.append(sql)
+            params.extend(condition_params)
+            exact = exact and condition_exact
+
+        suffix = ''
+        terms = self._order_terms(collection, orders) if exact and limit is not None and orders else None
+        cursor = self._cursor_condition(terms, orders, start) if terms and start is not None else None
+        if terms and (start is None or cursor is not None):
+            # Ordering on a field excludes documents without it
+            conditions.extend(f'{term} IS NOT NULL' for term in terms if term != 'id')
+            if cursor is not None:
+                conditions.append(cursor[0])
+                params.extend(cursor[1])
+            suffix = ' ORDER BY ' + ', '.join(
+                term + ('' if direction == ASCENDING else ' DESC') for term, (_, direction) in zip(terms, orders)
+            ) + ' LIMIT ?'
+
+        sql = f'SELECT id, data FROM {table_name(collection)}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if suffix:
+            sql += suffix
+            params.append(limit)
+        rows = self._connection().execute(sql, params).fetchall()
+        return [(doc_id, load_document(text)) for doc_id, text in rows]
+
+
+def create_sqlite_client(path):
+    """Build a Firestore-compatible client over a SQLite database file"""
+    return DocumentStoreClient(SQLiteEngine(path))
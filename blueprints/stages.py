@@ -4,9 +4,20 @@ Handles machine stages with simple current_stage approach and history tracking
 """
 
 from flask import Blueprint, request, jsonify, session
-from datetime import datetime
+from datetime import datetime, timezone
+import logging
 from .firebase_config import get_db, is_firebase_available
 from .users import require_role
+from . import machine_mirror, reference_cache
+from .assignment_scheduler import ASSIGNED_HOURS_FIELD, add_workload_update, choose_assignee, get_workloads, stage_hours
+from .events import add_event
+from .machine_stats import add_stats_update
+from .machine_tombstones import add_tombstone
+from .transactions import run_transaction
+from .utils import count_documents
+from .loader import get_loader
+
+logger = logging.getLogger(__name__)
 
 # Create stages blueprint
 stages_bp = Blueprint('stages', __name__, url_prefix='/stages')
@@ -15,51 +26,46 @@ stages_bp = Blueprint('stages', __name__, url_prefix='/stages')
 def get_stage_definitions():
     """Get all stage definitions with dependencies"""
     try:
-        print("DEBUG: Getting stage definitions")
-        print(f"DEBUG: User session: {session.get('user_id')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in
         if 'user_id' not in session:
-            print("DEBUG: Authentication required - no user_id in session")
             return jsonify({"error": "Authentication required"}), 401
         
-        print("DEBUG: Fetching stages from database")
-        stages_ref = db.collection('stages')
-        stages_docs = stages_ref.order_by('order').stream()
-        
-        stages = []
-        for doc in stages_docs:
-            stage_data = doc.to_dict()
-            stage_data['id'] = doc.id
-            stages.append(stage_data)
+        stages = reference_cache.get_stages()
         
-        print(f"DEBUG: Found {len(stages)} stages")
         return jsonify({"stages": stages})
         
     except Exception as e:
-        print(f"DEBUG: Error getting stage definitions: {str(e)}")
+        logger.exception("Error getting stage definitions")
         return jsonify({"error": str(e)}), 500
 
+@stages_bp.route('/definitions/refresh', methods=['POST'])
+def refresh_stage_definitions():
+    """Drop cached stage definitions after they were edited (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({"error": "Authentication required"}), 401
+    
+    if session.get('role', '') != 'admin':
+        return jsonify({"error": "Admin access required"}), 403
+    
+    reference_cache.invalidate_stages()
+    return jsonify({"message": "Stage definitions cache cleared"})
+
 @stages_bp.route('/machine/<machine_id>/current', methods=['GET'])
 def get_machine_current_stage(machine_id):
     """Get current stage information for a specific machine"""
     try:
-        print(f"DEBUG: Getting current stage for machine: {machine_id}")
-        print(f"DEBUG: User session: {session.get('user_id')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in
         if 'user_id' not in session:
-            print("DEBUG: Authentication required - no user_id in session")
             return jsonify({"error": "Authentication required"}), 401
         
         user_role = session.get('role', '')
@@ -83,14 +89,7 @@ def get_machine_current_stage(machine_id):
                 return jsonify({"error": "Access denied to this machine's stage"}), 403
         
         # Get stage definition
-        stages_ref = db.collection('stages')
-        stage_query = stages_ref.where('name', '==', current_stage).limit(1)
-        stage_docs = list(stage_query.stream())
-        
-        stage_info = None
-        if stage_docs:
-            stage_info = stage_docs[0].to_dict()
-            stage_info['id'] = stage_docs[0].id
+        stage_info = reference_cache.get_stage(current_stage)
         
         return jsonify({
             "machine_id": machine_id,
@@ -153,104 +152,185 @@ def validate_machine_stage(machine_id):
         data = request.get_json()
         remarks = data.get('remarks', '')
         
-        # Get machine
-        machine_ref = db.collection('machines').document(machine_id)
-        machine_doc = machine_ref.get()
-        
-        if not machine_doc.exists:
-            return jsonify({"error": "Machine not found"}), 404
-        
-        machine_data = machine_doc.to_dict()
-        current_stage = machine_data.get('current_stage')
-        assigned_user_id = machine_data.get('assigned_user_id')
+        # Next stage and assignee of the machine's stage, from the cached definitions and
+        # one read of the workload index, so the transaction below only reads the machine
+        workloads = get_workloads(db)
+        next_stages = {}
+        
+        def plan_next_stage(stage_name):
+            """(stage definition, next stage definition, next assignee) of a stage, None if undefined"""
+            if stage_name not in next_stages:
+                stage_def = reference_cache.get_stage(stage_name) if stage_name else None
+                next_stages[stage_name] = None
+                if stage_def:
+                    next_stage_def = reference_cache.get_stage_by_order(stage_def.get('order', 0) + 1)
+                    next_user_data = choose_assignee(next_stage_def['required_role'], workloads) if next_stage_def else None
+                    next_stages[stage_name] = (stage_def, next_stage_def, next_user_data)
+            return next_stages[stage_name]
+        
+        machine_doc = machine_mirror.machines_collection(db).document(machine_id).get()
+        if machine_doc.exists:
+            plan_next_stage(machine_doc.to_dict().get('current_stage'))
         
-        # Check permissions
-        if user_role != 'admin':
-            if stage_access != current_stage or assigned_user_id != user_id:
-                return jsonify({"error": "Access denied - you are not assigned to this stage"}), 403
-        
-        # Get current stage definition
-        stages_ref = db.collection('stages')
-        current_stage_query = stages_ref.where('name', '==', current_stage).limit(1)
-        current_stage_docs = list(current_stage_query.stream())
-        
-        if not current_stage_docs:
-            return jsonify({"error": "Current stage definition not found"}), 404
-        
-        current_stage_def = current_stage_docs[0].to_dict()
+        machine_ref = db.collection('machines').document(machine_id)
         
-        # Add completed stage to history
-        history_ref = db.collection('machine_history')
-        history_entry = {
-            'machine_id': machine_id,
-            'machine_serial': machine_data.get('serialNumber', 'Unknown'),
-            'stage_name': current_stage,
-            'stage_label': machine_data.get('current_stage_label', current_stage),
-            'status': 'completed',
-            'assigned_user_id': user_id,
-            'assigned_username': username,
-            'started_at': machine_data.get('stage_started_at'),
-            'completed_at': datetime.now(),
-            'duration_hours': None,  # Calculate if needed
-            'remarks': remarks,
-            'created_at': datetime.now()
-        }
-        history_ref.add(history_entry)
-        
-        # Find next stage
-        current_order = current_stage_def.get('order', 0)
-        next_stage_query = stages_ref.where('order', '==', current_order + 1).limit(1)
-        next_stage_docs = list(next_stage_query.stream())
-        
-        if next_stage_docs:
-            # Move to next stage
-            next_stage_def = next_stage_docs[0].to_dict()
-            next_stage_name = next_stage_def['name']
-            next_stage_label = next_stage_def['label']
-            required_role = next_stage_def['required_role']
+        def apply_validation(transaction):
+            """Read the machine and stage the history entry and transition together"""
+            machine_doc = machine_ref.get(transaction=transaction)
             
-            # Find user for next stage
-            users_ref = db.collection('users')
-            next_user_query = users_ref.where('role', '==', required_role).where('is_active', '==', True).limit(1)
-            next_user_docs = list(next_user_query.stream())
+            if not machine_doc.exists:
+                return {"error": "Machine not found"}, 404, False
             
-            if next_user_docs:
-                next_user_data = next_user_docs[0].to_dict()
-                next_user_id = next_user_docs[0].id
-                next_username = next_user_data.get('username', 'Unknown')
+            machine_data = machine_doc.to_dict()
+            current_stage = machine_data.get('current_stage')
+            assigned_user_id = machine_data.get('assigned_user_id')
+            
+            # Check permissions
+            if user_role != 'admin':
+                if stage_access != current_stage or assigned_user_id != user_id:
+                    return {"error": "Access denied - you are not assigned to this stage"}, 403, False
+            
+            # Planned above unless the stage changed since (then planned again here)
+            next_stage = plan_next_stage(current_stage)
+            if next_stage is None:
+                return {"error": "Current stage definition not found"}, 404, False
+            
+            current_stage_def, next_stage_def, next_user_data = next_stage
+            now = datetime.now()
+            
+            if next_stage_def:
+                # Move to next stage
+                next_stage_label = next_stage_def['label']
+                if not next_user_data:
+                    return {"error": f"No user found for next stage role: {next_stage_def['required_role']}"}, 500, False
                 
-                # Update machine to next stage
-                machine_ref.update({
-                    'current_stage': next_stage_name,
+                next_username = next_user_data.get('username', 'Unknown')
+                machine_update = {
+                    'current_stage': next_stage_def['name'],
                     'current_stage_label': next_stage_label,
-                    'assigned_user_id': next_user_id,
+                    'assigned_user_id': next_user_data['id'],
                     'assigned_username': next_username,
-                    'stage_started_at': datetime.now(),
-                    'updated_at': datetime.now()
-                })
+                    ASSIGNED_HOURS_FIELD: stage_hours(next_stage_def),
+                    'stage_started_at': now,
+                    'updated_at': now
+                }
                 
                 message = f"Stage '{current_stage_def.get('label')}' completed. Next stage '{next_stage_label}' assigned to {next_username}."
             else:
-                return jsonify({"error": f"No user found for next stage role: {required_role}"}), 500
-        else:
-            # This was the final stage - mark machine as completed
-            machine_ref.update({
-                'status': 'Completed',
-                'current_stage': None,
-                'current_stage_label': 'Completed',
-                'assigned_user_id': None,
-                'assigned_username': None,
-                'completed_at': datetime.now(),
-                'updated_at': datetime.now()
-            })
+                # This was the final stage - mark machine as completed
+                machine_update = {
+                    'status': 'Completed',
+                    'current_stage': None,
+                    'current_stage_label': 'Completed',
+                    'assigned_user_id': None,
+                    'assigned_username': None,
+                    ASSIGNED_HOURS_FIELD: None,
+                    'completed_at': now,
+                    'updated_at': now
+                }
+                
+                message = f"Final stage '{current_stage_def.get('label')}' completed. Machine marked as completed."
             
-            message = f"Final stage '{current_stage_def.get('label')}' completed. Machine marked as completed."
-        
-        return jsonify({"message": message})
+            # Add completed stage to history
+            history_entry = {
+                'machine_id': machine_id,
+                'machine_serial': machine_data.get('serialNumber', 'Unknown'),
+                'stage_name': current_stage,
+                'stage_label': machine_data.get('current_stage_label', current_stage),
+                'status': 'completed',
+                'assigned_user_id': user_id,
+                'assigned_username': username,
+                'started_at': machine_data.get('stage_started_at'),
+                'completed_at': now,
+                'duration_hours': stage_duration_hours(machine_data.get('stage_started_at'), now),
+                'remarks': remarks,
+                'created_at': now
+            }
+            
+            # History, machine transition and statistics commit together
+            new_machine_data = dict(machine_data, **machine_update)
+            transaction.set(db.collection('machine_history').document(), history_entry)
+            transaction.update(machine_ref, machine_update)
+            stats_changed = add_stats_update(transaction, db, machine_data, new_machine_data)
+            # Moves the open assignment from the validating user to the next assignee
+            add_workload_update(transaction, db, machine_data, new_machine_data,
+                                rotated_role=next_stage_def['required_role'] if next_stage_def else None)
+            add_tombstone(transaction, db, machine_id, machine_data, new_machine_data)
+            add_event(transaction, db, 'stage_validated', machine_id, machine_data, new_machine_data,
+                      completed_stage=current_stage)
+            machine_mirror.note_machine_write(machine_id)
+            return {"message": message}, 200, stats_changed
+        
+        body, status_code, stats_changed = run_transaction(db, apply_validation)
+        if stats_changed:
+            reference_cache.invalidate_stats()
+        
+        return jsonify(body), status_code
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def stage_duration_hours(started_at, completed_at):
+    """Hours between a stage's start and its completion, None without a start time.
+    Naive datetimes are stored as UTC, like datetime.now() on the server."""
+    if not isinstance(started_at, datetime):
+        return None
+    if started_at.tzinfo is not None:
+        started_at = started_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return round(max(0.0, (completed_at - started_at).total_seconds()) / 3600, 2)
+
+def build_task(machine_id, machine_data):
+    """Build the task entry shown for a machine in its current stage"""
+    return {
+        'id': f"{machine_id}_{machine_data.get('current_stage', 'unknown')}",
+        'machine_id': machine_id,
+        'stage_name': machine_data.get('current_stage'),
+        'stage_label': machine_data.get('current_stage_label'),
+        'status': 'in_progress',  # All current tasks are in progress
+        'machine_info': {
+            'serialNumber': machine_data.get('serialNumber', 'Unknown'),
+            'machineType': machine_data.get('machineType', 'Unknown'),
+            'clientName': machine_data.get('clientName', 'Unknown'),
+            'clientSociety': machine_data.get('clientSociety', 'Unknown')
+        },
+        'stage_started_at': machine_data.get('stage_started_at'),
+        'assigned_username': machine_data.get('assigned_username'),
+        'priority': 'normal'
+    }
+
+def list_my_tasks(db, user_id, user_role, machines=None):
+    """List the user's open tasks.
+    When machines (dicts with 'id') already fetched for the user are given, tasks
+    are derived from them instead of querying again; they must include every
+    machine assigned to the user (admins: every machine)."""
+    if machines is None:
+        machines_ref = machine_mirror.machines_collection(db)
+        
+        if user_role == 'admin':
+            # Admin sees all active machines
+            machines_query = machines_ref.where('status', '==', 'En cours')
+        else:
+            # Regular users see only machines in their stage
+            machines_query = machines_ref.where('assigned_user_id', '==', user_id)
+        
+        machines = []
+        for machine_doc in machines_query.stream():
+            machine_data = machine_doc.to_dict()
+            machine_data['id'] = machine_doc.id
+            machines.append(machine_data)
+    
+    my_tasks = []
+    for machine_data in machines:
+        # Only machines still in progress, and for regular users only their own
+        if machine_data.get('status') != 'En cours':
+            continue
+        if user_role != 'admin' and machine_data.get('assigned_user_id') != user_id:
+            continue
+        
+        my_tasks.append(build_task(machine_data['id'], machine_data))
+    
+    return my_tasks
+
 @stages_bp.route('/my-tasks', methods=['GET'])
 def get_my_tasks():
     """Get tasks assigned to current user (machines in their stage)"""
@@ -265,116 +345,113 @@ def get_my_tasks():
         
         user_id = session.get('user_id')
         user_role = session.get('role', '')
-        stage_access = session.get('stage_access', '')
-        
-        # Get machines assigned to this user
-        machines_ref = db.collection('machines')
-        
-        if user_role == 'admin':
-            # Admin sees all active machines
-            machines_query = machines_ref.where('status', '==', 'En cours')
-        else:
-            # Regular users see only machines in their stage
-            machines_query = machines_ref.where('assigned_user_id', '==', user_id)
         
-        machines_docs = machines_query.stream()
-        
-        my_tasks = []
-        for machine_doc in machines_docs:
-            machine_data = machine_doc.to_dict()
-            machine_id = machine_doc.id
-            
-            # Skip completed machines for regular users
-            if user_role != 'admin' and machine_data.get('status') != 'En cours':
-                continue
-            
-            task = {
-                'id': f"{machine_id}_{machine_data.get('current_stage', 'unknown')}",
-                'machine_id': machine_id,
-                'stage_name': machine_data.get('current_stage'),
-                'stage_label': machine_data.get('current_stage_label'),
-                'status': 'in_progress',  # All current tasks are in progress
-                'machine_info': {
-                    'serialNumber': machine_data.get('serialNumber', 'Unknown'),
-                    'machineType': machine_data.get('machineType', 'Unknown'),
-                    'clientName': machine_data.get('clientName', 'Unknown'),
-                    'clientSociety': machine_data.get('clientSociety', 'Unknown')
-                },
-                'stage_started_at': machine_data.get('stage_started_at'),
-                'assigned_username': machine_data.get('assigned_username'),
-                'priority': 'normal'
-            }
-            
-            my_tasks.append(task)
+        my_tasks = list_my_tasks(db, user_id, user_role)
         
         return jsonify({"tasks": my_tasks})
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def build_dashboard_data(db, user_id, user_role):
+    """Compute dashboard counters with count() aggregations (constant reads)"""
+    machines_ref = machine_mirror.machines_collection(db)
+    
+    dashboard_data = {
+        'my_pending_tasks': 0,
+        'my_completed_tasks': 0,
+        'total_machines': count_documents(machines_ref),
+        'machines_in_my_stages': 0
+    }
+    
+    if user_role == 'admin':
+        # Admin sees all data
+        dashboard_data['my_pending_tasks'] = count_documents(machines_ref.where('status', '==', 'En cours'))
+        dashboard_data['my_completed_tasks'] = count_documents(machines_ref.where('status', '==', 'Completed'))
+        dashboard_data['machines_in_my_stages'] = dashboard_data['total_machines']
+    else:
+        # Regular users see only their assigned machines
+        my_machines_query = machines_ref.where('assigned_user_id', '==', user_id)
+        dashboard_data['my_pending_tasks'] = count_documents(my_machines_query.where('status', '==', 'En cours'))
+        dashboard_data['machines_in_my_stages'] = count_documents(my_machines_query)
+        
+        # Completed tasks are the history entries validated by this user
+        history_query = db.collection('machine_history').where('assigned_user_id', '==', user_id)
+        dashboard_data['my_completed_tasks'] = count_documents(history_query)
+    
+    return dashboard_data
+
 @stages_bp.route('/dashboard', methods=['GET'])
 def get_dashboard_data():
     """Get dashboard data based on user role"""
     try:
-        print("DEBUG: Getting dashboard data")
-        print(f"DEBUG: User session: {session.get('user_id')}")
-        print(f"DEBUG: User role: {session.get('role')}")
-        print(f"DEBUG: Stage access: {session.get('stage_access')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in
         if 'user_id' not in session:
-            print("DEBUG: Authentication required - no user_id in session")
             return jsonify({"error": "Authentication required"}), 401
         
         user_id = session.get('user_id')
         user_role = session.get('role', '')
         
-        print(f"DEBUG: Fetching dashboard data for user {user_id} with role {user_role}")
+        logger.debug("Building dashboard data for user %s (%s)", user_id, user_role)
         
-        dashboard_data = {
-            'my_pending_tasks': 0,
-            'my_completed_tasks': 0,
-            'total_machines': 0,
-            'machines_in_my_stages': 0
-        }
-        
-        # Get total machines count
-        machines_ref = db.collection('machines')
-        all_machines = list(machines_ref.stream())
-        dashboard_data['total_machines'] = len(all_machines)
-        
-        if user_role == 'admin':
-            # Admin sees all data
-            active_machines = [m for m in all_machines if m.to_dict().get('status') == 'En cours']
-            completed_machines = [m for m in all_machines if m.to_dict().get('status') == 'Completed']
-            
-            dashboard_data['my_pending_tasks'] = len(active_machines)
-            dashboard_data['my_completed_tasks'] = len(completed_machines)
-            dashboard_data['machines_in_my_stages'] = len(all_machines)
-        else:
-            # Regular users see only their assigned machines
-            my_machines = [m for m in all_machines if m.to_dict().get('assigned_user_id') == user_id]
-            my_active_machines = [m for m in my_machines if m.to_dict().get('status') == 'En cours']
-            
-            dashboard_data['my_pending_tasks'] = len(my_active_machines)
-            dashboard_data['machines_in_my_stages'] = len(my_machines)
-            
-            # Get completed tasks from history
-            history_ref = db.collection('machine_history')
-            my_history_query = history_ref.where('assigned_user_id', '==', user_id)
-            my_history = list(my_history_query.stream())
-            dashboard_data['my_completed_tasks'] = len(my_history)
+        dashboard_data = build_dashboard_data(db, user_id, user_role)
         
         return jsonify(dashboard_data)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def list_recent_activities(db, user_id, user_role, machines_by_id=None):
+    """List recent history entries with machine details attached.
+    machines_by_id may hold machine dicts already fetched in the same request."""
+    machines_by_id = machines_by_id or {}
+    
+    # Get recent activities from machine_history
+    history_ref = db.collection('machine_history')
+    
+    if user_role == 'admin':
+        # Admin sees all activities
+        query = history_ref.order_by('completed_at', direction='DESCENDING').limit(15)
+    else:
+        # Regular users see only their activities
+        # Use simple where clause without order_by to avoid index requirements
+        query = history_ref.where('assigned_user_id', '==', user_id)
+    
+    activities_docs = list(query.stream())
+    
+    # If not admin, sort in Python and limit
+    if user_role != 'admin':
+        activities_docs.sort(key=lambda x: x.to_dict().get('completed_at', x.to_dict().get('created_at', datetime.min)), reverse=True)
+        activities_docs = activities_docs[:10]
+    
+    activities = []
+    
+    # Fetch the machines of all activities in one batched read
+    missing_ids = {doc.to_dict().get('machine_id') for doc in activities_docs}
+    missing_ids = [machine_id for machine_id in missing_ids if machine_id and machine_id not in machines_by_id]
+    machines_by_id = dict(machines_by_id, **get_loader().load_many('machines', missing_ids))
+    
+    for doc in activities_docs:
+        activity_data = doc.to_dict()
+        activity_data['id'] = doc.id
+        
+        machine_id = activity_data.get('machine_id')
+        # Deleted machines have no details to add
+        machine_data = machines_by_id.get(machine_id) if machine_id else None
+        if machine_data is not None:
+            activity_data['machine_type'] = machine_data.get('machineType', '')
+            activity_data['client_name'] = machine_data.get('clientName', '')
+            activity_data['client_society'] = machine_data.get('clientSociety', '')
+        
+        activities.append(activity_data)
+    
+    return activities
+
 @stages_bp.route('/recent-activities', methods=['GET'])
 def get_recent_activities():
     """Get recent activities from machine history"""
@@ -387,52 +464,13 @@ def get_recent_activities():
         if 'user_id' not in session:
             return jsonify({"error": "Authentication required"}), 401
         
+        user_id = session.get('user_id')
         user_role = session.get('role', '')
         
-        # Get recent activities from machine_history
-        history_ref = db.collection('machine_history')
-        
-        if user_role == 'admin':
-            # Admin sees all activities
-            query = history_ref.order_by('completed_at', direction='DESCENDING').limit(15)
-        else:
-            # Regular users see only their activities
-            user_id = session.get('user_id')
-            # Use simple where clause without order_by to avoid index requirements
-            query = history_ref.where('assigned_user_id', '==', user_id)
-        
-        activities_docs = list(query.stream())
-        
-        # If not admin, sort in Python and limit
-        if user_role != 'admin':
-            activities_docs.sort(key=lambda x: x.to_dict().get('completed_at', x.to_dict().get('created_at', datetime.min)), reverse=True)
-            activities_docs = activities_docs[:10]
-        
-        activities = []
-        
-        # Get machines collection for additional info
-        machines_ref = db.collection('machines')
-        
-        for doc in activities_docs:
-            activity_data = doc.to_dict()
-            activity_data['id'] = doc.id
-            
-            # Try to get additional machine info
-            machine_id = activity_data.get('machine_id')
-            if machine_id:
-                try:
-                    machine_doc = machines_ref.document(machine_id).get()
-                    if machine_doc.exists:
-                        machine_data = machine_doc.to_dict()
-                        activity_data['machine_type'] = machine_data.get('machineType', '')
-                        activity_data['client_name'] = machine_data.get('clientName', '')
-                        activity_data['client_society'] = machine_data.get('clientSociety', '')
-                except:
-                    pass  # Continue without additional machine info
-            
-            activities.append(activity_data)
+        activities = list_recent_activities(db, user_id, user_role)
         
         return jsonify({"activities": activities})
         
     except Exception as e:
+        logger.exception("Error listing recent activities")
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,44 @@
+"""
+Read-modify-write transactions
+run_transaction() runs a function in a Firestore transaction (rerun when a
+document it read changed before the commit), or on the local storage backends
+under the client's write lock, so concurrent updates never overwrite each other
+"""
+
+import time
+from google.cloud.firestore_v1 import transactional
+from .document_store import StoreTransaction
+from .firestore_metrics import InstrumentedTransaction, _unwrap
+
+# Firestore reruns a transaction whose reads were invalidated up to this many times
+MAX_ATTEMPTS = 5
+
+
+def run_transaction(db, function, max_attempts=MAX_ATTEMPTS):
+    """Call function(transaction) in a transaction and return its result.
+    The function reads with reference.get(transaction=transaction) before
+    staging any write, and may run more than once."""
+    transaction = db.transaction(max_attempts=max_attempts)
+    wrapped = _unwrap(transaction)
+    instrumented = isinstance(transaction, InstrumentedTransaction)
+    function_seconds = 0.0
+
+    def attempt(_):
+        nonlocal function_seconds
+        if instrumented:
+            transaction.reset()
+        started = time.perf_counter()
+        try:
+            return function(transaction)
+        finally:
+            function_seconds += time.perf_counter() - started
+
+    started = time.perf_counter()
+    if isinstance(wrapped, StoreTransaction):
+        result = wrapped.run(attempt)
+    else:
+        result = transactional(attempt)(wrapped)
+    if instrumented:
+        # Reads inside the function were timed as they happened
+        transaction.record_commit(time.perf_counter() - started - function_seconds)
+    return result
@@ -6,7 +6,13 @@ Handles user authentication and role-based access with stage assignments
 from flask import Blueprint, request, jsonify, session, render_template, redirect, url_for
 from datetime import datetime
 from .firebase_config import get_db, is_firebase_available
+from . import reference_cache
+from .assignment_scheduler import ASSIGNMENT_POLICY, WEIGHT_FIELD, get_workloads, user_workload
+from .loader import get_loader
 import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Create users blueprint
 users_bp = Blueprint('users', __name__, url_prefix='/users')
@@ -57,43 +63,37 @@ def users_page():
     
     return redirect(f'{FRONTEND_URL}/users.html')
 
+def get_user_profile(db, user_id):
+    """Get a user's profile without the password, or None if missing"""
+    user_data = get_loader().load('users', user_id)
+    if user_data is None:
+        return None
+    
+    # Remove sensitive information
+    user_data.pop('password', None)
+    user_data['id'] = user_id
+    return user_data
+
 @users_bp.route('/current', methods=['GET'])
 def get_current_user():
     """Get current logged-in user information"""
     try:
-        print("DEBUG: /users/current endpoint called")
-        print(f"DEBUG: Session data: {dict(session)}")
-        print(f"DEBUG: Session has user_id: {'user_id' in session}")
-        print(f"DEBUG: User ID value: {session.get('user_id', 'NOT FOUND')}")
-        print(f"DEBUG: Request headers: {dict(request.headers)}")
-        print(f"DEBUG: Request cookies: {request.cookies}")
-        
         if 'user_id' not in session:
-            print("DEBUG: No user_id in session - returning 401")
             return jsonify({"error": "Not authenticated"}), 401
         
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         user_id = session['user_id']
-        print(f"DEBUG: Looking up user: {user_id}")
+        user_data = get_user_profile(db, user_id)
         
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            print(f"DEBUG: User {user_id} not found in database")
+        if user_data is None:
+            logger.warning("Session user %s not found in database", user_id)
             session.clear()
             return jsonify({"error": "User not found"}), 404
         
-        user_data = user_doc.to_dict()
-        
-        # Remove sensitive information
-        user_data.pop('password', None)
-        user_data['id'] = user_id
-        
         return jsonify(user_data)
         
     except Exception as e:
@@ -103,27 +103,19 @@ def get_current_user():
 def get_all_users():
     """Get all users (admin only)"""
     try:
-        print("DEBUG: get_all_users endpoint called")
-        print(f"DEBUG: Session data: {dict(session)}")
-        print(f"DEBUG: User ID: {session.get('user_id')}")
-        print(f"DEBUG: User role: {session.get('role')}")
-        
         db = get_db()
         if not is_firebase_available():
-            print("DEBUG: Database not available")
+            logger.error("Database not available")
             return jsonify({"error": "Database not available"}), 500
         
         # Check if user is logged in and is admin
         if 'user_id' not in session:
-            print("DEBUG: No user_id in session - authentication required")
             return jsonify({"error": "Authentication required"}), 401
         
         user_role = session.get('role', '')
         if user_role != 'admin':
-            print(f"DEBUG: User role '{user_role}' is not admin - access denied")
             return jsonify({"error": "Admin access required"}), 403
         
-        print("DEBUG: Fetching users from database")
         users_ref = db.collection('users')
         users_docs = users_ref.stream()
         
@@ -135,11 +127,10 @@ def get_all_users():
             user_data.pop('password', None)
             users.append(user_data)
         
-        print(f"DEBUG: Found {len(users)} users")
         return jsonify({"users": users})
         
     except Exception as e:
-        print(f"DEBUG: Error in get_all_users: {str(e)}")
+        logger.exception("Error listing users")
         return jsonify({"error": str(e)}), 500
 
 @users_bp.route('/<user_id>', methods=['GET'])
@@ -248,6 +239,7 @@ def create_user():
         # Add user to database
         doc_ref = users_ref.add(user_data)
         user_id = doc_ref[1].id
+        reference_cache.invalidate_users()
         
         return jsonify({
             "message": "User created successfully",
@@ -294,12 +286,18 @@ def update_user(user_id):
         
         # Admin can update more fields
         if user_role == 'admin':
-            updatable_fields.extend(['role', 'is_active', 'stage_access'])
+            updatable_fields.extend(['role', 'is_active', 'stage_access', WEIGHT_FIELD])
         
         for field in updatable_fields:
             if field in data:
                 update_data[field] = data[field]
         
+        # Share of the work given to the user by the weighted assignment policy
+        if WEIGHT_FIELD in update_data:
+            weight = update_data[WEIGHT_FIELD]
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+                return jsonify({"error": f"{WEIGHT_FIELD} must be a positive number"}), 400
+        
         # Handle password update
         if 'password' in data and data['password']:
             update_data['password'] = hash_password(data['password'])
@@ -320,6 +318,7 @@ def update_user(user_id):
         if update_data:
             update_data['updated_at'] = datetime.now()
             user_ref.update(update_data)
+            reference_cache.invalidate_users()
         
         return jsonify({"message": "User updated successfully"})
         
@@ -360,6 +359,7 @@ def delete_user(user_id):
             return jsonify({"error": "User not found"}), 404
         
         user_ref.delete()
+        reference_cache.invalidate_users()
         
         return jsonify({"message": "User deleted successfully"})
         
@@ -398,9 +398,9 @@ def get_available_roles():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@users_bp.route('/by-stage/<stage_name>', methods=['GET'])
-def get_users_by_stage(stage_name):
-    """Get users who can access a specific stage"""
+@users_bp.route('/workloads', methods=['GET'])
+def get_user_workloads():
+    """Get the open assignments and estimated hours of every active user (admin only)"""
     try:
         db = get_db()
         if not is_firebase_available():
@@ -414,25 +414,44 @@ def get_users_by_stage(stage_name):
         if user_role != 'admin':
             return jsonify({"error": "Admin access required"}), 403
         
-        # Get users who can access this stage
-        users_ref = db.collection('users')
+        workloads = get_workloads(db)
+        users = []
+        for user in reference_cache.get_active_users():
+            open_assignments, open_hours = user_workload(workloads, user['id'])
+            users.append({
+                'id': user['id'],
+                'username': user.get('username'),
+                'role': user.get('role'),
+                WEIGHT_FIELD: user.get(WEIGHT_FIELD) or 1,
+                'open_assignments': open_assignments,
+                'open_hours': open_hours
+            })
+        users.sort(key=lambda user: (user['role'] or '', user['username'] or ''))
+        
+        return jsonify({"policy": ASSIGNMENT_POLICY, "users": users})
         
-        # Get users with specific stage access or admin users
-        stage_users_query = users_ref.where('stage_access', '==', stage_name).where('is_active', '==', True)
-        admin_users_query = users_ref.where('stage_access', '==', 'all').where('is_active', '==', True)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users_bp.route('/by-stage/<stage_name>', methods=['GET'])
+def get_users_by_stage(stage_name):
+    """Get users who can access a specific stage"""
+    try:
+        db = get_db()
+        if not is_firebase_available():
+            return jsonify({"error": "Database not available"}), 500
         
-        stage_users = list(stage_users_query.stream())
-        admin_users = list(admin_users_query.stream())
+        # Check if user is logged in
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
         
-        all_users = stage_users + admin_users
+        user_role = session.get('role', '')
+        if user_role != 'admin':
+            return jsonify({"error": "Admin access required"}), 403
         
-        users = []
-        for doc in all_users:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
-            # Remove password from response
-            user_data.pop('password', None)
-            users.append(user_data)
+        # Get users with specific stage access or admin users from the active-user directory
+        users = reference_cache.get_active_users(stage_access=stage_name)
+        users += reference_cache.get_active_users(stage_access='all')
         
         return jsonify({"stage": stage_name, "users": users})
         
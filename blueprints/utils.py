@@ -78,3 +78,9 @@ def create_success_response(data=None, message="Operation successful"):
     if data is not None:
         response["data"] = data
     return response
+
+
+def count_documents(query):
+    """Count documents matching a query with a server-side count() aggregation"""
+    results = query.count(alias='count').get()
+    return int(results[0][0].value)
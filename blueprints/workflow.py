@@ -5,8 +5,23 @@ Handles workflow stages, updates, and tracking
 
 from flask import Blueprint, render_template, request, jsonify, session
 from datetime import datetime
-from functools import wraps
+from functools import partial, wraps
+from google.cloud.firestore_v1 import ArrayUnion
+import logging
 from .firebase_config import get_db, is_firebase_available
+from .assignment_scheduler import ASSIGNED_HOURS_FIELD, add_workload_update, stage_hours
+from .machine_stats import add_stats_update
+from .machine_tombstones import add_tombstone
+from . import machine_mirror, reference_cache
+from .events import add_event, is_visible
+from .loader import get_loader
+from .transactions import run_transaction
+from .workflow_membership import (ASSIGNED_USERS_FIELD, STAGE_ASSIGNMENTS_FIELD, is_backfilled, is_member,
+                                  membership_fields, stage_assignment_key)
+from .workflow_stats import (add_workflow_stats_update, get_workflow_stats, list_workflow_activities,
+                             recompute_workflow_stats)
+
+logger = logging.getLogger(__name__)
 
 workflow_bp = Blueprint('workflow', __name__)
 
@@ -20,66 +35,54 @@ def login_required(f):
     return decorated_function
 
 def get_user_role():
-    """Get current user role from session"""
-    return session.get('user_role', 'user')
+    """Get current user role from session (set as 'role' at login)"""
+    return session.get('role', '').lower()
 
 @workflow_bp.route('/workflows', methods=['GET'])
 @login_required
 def get_workflows():
     """Get all workflows with their current status - filtered by user role"""
-    print("DEBUG: Getting workflows")
-    print(f"DEBUG: User session: {session.get('user_id')}")
-    print(f"DEBUG: User role: {session.get('user_role')}")
-    
     if not is_firebase_available():
-        print("DEBUG: Database not available")
+        logger.error("Database not available")
         return jsonify({'error': 'Database not available'}), 500
     
     try:
         db = get_db()
-        user_role = session.get('user_role', '').lower()
+        user_role = get_user_role()
         user_id = session.get('user_id')
         
-        print(f"DEBUG: Fetching workflows for user {user_id} with role {user_role}")
+        logger.debug("Listing workflows for user %s (%s)", user_id, user_role)
         
-        # Get all machines with their workflow instances
-        machines_ref = db.collection('machines')
-        machines = machines_ref.stream()
+        machines_ref = machine_mirror.machines_collection(db)
+        if 'admin' in user_role:
+            # Admin users see all workflows
+            machines = machines_ref.stream()
+        elif is_backfilled(db):
+            # Non-admin users only see workflows where they are assigned to stages
+            machines = machines_ref.where(ASSIGNED_USERS_FIELD, 'array_contains', user_id).stream()
+        else:
+            # Until the backfill has run, machines without the fields only match through workflow_instance
+            logger.warning("Workflow membership not backfilled, scanning machines for user %s", user_id)
+            machines = (machine for machine in machines_ref.stream() if is_member(machine.to_dict(), user_id))
         
         workflows = []
-        machine_count = 0
         for machine in machines:
-            machine_count += 1
             machine_data = machine.to_dict()
             workflow_instance = machine_data.get('workflow_instance')
             
             if workflow_instance:
-                # Admin users see all workflows
-                include_workflow = False
-                if 'admin' in user_role:
-                    include_workflow = True
-                else:
-                    # Non-admin users only see workflows where they are assigned to stages
-                    stages = workflow_instance.get('stages', [])
-                    for stage in stages:
-                        assigned_users = stage.get('assigned_users', [])
-                        if any(user.get('user_id') == user_id for user in assigned_users):
-                            include_workflow = True
-                            break
-                
-                if include_workflow:
-                    workflow_summary = {
-                        'machine_id': machine.id,
-                        'serial_number': machine_data.get('serialNumber', 'Unknown'),
-                        'machine_type': machine_data.get('machineType', 'Unknown'),
-                        'client_society': machine_data.get('clientSociety', 'Unknown'),
-                        'workflow_status': machine_data.get('workflow_status', 'Unknown'),
-                        'current_stage': machine_data.get('current_stage', 'Unknown'),
-                        'stages': workflow_instance.get('stages', []),
-                        'created_at': workflow_instance.get('created_at'),
-                        'updated_at': workflow_instance.get('updated_at')
-                    }
-                    workflows.append(workflow_summary)
+                workflow_summary = {
+                    'machine_id': machine.id,
+                    'serial_number': machine_data.get('serialNumber', 'Unknown'),
+                    'machine_type': machine_data.get('machineType', 'Unknown'),
+                    'client_society': machine_data.get('clientSociety', 'Unknown'),
+                    'workflow_status': machine_data.get('workflow_status', 'Unknown'),
+                    'current_stage': machine_data.get('current_stage', 'Unknown'),
+                    'stages': workflow_instance.get('stages', []),
+                    'created_at': workflow_instance.get('created_at'),
+                    'updated_at': workflow_instance.get('updated_at')
+                }
+                workflows.append(workflow_summary)
         
         return jsonify({
             'success': True,
@@ -99,7 +102,7 @@ def get_machine_workflow(machine_id):
     
     try:
         db = get_db()
-        user_role = session.get('user_role', '').lower()
+        user_role = get_user_role()
         user_id = session.get('user_id')
         
         # Get machine document
@@ -118,15 +121,7 @@ def get_machine_workflow(machine_id):
         # Check if user has access to this machine
         if 'admin' not in user_role:
             # Non-admin users can only access machines where they are assigned to stages
-            stages = workflow_instance.get('stages', [])
-            user_has_access = False
-            for stage in stages:
-                assigned_users = stage.get('assigned_users', [])
-                if any(user.get('user_id') == user_id for user in assigned_users):
-                    user_has_access = True
-                    break
-            
-            if not user_has_access:
+            if not is_member(machine_data, user_id):
                 return jsonify({'error': 'Access denied - you are not assigned to this machine'}), 403
         
         # Add machine info to workflow
@@ -146,6 +141,15 @@ def get_machine_workflow(machine_id):
     except Exception as e:
         return jsonify({'error': f'Error fetching workflow: {str(e)}'}), 500
 
+def derive_workflow_state(stages):
+    """current_stage label and workflow_status of a machine from its workflow stages"""
+    for stage in stages:
+        if stage['status'] in ('in_progress', 'pending'):
+            return stage['label'], 'active'
+        if stage['status'] == 'blocked':
+            return f"{stage['label']} (Bloqué)", 'blocked'
+    return 'Terminé', 'completed'
+
 @workflow_bp.route('/workflows/<machine_id>/stage/<stage_name>', methods=['PUT'])
 @login_required
 def update_workflow_stage(machine_id, stage_name):
@@ -162,98 +166,83 @@ def update_workflow_stage(machine_id, stage_name):
             return jsonify({'error': 'Invalid status'}), 400
         
         db = get_db()
-        user_role = session.get('user_role', '').lower()
+        user_role = get_user_role()
         user_id = session.get('user_id')
-        
+        username = session.get('username', 'Unknown')
         machine_ref = db.collection('machines').document(machine_id)
-        machine_doc = machine_ref.get()
-        
-        if not machine_doc.exists:
-            return jsonify({'error': 'Machine not found'}), 404
-        
-        machine_data = machine_doc.to_dict()
-        workflow_instance = machine_data.get('workflow_instance')
-        
-        if not workflow_instance:
-            return jsonify({'error': 'No workflow found for this machine'}), 404
         
-        # Update the specific stage
-        stages = workflow_instance.get('stages', [])
-        stage_updated = False
-        stage_to_update = None
-        
-        for stage in stages:
-            if stage['name'] == stage_name:
-                stage_to_update = stage
-                break
-        
-        if not stage_to_update:
-            return jsonify({'error': 'Stage not found'}), 404
-        
-        # Check if user has permission to update this stage
-        if 'admin' not in user_role:
+        def apply_stage_update(transaction):
+            """Read the machine and stage the stage change with everything derived from it"""
+            machine_doc = machine_ref.get(transaction=transaction)
+            if not machine_doc.exists:
+                return {'error': 'Machine not found'}, 404, False
+            
+            machine_data = machine_doc.to_dict()
+            workflow_instance = machine_data.get('workflow_instance')
+            if not workflow_instance:
+                return {'error': 'No workflow found for this machine'}, 404, False
+            
+            # Copies, so machine_data keeps the state before the change
+            stages = [dict(stage) for stage in workflow_instance.get('stages', [])]
+            stage_to_update = next((stage for stage in stages if stage['name'] == stage_name), None)
+            if not stage_to_update:
+                return {'error': 'Stage not found'}, 404, False
+            
             # Non-admin users can only update stages they are assigned to
-            assigned_users = stage_to_update.get('assigned_users', [])
-            user_assigned = any(user.get('user_id') == user_id for user in assigned_users)
+            if 'admin' not in user_role and not is_member(machine_data, user_id, stage_name):
+                return {'error': 'Access denied - you are not assigned to this stage'}, 403, False
             
-            if not user_assigned:
-                return jsonify({'error': 'Access denied - you are not assigned to this stage'}), 403
-        
-        # Update the stage
-        old_status = stage_to_update['status']
-        stage_to_update['status'] = new_status
-        stage_to_update['notes'] = notes
-        
-        # Update timestamps
-        if new_status == 'in_progress' and old_status == 'pending':
-            stage_to_update['started_at'] = datetime.now()
-        elif new_status == 'completed' and old_status in ['pending', 'in_progress']:
-            stage_to_update['completed_at'] = datetime.now()
-            if not stage_to_update.get('started_at'):
-                stage_to_update['started_at'] = datetime.now()
-        
-        # Add user info to the update
-        stage_to_update['last_updated_by'] = {
-            'user_id': user_id,
-            'username': session.get('user_name', 'Unknown'),
-            'updated_at': datetime.now()
-        }
-        
-        # Update workflow instance
-        workflow_instance['updated_at'] = datetime.now()
-        
-        # Determine current stage and overall status
-        current_stage = 'Terminé'
-        workflow_status = 'completed'
-        
-        for stage in stages:
-            if stage['status'] == 'in_progress':
-                current_stage = stage['label']
-                workflow_status = 'active'
-                break
-            elif stage['status'] == 'pending':
-                current_stage = stage['label']
-                workflow_status = 'active'
-                break
-            elif stage['status'] == 'blocked':
-                current_stage = f"{stage['label']} (Bloqué)"
-                workflow_status = 'blocked'
-                break
-        
-        # Update machine document
-        machine_ref.update({
-            'workflow_instance': workflow_instance,
-            'workflow_status': workflow_status,
-            'current_stage': current_stage,
-            'updated_at': datetime.now()
-        })
-        
-        return jsonify({
-            'success': True,
-            'message': f'Stage {stage_name} updated successfully',
-            'current_stage': current_stage,
-            'workflow_status': workflow_status
-        })
+            now = datetime.now()
+            old_status = stage_to_update['status']
+            stage_to_update['status'] = new_status
+            stage_to_update['notes'] = notes
+            if new_status == 'in_progress' and old_status == 'pending':
+                stage_to_update['started_at'] = now
+            elif new_status == 'completed' and old_status in ['pending', 'in_progress']:
+                stage_to_update['completed_at'] = now
+                if not stage_to_update.get('started_at'):
+                    stage_to_update['started_at'] = now
+            stage_to_update['last_updated_by'] = {
+                'user_id': user_id,
+                'username': username,
+                'updated_at': now
+            }
+            current_stage, workflow_status = derive_workflow_state(stages)
+            
+            # Only the stages list and the derived fields are written, not the whole
+            # workflow instance (Firestore cannot update one element of an array)
+            machine_update = {
+                'workflow_instance.stages': stages,
+                'workflow_instance.updated_at': now,
+                'workflow_status': workflow_status,
+                'current_stage': current_stage,
+                'updated_at': now
+            }
+            if current_stage != machine_data.get('current_stage'):
+                # The open assignment now stands for the new stage's estimated hours
+                machine_update[ASSIGNED_HOURS_FIELD] = stage_hours(reference_cache.get_stage(current_stage))
+            new_machine_data = dict(machine_data, workflow_instance=dict(workflow_instance, stages=stages, updated_at=now),
+                                    **{field: value for field, value in machine_update.items() if '.' not in field})
+            transaction.update(machine_ref, machine_update)
+            stats_changed = add_stats_update(transaction, db, machine_data, new_machine_data)
+            # Moves the open hours from the stored value to the new stage's when current_stage moves
+            add_workload_update(transaction, db, machine_data, new_machine_data)
+            add_tombstone(transaction, db, machine_id, machine_data, new_machine_data)
+            add_workflow_stats_update(transaction, db, machine_data, new_machine_data)
+            add_event(transaction, db, 'workflow_stage_updated', machine_id, machine_data, new_machine_data,
+                      stage=stage_name, stage_status=new_status, by_user_id=user_id, by_username=username)
+            machine_mirror.note_machine_write(machine_id)
+            return {
+                'success': True,
+                'message': f'Stage {stage_name} updated successfully',
+                'current_stage': current_stage,
+                'workflow_status': workflow_status
+            }, 200, stats_changed
+        
+        body, status_code, stats_changed = run_transaction(db, apply_stage_update)
+        if stats_changed:
+            reference_cache.invalidate_stats()
+        return jsonify(body), status_code
         
     except Exception as e:
         return jsonify({'error': f'Error updating workflow stage: {str(e)}'}), 500
@@ -275,71 +264,69 @@ def assign_user_to_stage(machine_id):
         
         db = get_db()
         
-        # Get user info
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Get user info (read outside the transaction: it is not modified)
+        user_data = get_loader().load('users', user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_data = user_doc.to_dict()
-        
-        # Get machine workflow
+        username = user_data.get('username', 'Unknown')
         machine_ref = db.collection('machines').document(machine_id)
-        machine_doc = machine_ref.get()
-        
-        if not machine_doc.exists:
-            return jsonify({'error': 'Machine not found'}), 404
         
-        machine_data = machine_doc.to_dict()
-        workflow_instance = machine_data.get('workflow_instance')
-        
-        if not workflow_instance:
-            return jsonify({'error': 'No workflow found for this machine'}), 404
-        
-        # Update the specific stage with user assignment
-        stages = workflow_instance.get('stages', [])
-        stage_updated = False
-        
-        for stage in stages:
-            if stage['name'] == stage_name:
-                # Add user to assigned users list
-                assigned_users = stage.get('assigned_users', [])
-                
-                # Check if user is already assigned
-                user_already_assigned = any(u['user_id'] == user_id for u in assigned_users)
-                
-                if not user_already_assigned:
-                    assigned_users.append({
-                        'user_id': user_id,
-                        'username': user_data.get('username', 'Unknown'),
-                        'role': user_data.get('role', 'Unknown'),
-                        'assigned_at': datetime.now()
-                    })
-                    
-                    stage['assigned_users'] = assigned_users
-                    stage_updated = True
-                else:
-                    return jsonify({'error': 'User already assigned to this stage'}), 400
-                
-                break
-        
-        if not stage_updated:
-            return jsonify({'error': 'Stage not found'}), 404
-        
-        # Update workflow instance
-        workflow_instance['updated_at'] = datetime.now()
-        
-        # Update machine document
-        machine_ref.update({
-            'workflow_instance': workflow_instance,
-            'updated_at': datetime.now()
-        })
-        
-        return jsonify({
-            'success': True,
-            'message': f'User {user_data.get("username", "Unknown")} assigned to stage {stage_name}'
-        })
+        def apply_assignment(transaction):
+            """Read the machine and stage the assignment, its membership entries and event"""
+            machine_doc = machine_ref.get(transaction=transaction)
+            if not machine_doc.exists:
+                return {'error': 'Machine not found'}, 404
+            
+            machine_data = machine_doc.to_dict()
+            workflow_instance = machine_data.get('workflow_instance')
+            if not workflow_instance:
+                return {'error': 'No workflow found for this machine'}, 404
+            
+            stages = [dict(stage) for stage in workflow_instance.get('stages', [])]
+            stage = next((stage for stage in stages if stage['name'] == stage_name), None)
+            if not stage:
+                return {'error': 'Stage not found'}, 404
+            
+            assigned_users = stage.get('assigned_users', [])
+            if any(u['user_id'] == user_id for u in assigned_users):
+                return {'error': 'User already assigned to this stage'}, 400
+            
+            now = datetime.now()
+            stage['assigned_users'] = assigned_users + [{
+                'user_id': user_id,
+                'username': username,
+                'role': user_data.get('role', 'Unknown'),
+                'assigned_at': now
+            }]
+            
+            # The stages list is rewritten whole (it is read in this transaction, so a
+            # concurrent change to another stage retries instead of being lost);
+            # membership entries are unioned in, never rewritten from a stale copy
+            machine_update = {
+                'workflow_instance.stages': stages,
+                'workflow_instance.updated_at': now,
+                ASSIGNED_USERS_FIELD: ArrayUnion([user_id]),
+                STAGE_ASSIGNMENTS_FIELD: ArrayUnion([stage_assignment_key(stage_name, user_id)]),
+                'updated_at': now
+            }
+            new_workflow_instance = dict(workflow_instance, stages=stages, updated_at=now)
+            new_machine_data = dict(machine_data, workflow_instance=new_workflow_instance,
+                                    **membership_fields(new_workflow_instance), updated_at=now)
+            transaction.update(machine_ref, machine_update)
+            add_workflow_stats_update(transaction, db, machine_data, new_machine_data)
+            add_event(transaction, db, 'machine_assigned', machine_id, machine_data, new_machine_data,
+                      stage=stage_name, user_id=user_id, username=username,
+                      by_user_id=session.get('user_id'), by_username=session.get('username', 'Unknown'))
+            machine_mirror.note_machine_write(machine_id)
+            return {
+                'success': True,
+                'message': f'User {username} assigned to stage {stage_name}'
+            }, 200
+        
+        body, status_code = run_transaction(db, apply_assignment)
+        return jsonify(body), status_code
         
     except Exception as e:
         return jsonify({'error': f'Error assigning user: {str(e)}'}), 500
@@ -375,59 +362,44 @@ def get_workflow_stages():
 @workflow_bp.route('/workflows/dashboard', methods=['GET'])
 @login_required
 def workflow_dashboard():
-    """Get workflow dashboard data"""
+    """Get workflow dashboard data from the stats/workflows aggregate"""
     if not is_firebase_available():
         return jsonify({'error': 'Database not available'}), 500
     
     try:
         db = get_db()
-        
-        # Get all machines with workflows
-        machines_ref = db.collection('machines')
-        machines = machines_ref.stream()
+        stats = get_workflow_stats(db)
+        
+        # Activities follow the live event rule: admins see all, others their stage and assignments
+        visible = None
+        if 'admin' not in get_user_role():
+            visible = partial(is_visible, user_id=session.get('user_id'), user_role=session.get('role', ''),
+                              stage_access=session.get('stage_access', ''))
+        
+        status_counts = stats.get('status_counts', {})
+        
+        # Every defined stage, in workflow order, then stages only found on machines
+        stage_statistics = {}
+        counted = stats.get('stage_statistics', {})
+        stage_names = [stage['name'] for stage in reference_cache.get_stages()]
+        stage_names += sorted(name for name in counted if name not in stage_names)
+        for name in stage_names:
+            counts = counted.get(name, {})
+            stage_statistics[name] = {
+                'total': counts.get('total', 0),
+                'completed': counts.get('completed', 0),
+                'in_progress': counts.get('in_progress', 0)
+            }
         
         dashboard_data = {
-            'total_workflows': 0,
-            'active_workflows': 0,
-            'completed_workflows': 0,
-            'blocked_workflows': 0,
-            'stage_statistics': {
-                'material_collection': {'total': 0, 'completed': 0, 'in_progress': 0},
-                'assembly': {'total': 0, 'completed': 0, 'in_progress': 0},
-                'testing': {'total': 0, 'completed': 0, 'in_progress': 0},
-                'delivery': {'total': 0, 'completed': 0, 'in_progress': 0},
-                'installation': {'total': 0, 'completed': 0, 'in_progress': 0}
-            },
-            'recent_activities': []
+            'total_workflows': stats.get('total_workflows', 0),
+            'active_workflows': status_counts.get('active', 0),
+            'completed_workflows': status_counts.get('completed', 0),
+            'blocked_workflows': status_counts.get('blocked', 0),
+            'stage_statistics': stage_statistics,
+            'recent_activities': list_workflow_activities(db, visible=visible)
         }
         
-        for machine in machines:
-            machine_data = machine.to_dict()
-            workflow_instance = machine_data.get('workflow_instance')
-            
-            if workflow_instance:
-                dashboard_data['total_workflows'] += 1
-                
-                workflow_status = machine_data.get('workflow_status', 'unknown')
-                if workflow_status == 'active':
-                    dashboard_data['active_workflows'] += 1
-                elif workflow_status == 'completed':
-                    dashboard_data['completed_workflows'] += 1
-                elif workflow_status == 'blocked':
-                    dashboard_data['blocked_workflows'] += 1
-                
-                # Count stage statistics
-                stages = workflow_instance.get('stages', [])
-                for stage in stages:
-                    stage_name = stage['name']
-                    if stage_name in dashboard_data['stage_statistics']:
-                        dashboard_data['stage_statistics'][stage_name]['total'] += 1
-                        
-                        if stage['status'] == 'completed':
-                            dashboard_data['stage_statistics'][stage_name]['completed'] += 1
-                        elif stage['status'] == 'in_progress':
-                            dashboard_data['stage_statistics'][stage_name]['in_progress'] += 1
-        
         return jsonify({
             'success': True,
             'dashboard': dashboard_data
@@ -435,3 +407,26 @@ def workflow_dashboard():
         
     except Exception as e:
         return jsonify({'error': f'Error fetching dashboard data: {str(e)}'}), 500
+
+@workflow_bp.route('/workflows/dashboard/recompute', methods=['POST'])
+@login_required
+def recompute_workflow_dashboard():
+    """Rebuild the workflow aggregate from all machines to repair drift (admin only)"""
+    if not is_firebase_available():
+        return jsonify({'error': 'Database not available'}), 500
+    
+    if get_user_role() != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    try:
+        stats = recompute_workflow_stats(get_db())
+        
+        return jsonify({
+            'success': True,
+            'total_workflows': stats['total_workflows'],
+            'status_counts': stats['status_counts'],
+            'stage_statistics': stats['stage_statistics']
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Error recomputing dashboard data: {str(e)}'}), 500
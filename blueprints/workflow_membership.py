@@ -0,0 +1,64 @@
+"""
+Workflow membership
+Denormalized copy of the users assigned to a machine's workflow stages, so
+non-admin workflow lists are answered by an array_contains query and access
+checks by a field lookup instead of scanning workflow_instance
+"""
+
+from firebase_admin import firestore
+from .machine_stats import STATS_COLLECTION
+
+# Every user assigned to at least one stage of the machine's workflow
+ASSIGNED_USERS_FIELD = 'assigned_user_ids'
+
+# One '<stage name>:<user id>' entry per stage assignment
+STAGE_ASSIGNMENTS_FIELD = 'stage_assignments'
+
+# stats/workflow_membership, written once every machine carries the fields
+BACKFILL_DOC = 'workflow_membership'
+
+# Once set the marker is never removed, so each worker reads it until it finds it
+_backfilled = False
+
+
+def stage_assignment_key(stage_name, user_id):
+    """Entry of stage_assignments for one user on one stage"""
+    return f'{stage_name}:{user_id}'
+
+
+def membership_fields(workflow_instance):
+    """Membership fields derived from a workflow instance's assigned_users lists"""
+    user_ids = []
+    stage_assignments = []
+    for stage in (workflow_instance or {}).get('stages', []):
+        for user in stage.get('assigned_users', []):
+            user_id = user.get('user_id')
+            if not user_id:
+                continue
+            if user_id not in user_ids:
+                user_ids.append(user_id)
+            stage_assignments.append(stage_assignment_key(stage.get('name'), user_id))
+    return {ASSIGNED_USERS_FIELD: user_ids, STAGE_ASSIGNMENTS_FIELD: stage_assignments}
+
+
+def is_member(machine_data, user_id, stage_name=None):
+    """Whether a user is assigned to the machine's workflow, or to one of its stages.
+    Machines written before the fields existed fall back to the workflow instance."""
+    if ASSIGNED_USERS_FIELD not in machine_data:
+        machine_data = membership_fields(machine_data.get('workflow_instance'))
+    if stage_name is None:
+        return user_id in machine_data.get(ASSIGNED_USERS_FIELD, [])
+    return stage_assignment_key(stage_name, user_id) in machine_data.get(STAGE_ASSIGNMENTS_FIELD, [])
+
+
+def mark_backfilled(db):
+    """Record that every machine carries the membership fields"""
+    db.collection(STATS_COLLECTION).document(BACKFILL_DOC).set({'backfilled_at': firestore.SERVER_TIMESTAMP})
+
+
+def is_backfilled(db):
+    """Whether listings can rely on the membership fields alone"""
+    global _backfilled
+    if not _backfilled:
+        _backfilled = db.collection(STATS_COLLECTION).document(BACKFILL_DOC).get().exists
+    return _backfilled
@@ -0,0 +1,148 @@
+"""
+Workflow dashboard aggregate
+Maintains the stats/workflows document: workflow counts per status and per-stage
+counts keyed by stage name, updated with blind increments in the same transaction
+as each workflow change. Recent activities are read from the change events.
+"""
+
+from datetime import datetime
+from firebase_admin import firestore
+from google.cloud.firestore_v1 import Query
+from .events import EVENTS_COLLECTION
+from .machine_stats import STATS_COLLECTION
+
+WORKFLOW_STATS_DOC = 'workflows'
+
+# Stage statuses counted per stage besides the total
+COUNTED_STAGE_STATUSES = ('completed', 'in_progress')
+
+# Change event type -> dashboard activity type
+ACTIVITY_TYPES = {'workflow_stage_updated': 'stage_updated', 'machine_assigned': 'user_assigned'}
+RECENT_ACTIVITIES = 50
+# Events looked through for a non-admin user's activities
+ACTIVITY_SCAN_LIMIT = 500
+
+
+def get_workflow_stats_ref(db):
+    """Get the reference of the workflow statistics document"""
+    return db.collection(STATS_COLLECTION).document(WORKFLOW_STATS_DOC)
+
+
+def compute_workflow_delta(old_data, new_data):
+    """Compute counter changes for a machine's workflow going from old_data to new_data.
+    Either side may be None (or have no workflow) for a create or a delete."""
+    total = 0
+    status_counts = {}
+    stage_counts = {}
+
+    for machine_data, sign in ((old_data, -1), (new_data, 1)):
+        workflow_instance = (machine_data or {}).get('workflow_instance')
+        if not workflow_instance:
+            continue
+        total += sign
+        status = machine_data.get('workflow_status') or 'unknown'
+        status_counts[status] = status_counts.get(status, 0) + sign
+        for stage in workflow_instance.get('stages', []):
+            counts = stage_counts.setdefault(stage['name'], {})
+            counts['total'] = counts.get('total', 0) + sign
+            if stage.get('status') in COUNTED_STAGE_STATUSES:
+                counts[stage['status']] = counts.get(stage['status'], 0) + sign
+
+    status_counts = {status: count for status, count in status_counts.items() if count}
+    stage_counts = {
+        name: {counter: count for counter, count in counts.items() if count}
+        for name, counts in stage_counts.items()
+    }
+    stage_counts = {name: counts for name, counts in stage_counts.items() if counts}
+    return total, status_counts, stage_counts
+
+
+def add_workflow_stats_update(batch, db, old_data, new_data):
+    """Add the counter increments for a workflow change to a batch or transaction.
+    Nothing reads the document in the transaction, so concurrent workflow updates
+    do not conflict on it. Returns False when nothing changes."""
+    total, status_counts, stage_counts = compute_workflow_delta(old_data, new_data)
+    if not total and not status_counts and not stage_counts:
+        return False
+
+    update = {'updated_at': datetime.now()}
+    if total:
+        update['total_workflows'] = firestore.Increment(total)
+    if status_counts:
+        update['status_counts'] = {
+            status: firestore.Increment(count) for status, count in status_counts.items()
+        }
+    if stage_counts:
+        update['stage_statistics'] = {
+            name: {counter: firestore.Increment(count) for counter, count in counts.items()}
+            for name, counts in stage_counts.items()
+        }
+    batch.set(get_workflow_stats_ref(db), update, merge=True)
+    return True
+
+
+def build_workflow_stats(machines):
+    """Workflow counters of an iterable of machine data"""
+    stats = {'total_workflows': 0, 'status_counts': {}, 'stage_statistics': {}}
+    for machine_data in machines:
+        total, status_counts, stage_counts = compute_workflow_delta(None, machine_data)
+        stats['total_workflows'] += total
+        for status, count in status_counts.items():
+            stats['status_counts'][status] = stats['status_counts'].get(status, 0) + count
+        for name, counts in stage_counts.items():
+            stage_statistics = stats['stage_statistics'].setdefault(name, {})
+            for counter, count in counts.items():
+                stage_statistics[counter] = stage_statistics.get(counter, 0) + count
+    return stats
+
+
+def recompute_workflow_stats(db):
+    """Rebuild the workflow counters from every machine"""
+    stats = build_workflow_stats(doc.to_dict() for doc in db.collection('machines').stream())
+    stats['updated_at'] = datetime.now()
+    stats['recomputed_at'] = stats['updated_at']
+    get_workflow_stats_ref(db).set(stats)
+    return stats
+
+
+def get_workflow_stats(db):
+    """Read the workflow statistics document, building it on first use
+    (also when it was only created by increments, see machine_stats.get_stats)"""
+    stats_doc = get_workflow_stats_ref(db).get()
+    if not stats_doc.exists:
+        return recompute_workflow_stats(db)
+    stats = stats_doc.to_dict()
+    if 'recomputed_at' not in stats:
+        return recompute_workflow_stats(db)
+    return stats
+
+
+def list_workflow_activities(db, limit=RECENT_ACTIVITIES, visible=None):
+    """Latest workflow activities, newest first, from the change events
+    (kept for EVENT_TTL; needs the machine_events (type, created_at desc) index).
+    visible(event) keeps only the events a user may see, looking at most
+    ACTIVITY_SCAN_LIMIT events back."""
+    query = (db.collection(EVENTS_COLLECTION)
+             .where('type', 'in', list(ACTIVITY_TYPES))
+             .order_by('created_at', direction=Query.DESCENDING)
+             .limit(limit if visible is None else ACTIVITY_SCAN_LIMIT))
+    activities = []
+    for doc in query.stream():
+        event = doc.to_dict()
+        if visible is not None and not visible(event):
+            continue
+        activities.append({
+            'type': ACTIVITY_TYPES[event['type']],
+            'machine_id': event.get('machine_id'),
+            'serial_number': event.get('serialNumber'),
+            'stage': event.get('stage'),
+            'stage_status': event.get('stage_status'),
+            'user_id': event.get('user_id'),
+            'username': event.get('username'),
+            'by_user_id': event.get('by_user_id'),
+            'by_username': event.get('by_username'),
+            'at': event.get('created_at'),
+        })
+        if len(activities) >= limit:
+            break
+    return activities
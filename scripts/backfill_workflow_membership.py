@@ -0,0 +1,64 @@
+"""
+Backfill assigned_user_ids / stage_assignments on machines with a workflow
+Run once against the configured backend (STORAGE_BACKEND) after deploying:
+    python scripts/backfill_workflow_membership.py [--dry-run]
+Until it has run, GET /workflows scans every machine for non-admin users
+"""
+
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from blueprints.firebase_config import get_db, initialize_firebase  # noqa: E402
+from blueprints.machines import BATCH_WRITE_LIMIT  # noqa: E402
+from blueprints.workflow_membership import mark_backfilled, membership_fields  # noqa: E402
+
+
+def backfill(db, dry_run=False):
+    """Write the membership fields where they are missing or stale; returns (scanned, updated)"""
+    scanned = 0
+    updated = 0
+    batch = db.batch()
+    pending_writes = 0
+    for doc in db.collection('machines').stream():
+        scanned += 1
+        machine_data = doc.to_dict()
+        workflow_instance = machine_data.get('workflow_instance')
+        if not workflow_instance:
+            continue
+        fields = membership_fields(workflow_instance)
+        if all(machine_data.get(field) == value for field, value in fields.items()):
+            continue
+        updated += 1
+        if dry_run:
+            continue
+        # updated_at is left alone: membership is derived data, not a change clients need to sync
+        batch.update(doc.reference, fields)
+        pending_writes += 1
+        if pending_writes >= BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+    if pending_writes:
+        batch.commit()
+    if not dry_run:
+        mark_backfilled(db)
+    return scanned, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='Only count the machines to update')
+    args = parser.parse_args()
+
+    if not initialize_firebase():
+        raise SystemExit('Database not available')
+    scanned, updated = backfill(get_db(), args.dry_run)
+    print(f"{updated} of {scanned} machines {'need' if args.dry_run else 'got'} membership fields")
+
+
+if __name__ == '__main__':
+    main()
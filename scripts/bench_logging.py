@@ -0,0 +1,132 @@
+"""
+Measure the logging cost on the /login and /machines hot paths
+Replays, in isolation, the print() calls these handlers made before the logging
+pipeline and the logger calls they make now, with the output captured to a file
+(a whole request costs milliseconds, which would hide these microseconds):
+python scripts/bench_logging.py [--iterations N]
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from werkzeug.datastructures import Headers  # noqa: E402
+from blueprints.logging_config import configure_logging, stop_logging  # noqa: E402
+
+# Representative request state for a successful login and machine listing
+SESSION = {
+    'user_id': 'u8Xk2mQ4rT9pLw1zN3bV', 'role': 'technicien', 'username': 'jdupont',
+    'stage_access': 'reparation', 'first_name': 'Jean', 'last_name': 'Dupont',
+}
+LOGIN_BODY = {'email': 'jean.dupont@isolab.fr', 'password': 'not-a-real-password'}
+USER_DATA = dict(SESSION, email='jean.dupont@isolab.fr', is_active=True,
+                 password='5e884898da28047151d0e56f8dc6292773603d0d6a9aef4f4c3e3b5e1b7f2a1c')
+HEADERS = Headers({'Content-Type': 'application/json', 'Content-Length': '245',
+                   'Access-Control-Allow-Origin': 'https://isolab-support.firebaseapp.com',
+                   'Access-Control-Allow-Credentials': 'true', 'Vary': 'Origin, Cookie'})
+MACHINE_COUNT = 50
+
+
+def login_with_print():
+    """The print() calls of a successful POST /login before the logging pipeline"""
+    identifier = LOGIN_BODY['email']
+    print("DEBUG: Login endpoint called")
+    print("DEBUG: Request method: POST")
+    print("DEBUG: Request content type: application/json")
+    print("DEBUG: Firebase connection established")
+    print(f"DEBUG: Received data: {LOGIN_BODY}")
+    print(f"DEBUG: Identifier: {identifier}")
+    print(f"DEBUG: Password provided: {'Yes' if LOGIN_BODY['password'] else 'No'}")
+    print(f"DEBUG: Searching for user by email: {identifier}")
+    print(f"DEBUG: Users found by email: {1}")
+    print(f"DEBUG: User found: {USER_DATA.get('email')} (ID: {SESSION['user_id']})")
+    print(f"DEBUG: User role: {USER_DATA.get('role')}")
+    print(f"DEBUG: User active: {USER_DATA.get('is_active', True)}")
+    print(f"DEBUG: Password hash match: {True}")
+    print(f"DEBUG: Session created for user: {USER_DATA.get('username')} ({USER_DATA['role']})")
+    print(f"DEBUG: Session data after setting: {dict(SESSION)}")
+    print(f"DEBUG: Session data - User ID: {SESSION['user_id']}")
+    print(f"DEBUG: Session data - Role: {USER_DATA['role']}")
+    print(f"DEBUG: Session data - Stage access: {USER_DATA.get('stage_access')}")
+    print(f"User logged in: {USER_DATA.get('username')} ({USER_DATA['role']}) - Stage access: {USER_DATA.get('stage_access')}")
+    print("DEBUG: Login successful, returning user data")
+    print(f"DEBUG: Response headers: {HEADERS}")
+
+
+def login_with_logging(logger):
+    """The logger calls of a successful POST /login now"""
+    logger.debug("Login endpoint called (content type: %s)", 'application/json')
+    logger.debug("Users found by email: %d", 1)
+    logger.info("User logged in: %s (%s) - Stage access: %s",
+                SESSION['user_id'], USER_DATA['role'], USER_DATA.get('stage_access'))
+
+
+def machines_with_print():
+    """The print() calls of a successful GET /machines by a technician before the logging pipeline"""
+    print("DEBUG: Getting all machines")
+    print(f"DEBUG: User session: {SESSION.get('user_id')}")
+    print(f"DEBUG: User role: {SESSION.get('role')}")
+    print(f"DEBUG: Stage access: {SESSION.get('stage_access')}")
+    print(f"DEBUG: Fetching machines for user {SESSION['user_id']} with role {SESSION['role']}")
+    print(f"DEBUG: Regular user - filtering by stage access: {SESSION['stage_access']}")
+    print(f"DEBUG: Fetching machines for stage: {SESSION['stage_access']}")
+    print(f"DEBUG: Found {MACHINE_COUNT} machines total")
+    print(f"DEBUG: Returning machine data for user {SESSION['user_id']}")
+
+
+def machines_with_logging(logger):
+    """The logger calls of a successful GET /machines now"""
+    logger.debug("Listed %d machines for user %s (%s), has_more=%s",
+                 MACHINE_COUNT, SESSION['user_id'], SESSION['role'], True)
+
+
+def time_calls(function, iterations, *args):
+    """Average time per call in microseconds"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function(*args)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--output', help='File receiving stdout (default: a temporary file)')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.output:
+            output = stack.enter_context(open(args.output, 'w'))
+        else:
+            output = stack.enter_context(tempfile.TemporaryFile('w'))
+
+        results = {}
+        with contextlib.redirect_stdout(output):
+            results['print'] = (time_calls(login_with_print, args.iterations),
+                                time_calls(machines_with_print, args.iterations))
+
+            configure_logging(stream=output)
+            root_logger = logging.getLogger()
+            for label, level in (('logging, production (WARNING)', logging.WARNING),
+                                 ('logging, DEBUG enabled', logging.DEBUG)):
+                root_logger.setLevel(level)
+                login_logger = logging.getLogger('blueprints.login')
+                machines_logger = logging.getLogger('blueprints.machines')
+                results[label] = (time_calls(login_with_logging, args.iterations, login_logger),
+                                  time_calls(machines_with_logging, args.iterations, machines_logger))
+            stop_logging()
+
+    print(f"{'mode':<32}{'/login (us)':>14}{'/machines (us)':>16}")
+    for label, (login_us, machines_us) in results.items():
+        print(f"{label:<32}{login_us:>14.2f}{machines_us:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
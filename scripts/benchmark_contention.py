@@ -0,0 +1,176 @@
+"""
+Contention benchmark for the workflow stage routes
+Updates every stage of a few machines and assigns users to them from parallel
+threads, then checks that no update was lost and that the derived fields, the workflow
+aggregate and the workload index match
+Usage: python scripts/benchmark_contention.py --backend sqlite --machines 20 --threads 16
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmark_routes import BASE_URL, load_dataset, make_client, percentile  # noqa: E402
+from generate_dataset import DEFAULT_PASSWORD, DatasetGenerator  # noqa: E402
+from blueprints.assignment_scheduler import build_workloads, get_workloads  # noqa: E402
+from blueprints.firebase_config import get_db  # noqa: E402
+from blueprints.workflow import derive_workflow_state  # noqa: E402
+from blueprints.workflow_membership import membership_fields  # noqa: E402
+from blueprints.workflow_stats import build_workflow_stats, get_workflow_stats, list_workflow_activities  # noqa: E402
+
+# Final status of each stage: all but the last completed, so current_stage ends on the last one
+FINAL_STATUSES = ('completed', 'in_progress')
+
+
+def build_requests(collections, machine_ids, assignments_per_machine, seed):
+    """Shuffled (method, path, body) requests and the state they must leave behind"""
+    machines = collections['machines']
+    users = [user_id for user_id, user in collections['users'].items() if user['role'] != 'admin']
+    randomizer = random.Random(seed)
+    requests = []
+    expected = {}
+    for machine_id in machine_ids:
+        stages = [stage['name'] for stage in machines[machine_id]['workflow_instance']['stages']]
+        statuses = {stage: FINAL_STATUSES[stage == stages[-1]] for stage in stages}
+        for stage, status in statuses.items():
+            requests.append(('PUT', f'/workflows/{machine_id}/stage/{stage}', {'status': status}))
+
+        # Distinct (stage, user) pairs not assigned yet, each assigned exactly once
+        existing = {(stage['name'], user['user_id'])
+                    for stage in machines[machine_id]['workflow_instance']['stages']
+                    for user in stage.get('assigned_users', [])}
+        candidates = [(stage, user_id) for stage in stages for user_id in users if (stage, user_id) not in existing]
+        assigned = randomizer.sample(candidates, min(assignments_per_machine, len(candidates)))
+        for stage, user_id in assigned:
+            requests.append(('POST', f'/workflows/{machine_id}/assign', {'stage_name': stage, 'user_id': user_id}))
+        expected[machine_id] = {'statuses': statuses, 'assignments': existing | set(assigned)}
+    randomizer.shuffle(requests)
+    return requests, expected
+
+
+def check_machine(machine_data, expected):
+    """Problems found in a machine after the run (empty when it is consistent)"""
+    problems = []
+    workflow_instance = machine_data['workflow_instance']
+    stages = workflow_instance['stages']
+    for stage in stages:
+        if stage['status'] != expected['statuses'][stage['name']]:
+            problems.append(f"lost status update on {stage['name']}")
+
+    assignments = {(stage['name'], user['user_id']) for stage in stages for user in stage.get('assigned_users', [])}
+    for stage_name, user_id in sorted(expected['assignments'] - assignments):
+        problems.append(f"lost assignment of {user_id} to {stage_name}")
+
+    for field, value in membership_fields(workflow_instance).items():
+        if sorted(machine_data.get(field, [])) != sorted(value):
+            problems.append(f"{field} out of sync with the stages")
+
+    current_stage, workflow_status = derive_workflow_state(stages)
+    if (machine_data.get('current_stage'), machine_data.get('workflow_status')) != (current_stage, workflow_status):
+        problems.append('current_stage/workflow_status not derived from the final stages')
+    return problems
+
+
+def without_zeros(value):
+    """Counters without the entries that increments left at zero"""
+    if isinstance(value, dict):
+        value = {key: without_zeros(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in (0, {})}
+    return value
+
+
+def rounded(value):
+    """Counters with the open hours rounded (increments add them up in another order)"""
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    return round(value, 6) if isinstance(value, float) else value
+
+
+def run(args):
+    collections = DatasetGenerator(
+        machines=max(args.machines, 10), clients=10, users_per_role=args.users_per_role,
+        history_depth=1, days=30, seed=args.seed, password=DEFAULT_PASSWORD,
+    ).generate()
+    machine_ids = list(collections['machines'])[:args.machines]
+    requests, expected = build_requests(collections, machine_ids, args.assignments, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        load_dataset(collections, args.backend, workdir)
+        admin_id = next(user_id for user_id, user in collections['users'].items() if user['role'] == 'admin')
+        sessions = {'admin': (admin_id, collections['users'][admin_id])}
+        local = threading.local()
+
+        def issue(request):
+            if not hasattr(local, 'client'):
+                local.client = make_client(sessions, 'admin')
+            method, path, body = request
+            started = time.perf_counter()
+            response = local.client.open(path, method=method, json=body, base_url=BASE_URL)
+            return (time.perf_counter() - started) * 1000, response.status_code
+
+        print(f"{len(requests)} requests on {len(machine_ids)} machines from {args.threads} threads "
+              f"({args.backend})", flush=True)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            results = list(executor.map(issue, requests))
+        elapsed = time.perf_counter() - started
+
+        db = get_db()
+        problems = {}
+        for machine_id in machine_ids:
+            machine_problems = check_machine(db.collection('machines').document(machine_id).get().to_dict(),
+                                             expected[machine_id])
+            if machine_problems:
+                problems[machine_id] = machine_problems
+
+        # The aggregate is incremented in the same transactions, so it must match a recount
+        workflow_stats = get_workflow_stats(db)
+        recount = build_workflow_stats(doc.to_dict() for doc in db.collection('machines').stream())
+        for field, value in recount.items():
+            if without_zeros(workflow_stats.get(field)) != without_zeros(value):
+                problems.setdefault('stats/workflows', []).append(f'{field} differs from a recount')
+        # Stage updates move current_stage, so the workload index must follow it too
+        workloads = get_workloads(db)['users']
+        recount = build_workloads(doc.to_dict() for doc in db.collection('machines').stream())
+        if without_zeros(rounded(workloads)) != without_zeros(rounded(recount)):
+            problems.setdefault('stats/workloads', []).append('open assignments or hours differ from a recount')
+
+        # Every request leaves one change event, which the dashboard lists as an activity
+        activities = len(list_workflow_activities(db, limit=len(requests) + 1))
+        if activities != len(requests):
+            problems.setdefault('stats/workflows', []).append(
+                f"{activities} activities recorded for {len(requests)} requests")
+
+    durations = sorted(duration for duration, _ in results)
+    statuses = {}
+    for _, status_code in results:
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+    print(f"throughput {len(results) / elapsed:.1f} req/s  p50 {percentile(durations, 0.50):.2f}ms  "
+          f"p95 {percentile(durations, 0.95):.2f}ms  p99 {percentile(durations, 0.99):.2f}ms  status {statuses}")
+    for machine_id, machine_problems in problems.items():
+        print(f"{machine_id}: {'; '.join(machine_problems)}")
+    print(f"{len(problems)} inconsistent machine(s)")
+    return 1 if problems or set(statuses) != {'200'} else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--machines', type=int, default=10, help='Machines updated concurrently')
+    parser.add_argument('--assignments', type=int, default=10, help='Users assigned per machine')
+    parser.add_argument('--users-per-role', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    return run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
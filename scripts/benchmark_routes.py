@@ -0,0 +1,365 @@
+"""
+Benchmark every API route through the Flask test client on local datasets
+Usage: python scripts/benchmark_routes.py run --sizes 1k,10k --output benchmarks/baseline.json
+       python scripts/benchmark_routes.py compare benchmarks/baseline.json benchmarks/current.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Start the app on the bundled export; each dataset size then swaps the client in
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from generate_dataset import DEFAULT_PASSWORD, SCALES, DatasetGenerator  # noqa: E402
+from app import app  # noqa: E402
+from blueprints import firestore_metrics, machine_mirror, reference_cache, request_metrics  # noqa: E402
+from blueprints.firebase_config import set_db  # noqa: E402
+from blueprints.machines import encode_watermark  # noqa: E402
+from blueprints.memory_store import create_memory_client  # noqa: E402
+from blueprints.sqlite_store import create_sqlite_client  # noqa: E402
+
+BASE_URL = 'https://localhost'
+TECH_ROLE = 'assembly_tech'
+
+# Endpoints intentionally not benchmarked: page redirects, static files, and
+# destructive writes that would empty the dataset while it is measured
+EXCLUDED_ENDPOINTS = {
+    'home', 'goto_login', 'voir_machines', 'clients_html', 'users_html', 'dashboard_html',
+    'ajouter_client_html', 'static', 'dashboard.dashboard', 'clients.clients_page', 'users.users_page',
+    'machines.view_machines', 'login.logout', 'machines.delete_machine', 'clients.delete_client',
+    'users.delete_user', 'stages.refresh_stage_definitions', 'events.stream_events',
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def parse_size(value):
+    """A --sizes entry: a preset name (1k, 10k, 100k) or a machine count"""
+    if value in SCALES:
+        return value, dict(SCALES[value])
+    machines = int(value)
+    return value, {'machines': machines, 'clients': max(10, machines // 6), 'users_per_role': 3}
+
+
+def load_dataset(collections, backend, workdir):
+    """Install a dataset as the app's database client"""
+    if backend == 'sqlite':
+        path = os.path.join(workdir, f'benchmark-{time.time_ns()}.db')
+        client = create_sqlite_client(path)
+        for collection, documents in collections.items():
+            client.engine.put_many(collection, documents)
+    else:
+        client = create_memory_client(collections)
+    set_db(client)
+    reference_cache.invalidate()
+    # With MACHINE_MIRROR=1 the replica must follow the new client
+    machine_mirror.stop_mirror()
+    if machine_mirror.start_mirror():
+        machine_mirror.wait_for_mirror()
+    firestore_metrics.reset()
+    request_metrics.reset()
+
+
+def build_cases(collections, include_writes):
+    """Requests covering the registered routes, with ids taken from the dataset"""
+    users = collections['users']
+    machines = collections['machines']
+    admin_id = next(user_id for user_id, user in users.items() if user['role'] == 'admin')
+
+    # The busiest technician is the interesting case for per-user queries
+    assigned = {}
+    for machine in machines.values():
+        if machine.get('assigned_user_id'):
+            assigned[machine['assigned_user_id']] = assigned.get(machine['assigned_user_id'], 0) + 1
+    tech_id = max((user_id for user_id, user in users.items() if user['role'] == TECH_ROLE),
+                  key=lambda user_id: assigned.get(user_id, 0))
+    tech_machine = next((machine_id for machine_id, machine in machines.items()
+                         if machine.get('assigned_user_id') == tech_id), next(iter(machines)))
+    machine_id = next(iter(machines))
+    client_id = next(iter(collections['clients']))
+    tech = users[tech_id]
+    stage_name = tech['stage_access']
+
+    sessions = {'admin': (admin_id, users[admin_id]), 'tech': (tech_id, tech)}
+    # Delta sync from a week ago; a callable path keeps the case name free of the token
+    week_ago = encode_watermark(datetime.now() - timedelta(days=7))
+    cases = [
+        ('login.login', 'POST', '/login', None, {'email': tech['email'], 'password': DEFAULT_PASSWORD}),
+        ('users.get_current_user', 'GET', '/users/current', 'tech', None),
+        ('users.get_all_users', 'GET', '/users/all', 'admin', None),
+        ('users.get_user', 'GET', f'/users/{tech_id}', 'admin', None),
+        ('users.get_available_roles', 'GET', '/users/roles', 'admin', None),
+        ('users.get_users_by_stage', 'GET', f'/users/by-stage/{stage_name}', 'admin', None),
+        ('users.get_user_workloads', 'GET', '/users/workloads', 'admin', None),
+        ('clients.get_clients', 'GET', '/clients/all', 'admin', None),
+        ('clients.get_client', 'GET', f'/clients/{client_id}', 'admin', None),
+        ('machines.get_all_machines', 'GET', '/machines', 'admin', None),
+        ('machines.get_all_machines', 'GET', '/machines?limit=50', 'admin', None),
+        ('machines.get_all_machines', 'GET', '/machines', 'tech', None),
+        ('machines.get_machine', 'GET', f'/machines/{machine_id}', 'admin', None),
+        ('machines.get_machine', 'GET', f'/machines/{tech_machine}', 'tech', None),
+        ('machines.get_machines_statistics', 'GET', '/machines/statistics', 'admin', None),
+        ('machines.get_machine_changes', 'GET', lambda i: f'/machines/changes?since={week_ago}', 'admin', None),
+        ('machines.get_machine_changes', 'GET', lambda i: f'/machines/changes?since={week_ago}', 'tech', None),
+        ('stages.get_stage_definitions', 'GET', '/stages/definitions', 'tech', None),
+        ('stages.get_machine_current_stage', 'GET', f'/stages/machine/{tech_machine}/current', 'tech', None),
+        ('stages.get_machine_history', 'GET', f'/stages/machine/{machine_id}/history', 'admin', None),
+        ('stages.get_my_tasks', 'GET', '/stages/my-tasks', 'tech', None),
+        ('stages.get_dashboard_data', 'GET', '/stages/dashboard', 'admin', None),
+        ('stages.get_dashboard_data', 'GET', '/stages/dashboard', 'tech', None),
+        ('stages.get_recent_activities', 'GET', '/stages/recent-activities', 'admin', None),
+        ('stages.get_recent_activities', 'GET', '/stages/recent-activities', 'tech', None),
+        ('dashboard.dashboard_bootstrap', 'GET', '/dashboard/bootstrap', 'admin', None),
+        ('dashboard.dashboard_bootstrap', 'GET', '/dashboard/bootstrap', 'tech', None),
+        ('workflow.get_workflows', 'GET', '/workflows', 'tech', None),
+        ('workflow.get_machine_workflow', 'GET', f'/workflows/{tech_machine}', 'tech', None),
+        ('workflow.get_workflow_stages', 'GET', '/workflow_stages', 'tech', None),
+        ('workflow.workflow_dashboard', 'GET', '/workflows/dashboard', 'admin', None),
+        ('metrics.metrics', 'GET', '/metrics', 'admin', None),
+    ]
+
+    if include_writes:
+        # Writes cycle through machines so every iteration has a valid target
+        in_progress = [machine_id for machine_id, machine in machines.items() if machine.get('current_stage')]
+        first_client = collections['clients'][client_id]
+        cases += [
+            ('machines.create_machine', 'POST', '/machines', 'admin',
+             lambda i: {'serialNumber': f'BENCH-{i}', 'ficheNumber': f'FB-{i}', 'machineType': 'Olivia Standard',
+                        'clientId': client_id, 'clientName': first_client['clientName'],
+                        'clientSociety': first_client['clientSociety']}),
+            ('machines.update_machine', 'PUT', lambda i: f'/machines/{in_progress[i % len(in_progress)]}', 'admin',
+             {'remarques': 'benchmark'}),
+            ('stages.validate_machine_stage', 'POST', lambda i: f'/stages/{in_progress[-1 - i % len(in_progress)]}/validate',
+             'admin', {'remarks': 'benchmark'}),
+            ('workflow.update_workflow_stage', 'PUT',
+             lambda i: f'/workflows/{in_progress[i % len(in_progress)]}/stage/{machines[in_progress[i % len(in_progress)]]["current_stage"]}',
+             'admin', {'status': 'in_progress'}),
+            ('workflow.assign_user_to_stage', 'POST', lambda i: f'/workflows/{in_progress[i % len(in_progress)]}/assign',
+             'admin', {'stage_name': stage_name, 'user_id': tech_id}),
+            ('clients.create_client', 'POST', '/clients', 'admin',
+             lambda i: {'clientName': f'Bench {i}', 'clientSociety': 'Bench', 'clientPhone': '20000000',
+                        'clientAddress': 'Sfax'}),
+            ('clients.update_client', 'PUT', f'/clients/{client_id}', 'admin', {'clientLocation': 'Sfax'}),
+            ('users.create_user', 'POST', '/users', 'admin',
+             lambda i: {'username': f'bench_{time.time_ns()}', 'email': f'bench_{time.time_ns()}@isolab.com',
+                        'password': 'bench', 'role': TECH_ROLE, 'first_name': 'Bench', 'last_name': 'User'}),
+            ('users.update_user', 'PUT', f'/users/{tech_id}', 'admin', {'phone': '+216 20 000 000'}),
+            ('machines.recompute_machines_statistics', 'POST', '/machines/statistics/recompute', 'admin', None),
+            ('workflow.recompute_workflow_dashboard', 'POST', '/workflows/dashboard/recompute', 'admin', None),
+        ]
+    return cases, sessions
+
+
+def make_client(sessions, role):
+    """Test client with a logged-in session for a role (None: anonymous)"""
+    client = app.test_client()
+    if role is not None:
+        user_id, user = sessions[role]
+        with client.session_transaction(base_url=BASE_URL) as session:
+            session['user_id'] = user_id
+            session['role'] = user['role']
+            session['username'] = user.get('username')
+            session['stage_access'] = user.get('stage_access', '')
+    return client
+
+
+def issue(client, method, path, body, iteration):
+    """Send one request; callable paths and bodies vary with the iteration"""
+    path = path(iteration) if callable(path) else path
+    body = body(iteration) if callable(body) else body
+    return client.open(path, method=method, json=body, base_url=BASE_URL)
+
+
+def run_case(sessions, case, iterations, warmup, alloc_iterations):
+    """Time one case; returns latency percentiles, allocations and backend counters"""
+    endpoint, method, path, role, body = case
+    client = make_client(sessions, role)
+    for iteration in range(warmup):
+        issue(client, method, path, body, iteration)
+
+    gc.collect()
+    durations = []
+    statuses = {}
+    reads = queries = writes = 0
+    for iteration in range(warmup, warmup + iterations):
+        started = time.perf_counter()
+        response = issue(client, method, path, body, iteration)
+        durations.append((time.perf_counter() - started) * 1000)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        reads += int(response.headers.get('X-Firestore-Reads', 0))
+        queries += int(response.headers.get('X-Firestore-Queries', 0))
+        writes += int(response.headers.get('X-Firestore-Writes', 0))
+
+    # Allocation pass, separate because tracing slows every request down
+    tracemalloc.start()
+    peaks = []
+    for iteration in range(warmup + iterations, warmup + iterations + alloc_iterations):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        issue(client, method, path, body, iteration)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'endpoint': endpoint,
+        'iterations': iterations,
+        'status': statuses,
+        'mean_ms': round(sum(durations) / len(durations), 3),
+        'p50_ms': round(percentile(durations, 0.50), 3),
+        'p95_ms': round(percentile(durations, 0.95), 3),
+        'p99_ms': round(percentile(durations, 0.99), 3),
+        'max_ms': round(durations[-1], 3),
+        'peak_alloc_kb': round(sum(peaks) / len(peaks) / 1024, 1) if peaks else None,
+        'reads': round(reads / iterations, 1),
+        'queries': round(queries / iterations, 1),
+        'writes': round(writes / iterations, 1),
+    }
+
+
+def case_name(case):
+    """Stable report key; parametrized paths are named by their endpoint"""
+    endpoint, method, path, role, _ = case
+    return f"{method} {endpoint if callable(path) else path} [{role or 'anonymous'}]"
+
+
+def command_run(args):
+    results = {}
+    exercised = set()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes.split(','):
+            label, scale = parse_size(size.strip())
+            print(f"== {label}: generating {scale['machines']} machines", flush=True)
+            collections = DatasetGenerator(
+                machines=scale['machines'], clients=scale['clients'], users_per_role=scale['users_per_role'],
+                history_depth=args.history_depth, days=730, seed=args.seed, password=DEFAULT_PASSWORD,
+            ).generate()
+            load_dataset(collections, args.backend, workdir)
+
+            cases, sessions = build_cases(collections, args.include_writes)
+            results[label] = {}
+            for case in cases:
+                if args.only and args.only not in case[0]:
+                    continue
+                result = run_case(sessions, case, args.iterations, args.warmup, args.alloc_iterations)
+                name = case_name(case)
+                results[label][name] = result
+                exercised.add(case[0])
+                print(f"{name:<60} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+                      f"reads {result['reads']:>8}  status {result['status']}", flush=True)
+
+    registered = {rule.endpoint for rule in app.url_map.iter_rules()}
+    not_covered = sorted(registered - exercised - EXCLUDED_ENDPOINTS)
+    if not_covered and not args.only:
+        print(f"Routes not benchmarked: {', '.join(not_covered)}")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'backend': args.backend,
+            'sizes': args.sizes,
+            'iterations': args.iterations,
+            'history_depth': args.history_depth,
+            'seed': args.seed,
+            'include_writes': args.include_writes,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+        print(f"Wrote {args.output}")
+
+
+def command_compare(args):
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    with open(args.current) as current_file:
+        current = json.load(current_file)['results']
+
+    regressions = 0
+    for size in sorted(set(baseline) & set(current)):
+        print(f"== {size}")
+        print(f"{'case':<60}{'p50 base':>10}{'p50 now':>10}{'p95 base':>10}{'p95 now':>10}{'reads':>14}")
+        for name in sorted(set(baseline[size]) | set(current[size])):
+            before = baseline[size].get(name)
+            after = current[size].get(name)
+            if before is None or after is None:
+                print(f"{name:<60} {'only in current' if before is None else 'only in baseline'}")
+                continue
+
+            flags = []
+            for metric in ('p50_ms', 'p95_ms'):
+                grown = after[metric] - before[metric]
+                if grown > args.min_ms and after[metric] > before[metric] * (1 + args.threshold):
+                    flags.append(f"{metric} +{grown / max(before[metric], 1e-9) * 100:.0f}%")
+            if after['reads'] > before['reads']:
+                flags.append(f"reads {before['reads']} -> {after['reads']}")
+            if sorted(after['status']) != sorted(before['status']):
+                flags.append(f"status {'/'.join(sorted(before['status']))} -> {'/'.join(sorted(after['status']))}")
+            if flags:
+                regressions += 1
+
+            print(f"{name:<60}{before['p50_ms']:>10.2f}{after['p50_ms']:>10.2f}{before['p95_ms']:>10.2f}"
+                  f"{after['p95_ms']:>10.2f}{before['reads']:>7}->{after['reads']:<6}"
+                  f"{'  REGRESSION: ' + ', '.join(flags) if flags else ''}")
+
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Benchmark the routes and write a JSON report')
+    run_parser.add_argument('--sizes', default='1k', help='Comma-separated presets (1k,10k,100k) or machine counts')
+    run_parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    run_parser.add_argument('--iterations', type=int, default=30)
+    run_parser.add_argument('--warmup', type=int, default=3)
+    run_parser.add_argument('--alloc-iterations', type=int, default=3)
+    run_parser.add_argument('--history-depth', type=int, default=2)
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--include-writes', action='store_true', help='Also benchmark create/update routes')
+    run_parser.add_argument('--only', help='Only run cases whose endpoint contains this text')
+    run_parser.add_argument('--output', help='JSON report path (e.g. benchmarks/baseline.json)')
+
+    compare_parser = commands.add_parser('compare', help='Flag regressions between two reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='Relative latency increase counted as a regression (default 20%%)')
+    compare_parser.add_argument('--min-ms', type=float, default=0.5,
+                                help='Ignore latency increases smaller than this many milliseconds')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        command_run(args)
+        return 0
+    return command_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Generate a synthetic, internally consistent dataset at production-like scale
+Usage: python scripts/generate_dataset.py --scale 10k --output datasets/10k
+       python scripts/generate_dataset.py --machines 2500 --history-depth 3 --sqlite isolab.db
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from blueprints.assignment_scheduler import ASSIGNED_HOURS_FIELD, WORKLOADS_DOC, build_workloads, stage_hours
+from blueprints.firestore_export import DEFAULT_EXPORT_DIR, load_export, write_export
+from blueprints.machine_stats import MACHINE_STATS_DOC, STATS_COLLECTION, stats_bucket
+from blueprints.users import hash_password
+from blueprints.workflow_membership import BACKFILL_DOC, membership_fields
+from blueprints.workflow_stats import WORKFLOW_STATS_DOC, build_workflow_stats
+
+# Presets for --scale: machines, clients, users per technician role
+SCALES = {
+    '1k': {'machines': 1000, 'clients': 200, 'users_per_role': 3},
+    '10k': {'machines': 10000, 'clients': 1500, 'users_per_role': 10},
+    '100k': {'machines': 100000, 'clients': 12000, 'users_per_role': 30},
+}
+
+DEFAULT_PASSWORD = 'isolab123'
+
+FIRST_NAMES = ['Ahmed', 'Mohamed', 'Youssef', 'Fatma', 'Leila', 'Amina', 'Sami', 'Nadia', 'Karim',
+               'Hedi', 'Sonia', 'Walid', 'Ines', 'Mehdi', 'Rania', 'Slim', 'Olfa', 'Anis', 'Salma', 'Hamza']
+LAST_NAMES = ['Ben Ali', 'Trabelsi', 'Gharbi', 'Hadji', 'Mansouri', 'Abdellaoui', 'Bouaziz', 'Cherif',
+              'Kallel', 'Jebali', 'Sassi', 'Ayari', 'Mejri', 'Dridi', 'Hammami', 'Baccouche']
+LOCATIONS = ['Sfax', 'Sousse', 'Gafsa', 'Kairouan', 'Mahdia', 'Monastir', 'Nabeul', 'Béja',
+             'Jendouba', 'Sidi Bouzid', 'Médenine', 'Zaghouan']
+SOCIETY_PREFIXES = ['Ferme', 'Huilerie', 'Domaine', 'Exploitation', 'Oliveraie', 'Société Agricole']
+MACHINE_TYPES = ['Olivia Standard', 'Olivia Premium', 'Olivia Compact']
+PAYMENT_STATUSES = ['En cours', 'Payé', 'En attente']
+PAYMENT_TYPES = ['Crédit', 'Espèces', 'Virement']
+FACTURATIONS = ['Non facturée', 'Facturée']
+CONFIRMATIONS = ['En attente', 'Confirmée']
+DEPARTMENTS = {
+    'supervisor': 'Production',
+    'assembly_tech': 'Production',
+    'testing_tech': 'Quality',
+    'delivery_tech': 'Logistics',
+    'installation_tech': 'Field Service',
+}
+REWORK_REMARKS = ['Reprise après contrôle', 'Pièce remplacée', 'Réglage à refaire']
+TVA_RATE = 0.19
+
+
+class DatasetGenerator:
+    """Builds {collection: {doc_id: data}} with references that resolve"""
+
+    def __init__(self, machines, clients, users_per_role, history_depth, days, seed, password):
+        self.random = random.Random(seed)
+        self.machine_count = machines
+        self.client_count = clients
+        self.users_per_role = users_per_role
+        self.history_depth = history_depth
+        self.days = days
+        self.password_hash = hash_password(password)
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+
+        reference = load_export(DEFAULT_EXPORT_DIR)
+        self.stages = reference['stages']
+        self.roles = reference.get('roles', {})
+        self.stage_order = sorted(self.stages.values(), key=lambda stage: stage['order'])
+
+    def new_id(self):
+        return ''.join(self.random.choice(string.ascii_letters + string.digits) for _ in range(20))
+
+    def phone(self):
+        return f"+216 {self.random.randint(20, 99)} {self.random.randint(100, 999)} {self.random.randint(100, 999)}"
+
+    def build_users(self):
+        """One admin plus users_per_role active users for every stage role"""
+        users = {}
+        created_at = self.now - timedelta(days=self.days + 30)
+        users[self.new_id()] = {
+            'username': 'admin', 'email': 'admin@isolab.com', 'password': self.password_hash,
+            'role': 'admin', 'first_name': 'Administrator', 'last_name': 'System',
+            'department': 'IT', 'phone': self.phone(), 'specialization': '',
+            'stage_access': 'all', 'created_at': created_at, 'is_active': True,
+            'can_validate_all': True,
+        }
+        for stage in self.stage_order:
+            role = stage['required_role']
+            for number in range(1, self.users_per_role + 1):
+                username = f"{role}_{number}"
+                users[self.new_id()] = {
+                    'username': username, 'email': f"{username}@isolab.com", 'password': self.password_hash,
+                    'role': role, 'first_name': self.random.choice(FIRST_NAMES),
+                    'last_name': self.random.choice(LAST_NAMES), 'department': DEPARTMENTS.get(role, ''),
+                    'phone': self.phone(), 'specialization': stage['label'], 'stage_access': stage['name'],
+                    'created_at': created_at, 'is_active': True, 'can_validate_all': False,
+                }
+        return users
+
+    def build_clients(self):
+        clients = {}
+        for _ in range(self.client_count):
+            first_name = self.random.choice(FIRST_NAMES)
+            last_name = self.random.choice(LAST_NAMES)
+            location = self.random.choice(LOCATIONS)
+            clients[self.new_id()] = {
+                'clientName': f"{first_name} {last_name}",
+                'clientSociety': f"{self.random.choice(SOCIETY_PREFIXES)} {last_name}",
+                'clientEmail': f"{first_name}.{last_name}".lower().replace(' ', '') + '@email.tn',
+                'clientPhone': str(self.random.randint(20000000, 99999999)),
+                'clientAddress': f"Route {self.random.randint(1, 120)}, {location}",
+                'clientLocation': location,
+                'dateAdded': self.now - timedelta(days=self.days + self.random.randint(0, 365)),
+                'created_by': 'admin',
+                'is_active': True,
+            }
+        return clients
+
+    def build_machines(self, users, clients):
+        """Machines spread over the last `days` days, each with its history entries"""
+        users_by_role = {}
+        for user_id, user in users.items():
+            users_by_role.setdefault(user['role'], []).append((user_id, user))
+        client_items = list(clients.items())
+
+        machines = {}
+        history = {}
+        for number in range(1, self.machine_count + 1):
+            machine_id = self.new_id()
+            client_id, client = self.random.choice(client_items)
+            date_added = self.now - timedelta(days=self.random.uniform(0, self.days))
+            # Older machines have progressed further through the workflow
+            age_ratio = (self.now - date_added).days / max(self.days, 1)
+            completed_stages = min(len(self.stage_order),
+                                   int(self.random.triangular(0, len(self.stage_order) + 1, age_ratio * 6)))
+
+            prix_ht = self.random.randint(60, 160) * 1000
+            machine = {
+                'serialNumber': f"OLIVIA-{number:06d}",
+                'ficheNumber': f"FT-{number:06d}",
+                'machineType': self.random.choice(MACHINE_TYPES),
+                'clientId': client_id,
+                'clientName': client['clientName'],
+                'clientSociety': client['clientSociety'],
+                'prixHT': prix_ht,
+                'prixTTC': round(prix_ht * (1 + TVA_RATE)),
+                'paymentStatus': self.random.choice(PAYMENT_STATUSES),
+                'paymentType': self.random.choice(PAYMENT_TYPES),
+                'facturation': self.random.choice(FACTURATIONS),
+                'confirmation': self.random.choice(CONFIRMATIONS),
+                'remarques': '',
+                'dateAdded': date_added,
+                'created_by': 'admin',
+            }
+
+            workflow_stages = []
+            stage_started_at = date_added
+            for index, stage in enumerate(self.stage_order):
+                assignee_id, assignee = self.random.choice(users_by_role[stage['required_role']])
+                workflow_stage = {
+                    'name': stage['name'],
+                    'label': stage['label'],
+                    'order': stage['order'],
+                    'status': 'pending',
+                    'assigned_users': [{'user_id': assignee_id, 'username': assignee['username']}],
+                    'notes': '',
+                }
+                if index < completed_stages:
+                    stage_started_at = self.add_stage_history(
+                        history, machine_id, machine, stage, assignee_id, assignee, stage_started_at)
+                    workflow_stage.update(status='completed', completed_at=stage_started_at)
+                elif index == completed_stages:
+                    workflow_stage.update(status='in_progress', started_at=stage_started_at)
+                    machine.update({
+                        'status': 'En cours',
+                        'current_stage': stage['name'],
+                        'current_stage_label': stage['label'],
+                        'assigned_user_id': assignee_id,
+                        'assigned_username': assignee['username'],
+                        ASSIGNED_HOURS_FIELD: stage_hours(stage),
+                        'stage_started_at': stage_started_at,
+                    })
+                workflow_stages.append(workflow_stage)
+
+            if completed_stages == len(self.stage_order):
+                machine.update({
+                    'status': 'Completed',
+                    'current_stage': None,
+                    'current_stage_label': 'Completed',
+                    'assigned_user_id': None,
+                    'assigned_username': None,
+                    'completed_at': stage_started_at,
+                })
+
+            last_update = min(stage_started_at, self.now)
+            machine.update({'dateUpdated': last_update, 'updated_at': last_update})
+            machine['workflow_instance'] = {
+                'stages': workflow_stages,
+                'created_at': date_added,
+                'updated_at': last_update,
+            }
+            machine.update(membership_fields(machine['workflow_instance']))
+            machine['workflow_status'] = 'completed' if machine['status'] == 'Completed' else 'active'
+            machines[machine_id] = machine
+        return machines, history
+
+    def add_stage_history(self, history, machine_id, machine, stage, user_id, user, started_at):
+        """Add 1 to history_depth entries (reworks, then the completion) for a stage.
+        Returns when the stage was completed."""
+        attempts = self.random.randint(1, self.history_depth)
+        for attempt in range(attempts):
+            duration = self.random.uniform(0.5, 2.0) * stage.get('estimated_duration_hours', 4)
+            completed_at = min(started_at + timedelta(hours=duration, days=self.random.uniform(0, 3)), self.now)
+            final = attempt == attempts - 1
+            history[self.new_id()] = {
+                'machine_id': machine_id,
+                'machine_serial': machine['serialNumber'],
+                'stage_name': stage['name'],
+                'stage_label': stage['label'],
+                'status': 'completed',
+                'assigned_user_id': user_id,
+                'assigned_username': user['username'],
+                'started_at': started_at,
+                'completed_at': completed_at,
+                'duration_hours': round((completed_at - started_at).total_seconds() / 3600, 2),
+                'remarks': '' if final else self.random.choice(REWORK_REMARKS),
+                'created_at': completed_at,
+            }
+            started_at = completed_at
+        return started_at
+
+    def build_stats(self, machines):
+        """The stats/machines, stats/workflows and stats/workloads aggregates matching the generated machines, and the membership backfill marker"""
+        stats = {'total_machines': 0, 'completed_machines': 0, 'stage_counts': {}}
+        for machine in machines.values():
+            stats['total_machines'] += 1
+            if machine.get('status') == 'Completed':
+                stats['completed_machines'] += 1
+            bucket = stats_bucket(machine)
+            stats['stage_counts'][bucket] = stats['stage_counts'].get(bucket, 0) + 1
+        stats['updated_at'] = self.now
+        stats['recomputed_at'] = self.now
+
+        workflow_stats = build_workflow_stats(machines.values())
+        workflow_stats.update(updated_at=self.now, recomputed_at=self.now)
+
+        stages_by_name = {stage['name']: stage for stage in self.stage_order}
+        workloads = {'users': build_workloads(machines.values(), stages_by_name.get), 'rotations': {},
+                     'updated_at': self.now, 'recomputed_at': self.now}
+        # Every generated machine carries the membership fields
+        membership = {'backfilled_at': self.now}
+        return {MACHINE_STATS_DOC: stats, WORKFLOW_STATS_DOC: workflow_stats, WORKLOADS_DOC: workloads,
+                BACKFILL_DOC: membership}
+
+    def generate(self):
+        users = self.build_users()
+        clients = self.build_clients()
+        machines, history = self.build_machines(users, clients)
+        return {
+            'users': users,
+            'clients': clients,
+            'stages': dict(self.stages),
+            'roles': dict(self.roles),
+            'machines': machines,
+            'machine_history': history,
+            STATS_COLLECTION: self.build_stats(machines),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k')
+    parser.add_argument('--machines', type=int, help='Override the number of machines of --scale')
+    parser.add_argument('--clients', type=int, help='Override the number of clients of --scale')
+    parser.add_argument('--users-per-role', type=int, help='Override the users per stage role of --scale')
+    parser.add_argument('--history-depth', type=int, default=2,
+                        help='Maximum history entries per completed stage (reworks included)')
+    parser.add_argument('--days', type=int, default=730, help='Spread dateAdded over this many days')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of every generated user')
+    parser.add_argument('--output', help='Write an export directory (the format of firestore_export_*)')
+    parser.add_argument('--sqlite', help='Load into this SQLite database (replacing its collections)')
+    args = parser.parse_args()
+
+    if not args.output and not args.sqlite:
+        parser.error('give --output and/or --sqlite')
+    if args.history_depth < 1:
+        parser.error('--history-depth must be at least 1')
+
+    scale = SCALES[args.scale]
+    generator = DatasetGenerator(
+        machines=args.machines or scale['machines'],
+        clients=args.clients or scale['clients'],
+        users_per_role=args.users_per_role or scale['users_per_role'],
+        history_depth=args.history_depth,
+        days=args.days,
+        seed=args.seed,
+        password=args.password,
+    )
+
+    started = time.perf_counter()
+    collections = generator.generate()
+    for collection, documents in collections.items():
+        print(f"{collection}: {len(documents)} documents")
+    print(f"Generated in {time.perf_counter() - started:.1f}s")
+
+    if args.output:
+        write_export(collections, args.output)
+        print(f"Wrote export to {args.output}")
+    if args.sqlite:
+        from blueprints.sqlite_store import SQLiteEngine
+
+        engine = SQLiteEngine(args.sqlite)
+        for collection, documents in collections.items():
+            engine.drop(collection)
+            engine.put_many(collection, documents)
+        print(f"Loaded into {args.sqlite}")
+    print(f"Every user's password is '{args.password}' (admin login: admin@isolab.com)")
+
+
+if __name__ == '__main__':
+    main()
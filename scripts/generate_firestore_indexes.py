@@ -0,0 +1,76 @@
+"""
+Generate firestore.indexes.json from the query shapes used by the blueprints
+Run after changing MACHINE_FILTERS: python scripts/generate_firestore_indexes.py
+"""
+
+import json
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from blueprints.events import EVENTS_COLLECTION
+from blueprints.machines import MACHINE_FILTERS, VISIBILITY_FIELDS, DATE_RANGE_FIELD, CHANGES_ORDER_FIELD
+from blueprints.machine_tombstones import TOMBSTONES_COLLECTION, TOMBSTONE_SCOPE_FIELDS, REMOVED_AT_FIELD
+
+OUTPUT_PATH = os.path.join(ROOT_DIR, 'firestore.indexes.json')
+
+# Composite indexes needed by queries outside the machine listing
+EXTRA_INDEXES = [
+    ('machine_history', [('machine_id', 'ASCENDING'), ('created_at', 'ASCENDING')]),
+    # Workflow dashboard activities (workflow_stats.list_workflow_activities)
+    (EVENTS_COLLECTION, [('type', 'ASCENDING'), ('created_at', 'DESCENDING')]),
+]
+
+# Collections whose expire_at field drives a TTL deletion policy
+TTL_COLLECTIONS = [EVENTS_COLLECTION, TOMBSTONES_COLLECTION]
+
+
+def machine_listing_indexes():
+    """One index per equality field, sharing the listing sort order.
+    Firestore merges these for queries combining several equality filters."""
+    fields = []
+    for field in VISIBILITY_FIELDS + list(MACHINE_FILTERS.values()):
+        if field not in fields:
+            fields.append(field)
+    return [
+        ('machines', [(field, 'ASCENDING'), (DATE_RANGE_FIELD, 'DESCENDING'), ('__name__', 'DESCENDING')])
+        for field in fields
+    ]
+
+
+def change_feed_indexes():
+    """Indexes of the delta sync queries: one visibility field, then change order"""
+    indexes = [
+        ('machines', [(field, 'ASCENDING'), (CHANGES_ORDER_FIELD, 'ASCENDING'), ('__name__', 'ASCENDING')])
+        for field in VISIBILITY_FIELDS
+    ]
+    indexes += [
+        (TOMBSTONES_COLLECTION, [(field, 'ASCENDING'), (REMOVED_AT_FIELD, 'ASCENDING'), ('__name__', 'ASCENDING')])
+        for field in list(TOMBSTONE_SCOPE_FIELDS) + ['reason']
+    ]
+    return indexes
+
+
+def build_indexes():
+    """Build the firestore.indexes.json document"""
+    indexes = []
+    for collection, fields in machine_listing_indexes() + change_feed_indexes() + EXTRA_INDEXES:
+        indexes.append({
+            'collectionGroup': collection,
+            'queryScope': 'COLLECTION',
+            'fields': [{'fieldPath': path, 'order': order} for path, order in fields]
+        })
+    field_overrides = [
+        {'collectionGroup': collection, 'fieldPath': 'expire_at', 'ttl': True, 'indexes': []}
+        for collection in TTL_COLLECTIONS
+    ]
+    return {'indexes': indexes, 'fieldOverrides': field_overrides}
+
+
+if __name__ == '__main__':
+    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(build_indexes(), f, indent=2)
+        f.write('\n')
+    print(f"Wrote {OUTPUT_PATH}")
@@ -0,0 +1,45 @@
+"""
+Import a Firestore export directory into the SQLite storage backend
+Usage: python scripts/import_firestore_export.py [--export-dir DIR] [--db isolab.db] [--replace]
+"""
+
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from blueprints.firebase_config import DEFAULT_SQLITE_PATH
+from blueprints.firestore_export import DEFAULT_EXPORT_DIR, load_export
+from blueprints.sqlite_store import SQLiteEngine
+
+
+def import_export(engine, collections, replace=False):
+    """Write {collection: {doc_id: data}} into the engine; returns documents written per collection"""
+    written = {}
+    for collection, documents in collections.items():
+        if replace:
+            engine.drop(collection)
+        engine.put_many(collection, documents)
+        written[collection] = len(documents)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--export-dir', default=DEFAULT_EXPORT_DIR)
+    parser.add_argument('--db', default=os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH))
+    parser.add_argument('--replace', action='store_true',
+                        help='Drop each imported collection before writing it')
+    args = parser.parse_args()
+
+    collections = load_export(args.export_dir)
+    written = import_export(SQLiteEngine(args.db), collections, replace=args.replace)
+    for collection, count in sorted(written.items()):
+        print(f"{collection}: {count} documents")
+    print(f"Imported {sum(written.values())} documents into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
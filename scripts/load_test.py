@@ -0,0 +1,308 @@
+"""
+Load generator replaying the frontend's per-role page journeys against a running server
+Usage: python scripts/load_test.py --base-url http://127.0.0.1:8080 --users 20 --duration 60
+       python scripts/load_test.py --start-server --workers 2 --users 20 --duration 60
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of virtual users per role (technicians dominate real traffic)
+ROLE_WEIGHTS = {
+    'admin': 1,
+    'supervisor': 1,
+    'assembly_tech': 3,
+    'testing_tech': 2,
+    'delivery_tech': 2,
+}
+
+# Same page size as static/static/js/voir-machines.js
+MACHINES_PAGE_SIZE = 50
+
+
+class VirtualUser:
+    """One logged-in browser session issuing the page's API calls in order"""
+
+    def __init__(self, base_url, role, email, password, think_time, stats, rng):
+        self.base_url = base_url.rstrip('/')
+        self.role = role
+        self.email = email
+        self.password = password
+        self.think_time = think_time
+        self.stats = stats
+        self.rng = rng
+        self.http = requests.Session()
+        self.journey = None
+
+    def request(self, method, path, body=None):
+        """Send one call, record it against the current journey and return the JSON body"""
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, json=body, timeout=60)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        self.stats.record(self.journey, method, path, status, (time.perf_counter() - started) * 1000)
+
+        if response is None:
+            return None
+        # The session cookie is Secure, so requests will not send it back over http by itself
+        cookie = response.cookies.get('session')
+        if cookie:
+            self.http.headers['Cookie'] = f'session={cookie}'
+        try:
+            return response.json() if response.ok else None
+        except ValueError:
+            return None
+
+    def think(self):
+        if self.think_time:
+            time.sleep(self.rng.uniform(self.think_time / 2, self.think_time * 1.5))
+
+    def login(self):
+        self.journey = 'login'
+        data = self.request('POST', '/login', {'email': self.email, 'password': self.password})
+        return data is not None
+
+
+# Journeys mirror the fetch sequences of static/static/js: every page starts
+# with /users/current (sidebar-nav.js) before loading its own data
+
+def journey_dashboard(user):
+    """dashboard.js: bootstrap call with every section"""
+    user.request('GET', '/users/current')
+    user.request('GET', '/dashboard/bootstrap')
+
+
+def journey_browse_machines(user):
+    """voir-machines.js: first page, sometimes the next page, then a machine detail"""
+    user.request('GET', '/users/current')
+    page = user.request('GET', f'/machines?limit={MACHINES_PAGE_SIZE}') or {}
+    machines = page.get('data') or []
+    user.think()
+    if page.get('next_cursor') and user.rng.random() < 0.5:
+        more = user.request('GET', f"/machines?limit={MACHINES_PAGE_SIZE}&cursor={page['next_cursor']}") or {}
+        machines += more.get('data') or []
+        user.think()
+    if machines:
+        user.request('GET', f"/machines/{user.rng.choice(machines)['id']}")
+
+
+def journey_poll_machines(user):
+    """Technicians keeping voir-machines open and refreshing it"""
+    user.request('GET', '/users/current')
+    for _ in range(3):
+        user.request('GET', f'/machines?limit={MACHINES_PAGE_SIZE}')
+        user.think()
+
+
+def journey_validate_task(user):
+    """dashboard.js validateTask(): validate one of my tasks, then reload the dashboard"""
+    user.request('GET', '/users/current')
+    data = user.request('GET', '/dashboard/bootstrap?sections=tasks') or {}
+    tasks = data.get('tasks') or []
+    if not tasks:
+        return
+    user.think()
+    task = user.rng.choice(tasks)
+    user.request('POST', f"/stages/{task['machine_id']}/validate", {'remarks': 'load test'})
+    user.request('GET', '/dashboard/bootstrap')
+
+
+def journey_clients(user):
+    """clients.js: client list and one client's details"""
+    user.request('GET', '/users/current')
+    clients = (user.request('GET', '/clients/all') or {}).get('clients') or []
+    user.think()
+    if clients:
+        user.request('GET', f"/clients/{user.rng.choice(clients)['id']}")
+
+
+def journey_users(user):
+    """users.js: user list and one user's details"""
+    user.request('GET', '/users/current')
+    users = (user.request('GET', '/users/all') or {}).get('users') or []
+    user.think()
+    if users:
+        user.request('GET', f"/users/{user.rng.choice(users)['id']}")
+
+
+# (journey name, weight, function) per role
+TECH_JOURNEYS = [
+    ('dashboard', 3, journey_dashboard),
+    ('poll_machines', 4, journey_poll_machines),
+    ('browse_machines', 2, journey_browse_machines),
+    ('validate_task', 1, journey_validate_task),
+]
+JOURNEYS = {
+    'admin': [
+        ('dashboard', 4, journey_dashboard),
+        ('browse_machines', 3, journey_browse_machines),
+        ('clients', 2, journey_clients),
+        ('users', 1, journey_users),
+    ],
+    'supervisor': [
+        ('dashboard', 4, journey_dashboard),
+        ('browse_machines', 4, journey_browse_machines),
+    ],
+    'assembly_tech': TECH_JOURNEYS,
+    'testing_tech': TECH_JOURNEYS,
+    'delivery_tech': TECH_JOURNEYS,
+}
+WRITE_JOURNEYS = {'validate_task'}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class LoadStats:
+    """Request latencies and outcomes per journey, shared by all virtual users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.journeys = {}
+
+    def record(self, journey, method, path, status, duration_ms):
+        with self._lock:
+            self.latencies.setdefault(journey, []).append(duration_ms)
+            if status == 0 or status >= 400:
+                self.errors[journey] = self.errors.get(journey, 0) + 1
+
+    def journey_done(self, journey):
+        with self._lock:
+            self.journeys[journey] = self.journeys.get(journey, 0) + 1
+
+    def report(self, elapsed):
+        lines = [f"{'journey':<18}{'runs':>7}{'requests':>10}{'req/s':>9}{'errors':>9}"
+                 f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        total_requests = total_errors = 0
+        every_latency = []
+        for journey in sorted(self.latencies):
+            latencies = sorted(self.latencies[journey])
+            errors = self.errors.get(journey, 0)
+            total_requests += len(latencies)
+            total_errors += errors
+            every_latency += latencies
+            lines.append(f"{journey:<18}{self.journeys.get(journey, 0):>7}{len(latencies):>10}"
+                         f"{len(latencies) / elapsed:>9.1f}{errors / len(latencies):>8.1%}"
+                         f"{percentile(latencies, 0.50):>10.1f}{percentile(latencies, 0.95):>10.1f}"
+                         f"{percentile(latencies, 0.99):>10.1f}")
+        every_latency.sort()
+        if total_requests:
+            lines.append(f"{'total':<18}{sum(self.journeys.values()):>7}{total_requests:>10}"
+                         f"{total_requests / elapsed:>9.1f}{total_errors / total_requests:>8.1%}"
+                         f"{percentile(every_latency, 0.50):>10.1f}{percentile(every_latency, 0.95):>10.1f}"
+                         f"{percentile(every_latency, 0.99):>10.1f}")
+        return '\n'.join(lines)
+
+
+def account_for(role, index, accounts_per_role):
+    """Login of the generated dataset (scripts/generate_dataset.py): admin, <role>_<n>"""
+    if role == 'admin':
+        return 'admin@isolab.com'
+    return f"{role}_{index % accounts_per_role + 1}@isolab.com"
+
+
+def run_virtual_user(user, journeys, deadline, stats):
+    if not user.login():
+        return
+    names = [name for name, _, _ in journeys]
+    weights = [weight for _, weight, _ in journeys]
+    functions = {name: function for name, _, function in journeys}
+    while time.monotonic() < deadline:
+        user.journey = user.rng.choices(names, weights)[0]
+        functions[user.journey](user)
+        stats.journey_done(user.journey)
+        user.think()
+
+
+def start_server(args):
+    """Start gunicorn on the chosen storage backend and wait until it answers"""
+    port = args.base_url.rsplit(':', 1)[-1].strip('/')
+    env = dict(os.environ, STORAGE_BACKEND=args.backend, LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.workers), '--threads', str(args.threads), '--timeout', '120', 'app:app']
+    server = subprocess.Popen(command, cwd=ROOT_DIR, env=env)
+    for _ in range(120):
+        try:
+            requests.get(args.base_url + '/users/current', timeout=1)
+            return server
+        except requests.RequestException:
+            if server.poll() is not None:
+                raise SystemExit(f"gunicorn exited with status {server.returncode}")
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit('gunicorn did not start within 60 seconds')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run after ramp-up starts')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users are started')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Mean seconds between page actions (0 for none)')
+    parser.add_argument('--accounts-per-role', type=int, default=3,
+                        help='Generated <role>_<n> accounts to spread users over')
+    parser.add_argument('--password', default='isolab123')
+    parser.add_argument('--roles', help='Comma-separated roles to simulate (default: all, weighted)')
+    parser.add_argument('--read-only', action='store_true', help='Skip journeys that validate stages')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--start-server', action='store_true', help='Start gunicorn for the duration of the test')
+    parser.add_argument('--backend', choices=['memory', 'sqlite', 'firestore'], default='memory',
+                        help='STORAGE_BACKEND for --start-server')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    roles = args.roles.split(',') if args.roles else list(ROLE_WEIGHTS)
+    rng = random.Random(args.seed)
+    server = start_server(args) if args.start_server else None
+
+    stats = LoadStats()
+    threads = []
+    started = time.monotonic()
+    deadline = started + args.duration
+    try:
+        for index in range(args.users):
+            role = rng.choices(roles, [ROLE_WEIGHTS[role] for role in roles])[0]
+            journeys = [journey for journey in JOURNEYS[role]
+                        if not (args.read_only and journey[0] in WRITE_JOURNEYS)]
+            user = VirtualUser(args.base_url, role, account_for(role, index, args.accounts_per_role),
+                               args.password, args.think_time, stats, random.Random(rng.random()))
+            thread = threading.Thread(target=run_virtual_user, args=(user, journeys, deadline, stats), daemon=True)
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp_up / max(args.users, 1))
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print('Interrupted, reporting partial results')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    elapsed = time.monotonic() - started
+    print(f"{args.users} users, {elapsed:.0f}s, think time {args.think_time}s")
+    print(stats.report(elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Replay recorded request traces (TRACE_LOG_PATH) against a local instance
+Usage: python scripts/replay_traces.py traces.log --base-url http://127.0.0.1:8080 --speed 2
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from blueprints.request_traces import PLAIN_VALUES  # noqa: E402
+from load_test import percentile  # noqa: E402
+
+# Rule placeholder, e.g. <machine_id> or <path:filename>
+RULE_ARGUMENT = re.compile(r'<(?:[^:<>]+:)?([^<>]+)>')
+
+# Hashed parameter names and the local collection their values are mapped onto
+ID_PARAMETERS = {'machine_id': 'machines', 'client_id': 'clients', 'user_id': 'users', 'clientId': 'clients'}
+
+# Endpoints that only succeed on a machine assigned to the caller
+TASK_ENDPOINTS = {'stages.validate_machine_stage', 'workflow.update_workflow_stage'}
+
+
+def read_traces(paths, limit=None):
+    """Trace lines from the given files and their rotated backups, oldest first"""
+    files = []
+    for pattern in paths:
+        for path in glob.glob(pattern):
+            # RotatingFileHandler keeps older traces in .1, .2, ... (highest is oldest)
+            backups = sorted(glob.glob(f'{path}.[0-9]*'), key=lambda name: -int(name.rsplit('.', 1)[1]))
+            files += [name for name in backups + [path] if name not in files]
+
+    traces = []
+    for path in files:
+        with open(path, encoding='utf-8') as trace_file:
+            for line in trace_file:
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    continue
+    traces.sort(key=lambda trace: trace['t'])
+    return traces[:limit] if limit else traces
+
+
+def list_machine_ids(get):
+    """Ids of every machine visible to a session, following the pagination cursors"""
+    ids = []
+    cursor = None
+    while True:
+        page = get('/machines?limit=200' + (f'&cursor={cursor}' if cursor else ''))
+        ids += [machine['id'] for machine in page.get('data', [])]
+        cursor = page.get('next_cursor')
+        if not cursor:
+            return sorted(ids)
+
+
+class LocalData:
+    """Ids of the local instance that hashed ids from the trace are mapped onto"""
+
+    def __init__(self, base_url, admin_email, password):
+        self.http = requests.Session()
+        self.base_url = base_url
+        response = self.http.post(f'{base_url}/login', json={'email': admin_email, 'password': password})
+        response.raise_for_status()
+        self.http.headers['Cookie'] = f"session={response.cookies['session']}"
+
+        self.users = [user for user in self._get('/users/all')['users'] if user.get('is_active', True)]
+        self.ids = {
+            'users': sorted(user['id'] for user in self.users),
+            'clients': sorted(client['id'] for client in self._get('/clients/all')['clients']),
+            'machines': sorted(list_machine_ids(self._get)),
+        }
+
+    def _get(self, path):
+        response = self.http.get(self.base_url + path)
+        response.raise_for_status()
+        return response.json()
+
+    def map_id(self, kind, hashed, session=None):
+        """Same hashed id, same local document, so the trace's skew is preserved.
+        Machines are picked among those the replaying user can see."""
+        ids = self.ids[kind]
+        if kind == 'machines' and session is not None:
+            ids = session.machine_ids or ids
+        return ids[int(hashed, 16) % len(ids)] if ids else hashed
+
+    def map_task(self, hashed, session):
+        """Machine for a stage validation: one of the replaying user's own tasks"""
+        ids = session.task_ids or session.machine_ids or self.ids['machines']
+        return ids[int(hashed, 16) % len(ids)] if ids else hashed
+
+    def account(self, role, hashed_user):
+        """Local login (email) standing in for a traced user"""
+        candidates = sorted((user for user in self.users if user.get('role') == role), key=lambda user: user['id'])
+        if not candidates:
+            return None
+        return candidates[int(hashed_user or '0', 16) % len(candidates)]['email']
+
+
+class ReplaySession:
+    """Logged-in session of one traced user"""
+
+    def __init__(self, base_url, email, password):
+        self.base_url = base_url
+        self.email = email
+        self.password = password
+        self.http = requests.Session()
+        self.cursors = {}
+        self.machine_ids = []
+        self.task_ids = []
+
+    def send(self, method, path, body=None):
+        response = self.http.request(method, self.base_url + path, json=body, timeout=120)
+        # The session cookie is Secure, so requests will not send it back over http by itself
+        cookie = response.cookies.get('session')
+        if cookie:
+            self.http.headers['Cookie'] = f'session={cookie}'
+        return response
+
+    def login(self):
+        return self.send('POST', '/login', {'email': self.email, 'password': self.password})
+
+    def get_json(self, path):
+        response = self.send('GET', path)
+        response.raise_for_status()
+        return response.json()
+
+
+def build_request(trace, data, session):
+    """Path, query string and body of a trace, mapped onto local ids"""
+    view_args = trace.get('v', {})
+
+    def substitute(match):
+        name = match.group(1)
+        value = view_args.get(name, '')
+        if trace['e'] in TASK_ENDPOINTS and name == 'machine_id':
+            return data.map_task(value, session)
+        if name in ID_PARAMETERS and name not in PLAIN_VALUES:
+            return data.map_id(ID_PARAMETERS[name], value, session)
+        return str(value)
+
+    path = RULE_ARGUMENT.sub(substitute, trace['p'])
+    query = []
+    for key, value in trace.get('q', {}).items():
+        if key == 'cursor':
+            cursor = session.cursors.get(trace['e'])
+            if cursor:
+                query.append(f'cursor={cursor}')
+        elif key in PLAIN_VALUES:
+            # Filter values such as "En cours" or ISO datetimes with "+" need escaping
+            query.append(f'{key}={quote(str(value), safe="")}')
+        elif key in ID_PARAMETERS:
+            query.append(f'{key}={data.map_id(ID_PARAMETERS[key], value)}')
+    if query:
+        path += '?' + '&'.join(query)
+
+    body = None
+    if 'b' in trace:
+        body = {key: ('replay' if value is None else value) for key, value in trace['b'].items()}
+    return path, body
+
+
+class ReplayStats:
+    """Replayed vs recorded latency and reads per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.lag = []
+
+    def record(self, trace, status, duration_ms, reads, lag_ms):
+        with self._lock:
+            entry = self.endpoints.setdefault(trace['e'], {
+                'latencies': [], 'original': [], 'errors': 0, 'reads': 0, 'original_reads': 0,
+            })
+            entry['latencies'].append(duration_ms)
+            if trace.get('d') is not None:
+                entry['original'].append(trace['d'])
+            entry['reads'] += reads
+            entry['original_reads'] += (trace.get('f') or [0])[0]
+            if status == 0 or status >= 400:
+                entry['errors'] += 1
+            self.lag.append(lag_ms)
+
+    def report(self, elapsed):
+        lines = [f"{'endpoint':<40}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                 f"{'orig p95':>10}{'reads':>8}{'orig reads':>11}"]
+        total = 0
+        for endpoint, entry in sorted(self.endpoints.items(), key=lambda item: -len(item[1]['latencies'])):
+            latencies = sorted(entry['latencies'])
+            count = len(latencies)
+            total += count
+            lines.append(f"{endpoint:<40}{count:>7}{entry['errors'] / count:>7.1%}"
+                         f"{percentile(latencies, 0.50):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+                         f"{percentile(latencies, 0.99):>9.1f}{percentile(sorted(entry['original']), 0.95):>10.1f}"
+                         f"{entry['reads'] / count:>8.1f}{entry['original_reads'] / count:>11.1f}")
+        lag = sorted(self.lag)
+        lines.append(f"{total} requests in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f}/s), "
+                     f"dispatch lag p95 {percentile(lag, 0.95):.0f}ms")
+        return '\n'.join(lines)
+
+
+def replay_one(trace, data, sessions, stats, scheduled):
+    """Issue one traced request and record its outcome"""
+    session = sessions.get(trace.get('u'))
+    lag_ms = max(0.0, (time.monotonic() - scheduled) * 1000)
+    started = time.perf_counter()
+    try:
+        if trace['e'] == 'login.login':
+            response = session.login()
+        else:
+            path, body = build_request(trace, data, session)
+            response = session.send(trace['m'], path, body)
+        status = response.status_code
+        reads = int(response.headers.get('X-Firestore-Reads', 0))
+        if response.ok and 'q' in trace:
+            try:
+                session.cursors[trace['e']] = response.json().get('next_cursor')
+            except (ValueError, AttributeError):
+                pass
+    except requests.RequestException:
+        status, reads = 0, 0
+    stats.record(trace, status, (time.perf_counter() - started) * 1000, reads, lag_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traces', nargs='+', help='Trace log files (rotated backups are picked up too)')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Rate scale: 1 replays at the recorded rate, 2 twice as fast, 0 as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=32, help='Maximum requests in flight')
+    parser.add_argument('--include-writes', action='store_true', help='Also replay POST/PUT/DELETE requests')
+    parser.add_argument('--limit', type=int, help='Replay only the first N traces')
+    parser.add_argument('--admin-email', default='admin@isolab.com')
+    parser.add_argument('--password', default='isolab123', help='Password of the local accounts')
+    args = parser.parse_args()
+
+    traces = [trace for trace in read_traces(args.traces, args.limit)
+              if args.include_writes or trace['m'] == 'GET' or trace['e'] == 'login.login']
+    traces = [trace for trace in traces if trace.get('u')]
+    if not traces:
+        raise SystemExit('No replayable traces found')
+
+    data = LocalData(args.base_url.rstrip('/'), args.admin_email, args.password)
+    sessions = {}
+    for trace in traces:
+        if trace['u'] not in sessions:
+            email = data.account(trace.get('r'), trace['u'])
+            if email:
+                sessions[trace['u']] = ReplaySession(args.base_url.rstrip('/'), email, args.password)
+    traces = [trace for trace in traces if trace['u'] in sessions]
+
+    users = {}
+    for trace in traces:
+        users[(trace['u'], trace.get('r'))] = users.get((trace['u'], trace.get('r')), 0) + 1
+    print(f"Replaying {len(traces)} requests from {len(sessions)} users at speed {args.speed or 'max'}")
+    for (user, role), count in sorted(users.items(), key=lambda item: -item[1])[:5]:
+        print(f"  {user} ({role}): {count} requests")
+
+    for session in sessions.values():
+        session.login()
+        session.machine_ids = list_machine_ids(session.get_json)
+        session.task_ids = sorted(task['machine_id'] for task in session.get_json('/stages/my-tasks')['tasks'])
+
+    stats = ReplayStats()
+    first = traces[0]['t']
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for trace in traces:
+            scheduled = started + ((trace['t'] - first) / args.speed if args.speed else 0)
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(replay_one, trace, data, sessions, stats, scheduled)
+    print(stats.report(time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    main()
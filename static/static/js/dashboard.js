@@ -3,37 +3,16 @@ window.API_BASE_URL = API_BASE_URL;
 
 // Role-Based Dashboard functionality
 document.addEventListener('DOMContentLoaded', function() {
-    // Check authentication and load user data
-    checkAuthentication();
-    
     // Initialize dashboard components
     initializeDashboard();
     
-    // Load dashboard data
+    // Check authentication, load user data and dashboard data in one request
     loadDashboardData();
+    
+    // Keep the task list current without reloading the page
+    subscribeToDashboardEvents();
 });
 
-function checkAuthentication() {
-    fetch(`${API_BASE_URL}/users/current`, { 
-        credentials: 'include',
-        headers: {
-            'Content-Type': 'application/json'
-        }
-    })
-        .then(res => res.json())
-        .then(data => {
-            if (data.error) {
-                window.location.href = '/login';
-            } else {
-                displayUserInfo(data);
-                // Navigation configuration is handled by sidebar-nav.js
-            }
-        })
-        .catch(() => {
-            window.location.href = '/login';
-        });
-}
-
 function displayUserInfo(user) {
     const userInfo = document.getElementById('userInfo');
     const fullName = `${user.first_name || ''} ${user.last_name || ''}`.trim() || user.username;
@@ -54,53 +33,96 @@ function getRoleDisplayName(role) {
 }
 
 async function loadDashboardData() {
+    let data;
+    
     try {
         showLoading();
         
-        // Load role-based dashboard data
-        await Promise.all([
-            loadDashboardStats(),
-            loadMyTasks(),
-            loadRecentActivities()
-        ]);
+        // Load every dashboard section in a single request
+        const response = await fetch(`${API_BASE_URL}/dashboard/bootstrap`, {
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' }
+        });
+        
+        if (response.status === 401 || response.status === 404) {
+            window.location.href = '/login';
+            return;
+        }
+        
+        data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Failed to load dashboard');
+        }
         
     } catch (error) {
         console.error('Error loading dashboard data:', error);
         showErrorMessage('Erreur lors du chargement des données');
+        displayDashboardStats({});
+        displayMyTasks([]);
+        displayRecentActivities([]);
+        return;
     } finally {
         hideLoading();
     }
+    
+    // Navigation configuration is handled by sidebar-nav.js
+    displayUserInfo(data.user);
+    displayDashboardStats(data);
+    displayMyTasks(data.tasks || []);
+    displayRecentActivities(data.activities || []);
 }
 
-async function loadDashboardStats() {
+// Live updates: the server streams changes to the machines this user works on
+let dashboardRefreshTimer = null;
+
+function subscribeToDashboardEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    
+    const events = new EventSource(`${API_BASE_URL}/events/stream`, { withCredentials: true });
+    events.onmessage = function() {
+        // Coalesce a burst of events into a single refresh
+        clearTimeout(dashboardRefreshTimer);
+        dashboardRefreshTimer = setTimeout(refreshMyTasks, 500);
+    };
+}
+
+// Reload only the task counters and the task list
+async function refreshMyTasks() {
     try {
-        // Load stats from multiple endpoints
-        const [stagesResponse, machinesResponse, clientsResponse] = await Promise.all([
-            fetch(`${API_BASE_URL}/stages/dashboard`, { 
-                credentials: 'include',
-                headers: { 'Content-Type': 'application/json' }
-            }),
-            fetch(`${API_BASE_URL}/machines`, { 
-                credentials: 'include',
-                headers: { 'Content-Type': 'application/json' }
-            }),
-            fetch(`${API_BASE_URL}/clients/all`, { 
-                credentials: 'include',
-                headers: { 'Content-Type': 'application/json' }
-            })
-        ]);
+        const response = await fetch(`${API_BASE_URL}/dashboard/bootstrap?sections=dashboard,tasks`, {
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' }
+        });
+        if (!response.ok) {
+            return;
+        }
         
+        const data = await response.json();
+        if (data.dashboard) {
+            document.getElementById('myPendingTasks').textContent = data.dashboard.my_pending_tasks || 0;
+            document.getElementById('myCompletedTasks').textContent = data.dashboard.my_completed_tasks || 0;
+        }
+        displayMyTasks(data.tasks || []);
+        
+    } catch (error) {
+        console.error('Error refreshing tasks:', error);
+    }
+}
+
+function displayDashboardStats(data) {
+    try {
         // Process stages data (user tasks)
-        if (stagesResponse.ok) {
-            const stagesData = await stagesResponse.json();
+        if (data.dashboard) {
+            const stagesData = data.dashboard;
             document.getElementById('myPendingTasks').textContent = stagesData.my_pending_tasks || 0;
             document.getElementById('myCompletedTasks').textContent = stagesData.my_completed_tasks || 0;
         }
         
         // Process machines data
-        if (machinesResponse.ok) {
-            const machinesData = await machinesResponse.json();
-            const machines = machinesData.data || [];
+        if (data.machines) {
+            const machines = data.machines.data || [];
             
             // Count active machines (not in maintenance or problems)
             const activeMachines = machines.filter(machine => {
@@ -119,12 +141,9 @@ async function loadDashboardStats() {
             document.getElementById('maintenanceMachines').textContent = maintenanceMachines.length;
         }
         
-        // Process clients data
-        if (clientsResponse.ok) {
-            const clientsData = await clientsResponse.json();
-            const clients = clientsData.clients || [];
-            document.getElementById('totalClients').textContent = clients.length;
-        }
+        // Process clients data (admin only)
+        const clients = data.clients || [];
+        document.getElementById('totalClients').textContent = clients.length;
         
     } catch (error) {
         console.error('Error loading dashboard stats:', error);
@@ -138,46 +157,6 @@ async function loadDashboardStats() {
     }
 }
 
-async function loadMyTasks() {
-    try {
-        const response = await fetch(`${API_BASE_URL}/stages/my-tasks`, {
-            credentials: 'include',
-            headers: { 'Content-Type': 'application/json' }
-        });
-        
-        if (!response.ok) {
-            throw new Error('Failed to load tasks');
-        }
-        
-        const data = await response.json();
-        displayMyTasks(data.tasks || []);
-        
-    } catch (error) {
-        console.error('Error loading tasks:', error);
-        displayMyTasks([]);
-    }
-}
-
-async function loadRecentActivities() {
-    try {
-        const response = await fetch(`${API_BASE_URL}/stages/recent-activities`, {
-            credentials: 'include',
-            headers: { 'Content-Type': 'application/json' }
-        });
-        
-        if (!response.ok) {
-            throw new Error('Failed to load recent activities');
-        }
-        
-        const data = await response.json();
-        displayRecentActivities(data.activities || []);
-        
-    } catch (error) {
-        console.error('Error loading recent activities:', error);
-        displayRecentActivities([]);
-    }
-}
-
 function displayMyTasks(tasks) {
     const container = document.getElementById('myTasksContainer');
     
@@ -3,6 +3,13 @@
 window.API_BASE_URL = window.API_BASE_URL || 'https://my-service-83716313182.europe-central2.run.app';
 let selectedClient = null;
 
+// Machines are listed page by page; the server returns a cursor for the next page
+const MACHINES_PAGE_SIZE = 50;
+let machinesNextCursor = null;
+
+// Logged-in user (id, role, stage_access), used to drop machines that leave their view
+let currentUser = null;
+
 document.addEventListener('DOMContentLoaded', function() {
     console.log('DOM Content Loaded - voir-machines.js script starting');
     
@@ -21,6 +28,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Check if there's a machine parameter in the URL
     checkMachineParameter();
     
+    // Patch the list from the server's change events instead of reloading it
+    subscribeToMachineEvents();
+    
     console.log('All initialization complete');
 });
 
@@ -50,7 +60,9 @@ function checkAuthentication() {
         .then(data => {
             if (data.error) {
                 window.location.href = '/login';
+                return;
             }
+            currentUser = data;
         })
         .catch(() => {
             window.location.href = '/login';
@@ -66,25 +78,47 @@ function initializeMachineSearch() {
     });
 }
 
-// Load all machines
+// Fetch one page of machines
+async function fetchMachinesPage(cursor) {
+    const params = new URLSearchParams({ limit: MACHINES_PAGE_SIZE });
+    
+    // Exact-match filters are applied by the server
+    const statusFilter = document.getElementById('statusFilter').value;
+    if (statusFilter) {
+        params.set('status', statusFilter);
+    }
+    const typeFilter = document.getElementById('typeFilter').value;
+    if (typeFilter) {
+        params.set('machineType', typeFilter);
+    }
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    
+    const response = await fetch(`${API_BASE_URL}/machines?${params.toString()}`, { 
+        credentials: 'include',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    });
+    if (!response.ok) {
+        throw new Error('Erreur lors du chargement des machines');
+    }
+    
+    return response.json();
+}
+
+// Load first page of machines
 async function loadAllMachines() {
     showLoadingState();
     
     try {
-        const response = await fetch(`${API_BASE_URL}/machines`, { 
-            credentials: 'include',
-            headers: {
-                'Content-Type': 'application/json'
-            }
-        });
-        if (!response.ok) {
-            throw new Error('Erreur lors du chargement des machines');
-        }
-        
-        const result = await response.json();
+        const result = await fetchMachinesPage(null);
         const machines = result.data || [];
         
+        machinesNextCursor = result.next_cursor || null;
         displayMachinesList(machines);
+        updateLoadMoreButton();
         
     } catch (error) {
         console.error('Error loading machines:', error);
@@ -92,6 +126,41 @@ async function loadAllMachines() {
     }
 }
 
+// Append the next page of machines to the list
+async function loadMoreMachines() {
+    if (!machinesNextCursor) {
+        return;
+    }
+    
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    loadMoreBtn.disabled = true;
+    
+    try {
+        const result = await fetchMachinesPage(machinesNextCursor);
+        const machinesGrid = document.getElementById('machinesGrid');
+        
+        (result.data || []).forEach(machine => {
+            machinesGrid.appendChild(createMachineCard(machine));
+        });
+        
+        machinesNextCursor = result.next_cursor || null;
+        
+    } catch (error) {
+        console.error('Error loading more machines:', error);
+    } finally {
+        loadMoreBtn.disabled = false;
+        updateLoadMoreButton();
+    }
+}
+
+// Show the "load more" button only while another page exists
+function updateLoadMoreButton() {
+    const container = document.getElementById('loadMoreContainer');
+    if (container) {
+        container.style.display = machinesNextCursor ? 'block' : 'none';
+    }
+}
+
 // Display machines list
 function displayMachinesList(machines) {
     const machinesGrid = document.getElementById('machinesGrid');
@@ -131,6 +200,8 @@ function displayMachinesList(machines) {
 function createMachineCard(machine) {
     const card = document.createElement('div');
     card.className = 'machine-card';
+    card.dataset.machineId = machine.id;
+    card.machine = machine;
     
     const statusClass = getStatusClass(machine.status);
     
@@ -159,6 +230,42 @@ function createMachineCard(machine) {
     return card;
 }
 
+// Live updates: events carry the list fields of the changed machine
+function subscribeToMachineEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    
+    const events = new EventSource(`${API_BASE_URL}/events/stream`, { withCredentials: true });
+    events.onmessage = function(message) {
+        const event = JSON.parse(message.data);
+        const card = document.querySelector(`.machine-card[data-machine-id="${event.machine_id}"]`);
+        
+        if (event.type === 'machine_deleted') {
+            if (card) {
+                card.remove();
+            }
+            return;
+        }
+        
+        const machine = Object.assign({}, card ? card.machine : {}, event, { id: event.machine_id });
+        if (!matchesListFilters(machine) || !isVisibleToCurrentUser(event)) {
+            if (card) {
+                card.remove();
+            }
+            return;
+        }
+        
+        if (card) {
+            card.replaceWith(createMachineCard(machine));
+        } else if (event.type === 'machine_created') {
+            const machinesGrid = document.getElementById('machinesGrid');
+            machinesGrid.querySelector('.no-machines')?.remove();
+            machinesGrid.prepend(createMachineCard(machine));
+        }
+    };
+}
+
 // View machine details
 function viewMachineDetails(machineId) {
     // Find the machine in the current data
@@ -607,30 +714,26 @@ function showAllMachines() {
     loadAllMachines();
 }
 
-// Filter machines
-function filterMachines() {
-    const typeFilter = document.getElementById('typeFilter').value.toLowerCase();
-    const statusFilter = document.getElementById('statusFilter').value.toLowerCase();
-    
-    // Get all machine cards
-    const machineCards = document.querySelectorAll('.machine-card');
-    
-    machineCards.forEach(card => {
-        const type = card.querySelector('.machine-card-info p:first-child').textContent.toLowerCase();
-        const status = card.querySelector('.machine-card-status').textContent.toLowerCase();
-        
-        let showCard = true;
-        
-        if (typeFilter && !type.includes(typeFilter)) {
-            showCard = false;
-        }
-        
-        if (statusFilter && !status.includes(statusFilter)) {
-            showCard = false;
-        }
-        
-        card.style.display = showCard ? 'block' : 'none';
-    });
+// Same rule as the server's list: admins see everything, others the machines of
+// their stage and those assigned to them. Events omit fields that are empty, so
+// the event itself (not the merged card data) tells the machine's new state.
+function isVisibleToCurrentUser(event) {
+    if (!currentUser || currentUser.role === 'admin') {
+        return true;
+    }
+    if (event.assigned_user_id === currentUser.id) {
+        return true;
+    }
+    const stageAccess = currentUser.stage_access;
+    return Boolean(stageAccess) && stageAccess !== 'all' && event.current_stage === stageAccess;
+}
+
+// Whether a machine passes the filters the server applied to the list
+function matchesListFilters(machine) {
+    const statusFilter = document.getElementById('statusFilter').value;
+    const typeFilter = document.getElementById('typeFilter').value;
+    return (!statusFilter || machine.status === statusFilter) &&
+        (!typeFilter || machine.machineType === typeFilter);
 }
 
 // Machine search functionality
@@ -672,7 +775,9 @@ async function searchMachine() {
         });
         
         if (filteredMachines.length > 0) {
+            machinesNextCursor = null;
             displayMachinesList(filteredMachines);
+            updateLoadMoreButton();
         } else {
             document.getElementById('machinesList').style.display = 'none';
             document.getElementById('noResults').style.display = 'block';